@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Microbenchmark of Accession2TaxidParser
+
+Compares the throughput of decompressing an accession2taxid file alone
+    (with the standard gzip module and with the selected backend), parsing
+    it line by line (as taxadb <= 0.12 did) and parsing it with
+    `Accession2TaxidParser.accession2taxid`. A synthetic file is generated
+    unless one is given.
+
+Usage:
+    python benchmarks/accession2taxid.py [--lines N] [--file FILE]
+        [--decompress BACKEND] [--workers N]
+"""
+
+import os
+import sys
+import gzip
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from taxadb.decompress import Decompressor  # noqa: E402
+from taxadb.parser import Accession2TaxidParser  # noqa: E402
+from taxadb.schema import Taxa  # noqa: E402
+from taxadb.taxadb import TaxaDB  # noqa: E402
+from taxadb.util import chunked  # noqa: E402
+
+TAXIDS = 100000
+
+
+def generate(path, lines):
+    """Write a synthetic accession2taxid file"""
+    rng = random.Random(0)
+    with gzip.open(path, 'wt', compresslevel=6) as f:
+        f.write('accession\taccession.version\ttaxid\tgi\n')
+        for i in range(lines):
+            accession = 'XP_%09d' % i
+            # 1% of accessions are mapped to a taxid missing from table Taxa
+            taxid = rng.randint(1, TAXIDS * 101 // 100)
+            f.write('%s\t%s.1\t%d\t%d\n' % (accession, accession, taxid, i))
+
+
+def decompress(path, backend='gzip'):
+    """Read the file, without parsing it"""
+    total = 0
+    with Decompressor(backend).open(path) as f:
+        for block in iter(lambda: f.read(Accession2TaxidParser.BLOCK_SIZE),
+                          b''):
+            total += len(block)
+    return total
+
+
+def legacy(path):
+    """Parse the file line by line, one dictionary per row"""
+    taxids = dict((str(taxid), True) for taxid in range(1, TAXIDS + 1))
+    rows = 0
+    with gzip.open(path, 'rb') as f:
+        f.readline()
+        for line in f:
+            line_list = line.decode().rstrip('\n').split('\t')
+            if line_list[2] not in taxids:
+                continue
+            {'accession': line_list[0], 'taxid': line_list[2]}
+            rows += 1
+    return rows
+
+
+def blocks(path, backend='auto', workers=1):
+    """Parse the file with Accession2TaxidParser"""
+    parser = Accession2TaxidParser(fast=True, chunk=100000,
+                                   decompress=backend, workers=workers)
+    return sum(len(chunk) for chunk in parser.accession2taxid(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=2000000,
+                        help='Lines of the synthetic file. Default 2000000')
+    parser.add_argument('--file', help='accession2taxid file (gzipped)')
+    parser.add_argument('--decompress', default='auto',
+                        help='Decompression backend. Default auto')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Parsing processes. Default 1')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    path = args.file
+    if path is None:
+        path = os.path.join(directory, 'prot.accession2taxid.gz')
+        generate(path, args.lines)
+    db = TaxaDB(dbtype='sqlite', dbname=os.path.join(directory, 'db.sqlite'))
+    db.db.create_tables([Taxa])
+    with db.db.atomic():
+        for chunk in chunked(range(1, TAXIDS + 1), 200):
+            Taxa.insert_many([(taxid, 1, str(taxid), 'species')
+                              for taxid in chunk],
+                             fields=[Taxa.ncbi_taxid, Taxa.parent_taxid,
+                                     Taxa.tax_name,
+                                     Taxa.lineage_level]).execute()
+
+    backend = Decompressor(args.decompress).select(path)
+    size = decompress(path)
+    for name, func in [('gzip only', decompress),
+                       ('%s only' % backend,
+                        lambda path: decompress(path, backend)),
+                       ('line by line', legacy),
+                       ('accession2taxid',
+                        lambda path: blocks(path, backend, args.workers))]:
+        start = time.perf_counter()
+        result = func(path)
+        elapsed = time.perf_counter() - start
+        print('%-16s %8.1f MB/s  %6.2fs  (%d)'
+              % (name, size / elapsed / 1e6, elapsed, result))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,13 @@
-from taxadb.schema import Accession, Taxa
+import threading
+
+from collections import deque
+from itertools import chain, count, islice
+
+from peewee import JOIN, OperationalError
+
+from taxadb.bloom import BloomFilter
+from taxadb.cache import LRUCache
+from taxadb.util import chunked, unique
 from taxadb.taxadb import TaxaDB
 
 
@@ -11,122 +20,398 @@ class AccessionID(TaxaDB):
 
     Args:
         **kwargs: Arbitrary arguments. Supported (username, password, port,
-            hostname, config, dbtype, dbname)
+            hostname, config, dbtype, dbname, in_memory, cte,
+            bulk_threshold, cache_size, bloom) and the database settings of
+            `taxadb.taxadb.TaxaDB`
 
     Raises:
         SystemExit: If table `accession` does not exist
+
+    Attributes:
+        BULK_THRESHOLD (:obj:`int`): Default number of requested accessions
+            from which they are loaded in a temporary table and joined in a
+            single statement, instead of being requested `MAX_LIST` at a
+            time. Set with `bulk_threshold`. Not used with a read-only
+            database, which can't hold a temporary table
+        bloom (:obj:`taxadb.bloom.BloomFilter`): Bloom filter of the
+            accessions of the database, loaded from the file set with
+            `bloom` (built by `taxadb create --bloom`). Accessions absent
+            from the filter are reported missing without querying the
+            database. None if `bloom` is not set
     """
 
+    BULK_THRESHOLD = 20000
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.check_table_exists(Accession)
+        self.check_table_exists(self.Accession)
+        self.bulk_threshold = self.getint(
+            'bulk_threshold', fallback=AccessionID.BULK_THRESHOLD)
+        self._batches = count()
+        # Temporary tables are private to a connection, and connections
+        # to a thread
+        self._leftovers = threading.local()
+        self.bloom = None
+        if self.get('bloom'):
+            self.bloom = BloomFilter.load(self.get('bloom'))
+            self.logger.debug(
+                "Loaded Bloom filter of %d accessions (false positive rate "
+                "%.4g)" % (len(self.bloom), self.bloom.false_positive_rate()))
 
     def taxid(self, acc_number_list):
         """Get taxonomy of accession ids
 
-        Given a list of accession numbers, yield the accession number and their
-        associated taxids as tuples
+        Given an iterable of accession numbers, yield the accession number and
+        their associated taxids as tuples. Accession numbers are requested
+        `MAX_LIST` at a time and results are yielded chunk by chunk.
 
         Args:
-            acc_number_list (:obj:`list`): a list of accession numbers
+            acc_number_list (:obj:`iterable`): accession numbers, e.g. a list
+                or a generator
 
         Yields:
             tuple: (accession id, taxonomy id)
 
         """
-        self.check_list_ids(acc_number_list)
-        with self.db.atomic():
-            query = Accession.select().where(
-                Accession.accession << acc_number_list)
-            for i in query:
-                yield (i.accession, i.taxid.ncbi_taxid)
-            # TODO: List accession ID not found?
-            # for noid in notfound:
-            #     self._unmapped_taxid(noid)
+        rows = self._cached_lookup('taxid', acc_number_list, self._lookup)
+        for accession, ncbi_taxid, _ in rows:
+            yield (accession, ncbi_taxid)
 
     def sci_name(self, acc_number_list):
         """Get taxonomic scientific name for accession ids
 
-        Given a list of accession numbers, yield the accession number and their
-        associated scientific name as tuples
+        Given an iterable of accession numbers, yield the accession number and
+        their associated scientific name as tuples
 
         Args:
-            acc_number_list (:obj:`list`): a list of accession numbers
+            acc_number_list (:obj:`iterable`): accession numbers, e.g. a list
+                or a generator
 
         Yields:
             tuple: (accession id, taxonomy id)
 
         """
-        self.check_list_ids(acc_number_list)
-        with self.db.atomic():
-            query = Accession.select().where(
-                Accession.accession << acc_number_list)
-            for i in query:
-                yield (i.accession, i.taxid.tax_name)
-            # TODO: List accession ID not found?
-            # for noid in notfound:
-            #     self._unmapped_taxid(noid)
+        rows = self._cached_lookup('sci_name', acc_number_list, self._lookup)
+        for accession, _, name in rows:
+            yield (accession, name)
 
     def lineage_id(self, acc_number_list):
         """Get taxonomic lineage name for accession ids
 
-        Given a list of accession numbers, yield the accession number and their
-            associated lineage (in the form of taxids) as tuples
+        Given an iterable of accession numbers, yield the accession number and
+            their associated lineage (in the form of taxids) as tuples
 
         Args:
-            acc_number_list (:obj:`list`): a list of accession numbers
+            acc_number_list (:obj:`iterable`): accession numbers, e.g. a list
+                or a generator
 
         Yields:
             tuple: (accession id, lineage list)
 
         """
-        self.check_list_ids(acc_number_list)
-        with self.db.atomic():
-            query = Accession.select().where(
-                Accession.accession << acc_number_list)
-            for i in query:
-                lineage_list = []
-                current_lineage = i.taxid.tax_name
-                current_lineage_id = i.taxid.ncbi_taxid
-                parent = i.taxid.parent_taxid
-                while current_lineage != 'root':
-                    lineage_list.append(current_lineage_id)
-                    new_query = Taxa.get(Taxa.ncbi_taxid == parent)
-                    current_lineage = new_query.tax_name
-                    current_lineage_id = new_query.ncbi_taxid
-                    parent = new_query.parent_taxid
-                yield (i.accession, lineage_list)
-            # TODO: List accession ID not found?
-            # for noid in notfound:
-            #     self._unmapped_taxid(noid)
+        rows = self._cached_lookup('lineage_id', acc_number_list,
+                                   self._lookup_lineages)
+        for accession, lineage in rows:
+            if lineage is not None:
+                lineage = [ncbi_taxid for ncbi_taxid, _, _ in lineage]
+            yield (accession, lineage)
 
     def lineage_name(self, acc_number_list):
         """Get a lineage name for accession ids
 
-        Given a list of acession numbers, yield the accession number and their
-            associated lineage as tuples
+        Given an iterable of acession numbers, yield the accession number and
+            their associated lineage as tuples
 
         Args:
-            acc_number_list (:obj:`list`): a list of accession numbers
+            acc_number_list (:obj:`iterable`): accession numbers, e.g. a list
+                or a generator
 
         Yields:
             tuple: (accession id, lineage name)
 
         """
-        self.check_list_ids(acc_number_list)
-        with self.db.atomic():
-            query = Accession.select().where(
-                Accession.accession << acc_number_list)
-            for i in query:
-                lineage_list = []
-                current_lineage = i.taxid.tax_name
-                parent = i.taxid.parent_taxid
-                while current_lineage != 'root':
-                    lineage_list.append(current_lineage)
-                    new_query = Taxa.get(Taxa.ncbi_taxid == parent)
-                    current_lineage = new_query.tax_name
-                    parent = new_query.parent_taxid
-                yield (i.accession, lineage_list)
-            # TODO: List accession ID not found?
-            # for noid in notfound:
-            #     self._unmapped_taxid(noid)
+        rows = self._cached_lookup('lineage_name', acc_number_list,
+                                   self._lookup_lineages)
+        for accession, lineage in rows:
+            if lineage is not None:
+                lineage = [name for _, name, _ in lineage]
+            yield (accession, lineage)
+
+    def in_clade(self, taxid):
+        """Get all accessions mapped to a clade
+
+        Given a taxid, yield all accession numbers mapped to it or to one of
+            its descendants. Rows are streamed (see `taxadb.util.stream`),
+            so that large clades can be iterated in bounded memory.
+
+        Args:
+            taxid (:obj:`int`): a taxid
+
+        Yields:
+            tuple: (accession id, taxonomy id)
+
+        """
+        if self.tree is None and self.materialized:
+            try:
+                clade = self.Lineage.get(self.Lineage.ncbi_taxid == taxid)
+            except self.Lineage.DoesNotExist:
+                return
+            query = self.Accession.select(
+                self.Accession.accession, self.Accession.taxid).join(
+                self.Lineage,
+                on=(self.Accession.taxid == self.Lineage.ncbi_taxid)).where(
+                self.Lineage.lft >= clade.lft,
+                self.Lineage.lft <= clade.rgt).tuples()
+            for row in self._stream(query):
+                yield row
+            return
+        clade = chain([taxid], self._descendants(taxid))
+        for chunk in chunked(clade, TaxaDB.MAX_LIST):
+            query = self.Accession.select(
+                self.Accession.accession, self.Accession.taxid).where(
+                self.Accession.taxid << chunk).tuples()
+            for row in self._stream(query):
+                yield row
+
+    def _cached_lookup(self, namespace, acc_number_list, lookup):
+        """Request accessions not found in cache
+
+        Accessions found in cache are yielded as they come, the others are
+            passed on to `lookup` and their results cached. Accessions not
+            found in the database are not cached. Repeated accessions are
+            requested and yielded once, whatever the cache and the lookup
+            path.
+
+        Args:
+            namespace (:obj:`str`): Cache namespace, the name of the cached
+                method
+            acc_number_list (:obj:`iterable`): accession numbers
+            lookup (:obj:`callable`): Method requesting accessions, yielding
+                tuples starting with the accession (e.g. `_lookup`)
+
+        Yields:
+            tuple: rows of `lookup`
+
+        """
+        acc_number_list = unique(acc_number_list)
+        if self.cache is None:
+            for row in lookup(acc_number_list):
+                yield row
+            return
+        hits = deque()
+
+        def misses():
+            for accession in acc_number_list:
+                value = self.cache.get(namespace, accession)
+                if value is LRUCache.MISSING:
+                    yield accession
+                else:
+                    hits.append((accession,) + value)
+
+        for row in lookup(misses()):
+            while hits:
+                yield hits.popleft()
+            self.cache.put(namespace, row[0], row[1:])
+            yield row
+        while hits:
+            yield hits.popleft()
+
+    def _lookup(self, acc_number_list):
+        """Request accessions
+
+        Up to `bulk_threshold` accessions are requested `MAX_LIST` at a time
+            (see `_lookup_chunks`). Larger batches are loaded in a temporary
+            table and joined in a single statement (see `_lookup_bulk`),
+            unless the database is read-only.
+            Accessions absent from the Bloom filter, if any, are not
+            requested.
+            Accessions not found are logged one by one at DEBUG level, and
+            counted in a single warning once the lookup is over. Input
+            accessions are expected distinct (see `_cached_lookup`), so
+            that a missing accession is counted once whatever the path.
+
+        Args:
+            acc_number_list (:obj:`iterable`): accession numbers
+
+        Yields:
+            tuple: (accession id, taxonomy id, scientific name)
+
+        """
+        missing = 0
+
+        def unmapped(accession):
+            nonlocal missing
+            missing += 1
+            self.logger.debug("No taxid mapped for accession %s" % accession)
+
+        try:
+            accessions = iter(acc_number_list)
+            if self.bloom is not None:
+                accessions = self._filter(accessions, unmapped)
+            if self.read_only:
+                rows = self._lookup_chunks(accessions, unmapped)
+            else:
+                batch = list(islice(accessions, self.bulk_threshold))
+                if len(batch) < self.bulk_threshold:
+                    rows = self._lookup_chunks(batch, unmapped)
+                else:
+                    rows = self._lookup_bulk(chain(batch, accessions),
+                                             unmapped)
+            for row in rows:
+                yield row
+        finally:
+            if missing:
+                self.logger.warning("No taxid mapped for %d accession(s)"
+                                    % missing)
+
+    def _lookup_lineages(self, acc_number_list):
+        """Request accessions and the lineages of their taxids
+
+        Rows of `_lookup` are processed `MAX_LIST` at a time. The distinct
+            taxids of a chunk are resolved together with `_lineages`, and
+            lineages and ancestors already resolved for a previous chunk are
+            reused, so that each taxid is requested once per call.
+
+        Args:
+            acc_number_list (:obj:`iterable`): accession numbers
+
+        Yields:
+            tuple: (accession id, lineage), see `TaxaDB._lineage`
+
+        """
+        lineages = {}
+        nodes = {}
+        for chunk in chunked(self._lookup(acc_number_list), TaxaDB.MAX_LIST):
+            taxids = set(row[1] for row in chunk) - lineages.keys()
+            if taxids:
+                lineages.update(self._lineages(taxids, nodes=nodes))
+            for accession, ncbi_taxid, _ in chunk:
+                yield (accession, lineages[ncbi_taxid])
+
+    def _filter(self, acc_number_list, unmapped):
+        """Drop accessions absent from the Bloom filter
+
+        Args:
+            acc_number_list (:obj:`iterable`): accession numbers
+            unmapped (:obj:`callable`): called with each dropped accession
+
+        Yields:
+            str: accessions possibly in the database
+        """
+        for accession in acc_number_list:
+            if accession in self.bloom:
+                yield accession
+            else:
+                unmapped(accession)
+
+    def _lookup_chunks(self, acc_number_list, unmapped):
+        """Request accessions, `MAX_LIST` at a time
+
+        The input is consumed lazily, one chunk at a time. Accessions of a
+            chunk not found in the database are passed to `unmapped` once
+            the chunk is processed.
+
+        Args:
+            acc_number_list (:obj:`iterable`): accession numbers
+            unmapped (:obj:`callable`): called with each accession not found
+
+        Yields:
+            tuple: (accession id, taxonomy id, scientific name)
+
+        """
+        for chunk in chunked(acc_number_list, TaxaDB.MAX_LIST):
+            query = self.Accession.select(
+                self.Accession.accession, self.Taxa.ncbi_taxid,
+                self.Taxa.tax_name).join(
+                self.Taxa,
+                on=(self.Accession.taxid == self.Taxa.ncbi_taxid)).where(
+                self.Accession.accession << chunk).tuples()
+            with self.database.atomic():
+                rows = list(query)
+            found = set()
+            for row in rows:
+                found.add(row[0])
+                yield row
+            for noid in set(chunk) - found:
+                unmapped(noid)
+
+    def _batch_model(self):
+        """Get a temporary table private to a bulk lookup
+
+        Returns:
+            :obj:`pw.Model`: copy of `AccessionBatch` with a table name
+                unique to this instance, so that bulk lookups iterated side
+                by side don't share their input
+        """
+        table_name = '%s_%d' % (self.AccessionBatch.get_table_name(),
+                                next(self._batches))
+        meta = type('Meta', (object,), {'table_name': table_name})
+        return type('AccessionBatch', (self.AccessionBatch,), {
+            'Meta': meta, '__module__': self.AccessionBatch.__module__})
+
+    def _lookup_bulk(self, acc_number_list, unmapped):
+        """Request accessions through a temporary table
+
+        All accessions, expected distinct, are bulk inserted in a temporary
+            table (see `_batch_model`), then joined against tables
+            Accession and Taxa in a single statement, whose rows are
+            streamed (buffered by the driver with MySQL, as the table is
+            private to the connection). Accessions not found in the database
+            are passed to `unmapped` as they come. The temporary table is
+            dropped once the lookup is over (see `_drop_batches`).
+
+        Args:
+            acc_number_list (:obj:`iterable`): accession numbers
+            unmapped (:obj:`callable`): called with each accession not found
+
+        Yields:
+            tuple: (accession id, taxonomy id, scientific name)
+
+        """
+        batch = self._batch_model()
+        self.database.create_tables([batch])
+        query = rows = None
+        try:
+            with self.database.atomic():
+                for chunk in chunked(acc_number_list, TaxaDB.MAX_LIST):
+                    batch.insert_many(
+                        [(acc,) for acc in chunk],
+                        fields=[batch.accession]).execute()
+            query = batch.select(
+                batch.accession, self.Taxa.ncbi_taxid,
+                self.Taxa.tax_name).join(
+                self.Accession, JOIN.LEFT_OUTER,
+                on=(batch.accession == self.Accession.accession)).join(
+                self.Taxa, JOIN.LEFT_OUTER,
+                on=(self.Accession.taxid == self.Taxa.ncbi_taxid)).tuples()
+            rows = self._stream(query, private=True)
+            for row in rows:
+                if row[1] is None:
+                    unmapped(row[0])
+                else:
+                    yield row
+        finally:
+            # Release the cursor reading the temporary table first, as it
+            # can't be dropped while read (e.g. when the consumer stops
+            # early)
+            del query, rows
+            self._drop_batches(batch)
+
+    def _drop_batches(self, batch):
+        """Drop the temporary table of a bulk lookup that is over
+
+        SQLite can't drop a table while another lookup of the connection is
+            still reading. Tables that can't be dropped yet are emptied, and
+            dropped by a later call in the same thread.
+
+        Args:
+            batch (:obj:`pw.Model`): temporary table, see `_batch_model`
+        """
+        leftovers = []
+        for table in getattr(self._leftovers, 'batches', []) + [batch]:
+            try:
+                self.database.drop_tables([table])
+            except OperationalError:
+                table.delete().execute()
+                leftovers.append(table)
+        self._leftovers.batches = leftovers
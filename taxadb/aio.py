@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Asyncio counterparts of the query classes
+
+Requires Python >= 3.6 (asynchronous generators). Not imported by the
+    rest of the package, so that older interpreters can still use taxadb.
+"""
+
+import sys
+import asyncio
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+
+from playhouse.pool import PooledDatabase
+
+from taxadb.accessionid import AccessionID
+from taxadb.names import SciName
+from taxadb.taxadb import TaxaDB
+from taxadb.taxid import TaxID
+
+
+class AsyncTaxaDB(object):
+
+    """Run the queries of a TaxaDB class without blocking the event loop
+
+    Parent class of the asyncio query classes. Each instance wraps a
+        blocking query object built from the same arguments, whose methods
+        are run on worker threads:
+
+    - methods returning a value are coroutines, run on a pool of
+      `concurrency` threads shared by the instance;
+    - methods yielding results are asynchronous generators. The blocking
+      generator is advanced `MAX_LIST` results at a time, on a thread
+      dedicated to the iteration, as its queries may rely on the state of
+      its database connection (e.g. the temporary table of a bulk
+      accession lookup).
+
+    At most `concurrency` batches (a coroutine, or a step of a generator)
+        are in flight at once, other batches wait for a free slot without
+        blocking the loop. A generator holds no slot while its consumer
+        processes a batch, so that consumers can freely await other
+        queries. An instance must be used from a single event loop. With a
+        connection pool (see `pool_size`), each batch checks a connection
+        out of the pool and returns it once done.
+
+    Args:
+        **kwargs: Arguments of the wrapped class, plus `concurrency`
+
+    Attributes:
+        CLASS (:obj:`type`): Wrapped query class
+        CONCURRENCY (:obj:`int`): Default maximum number of batches in
+            flight. Set with `concurrency`
+        sync (:obj:`taxadb.taxadb.TaxaDB`): Wrapped blocking query object
+        concurrency (:obj:`int`): Maximum number of batches in flight
+        executor (:obj:`concurrent.futures.ThreadPoolExecutor`): Threads
+            running the coroutines
+    """
+
+    CLASS = TaxaDB
+    CONCURRENCY = 4
+
+    def __init__(self, **kwargs):
+        self.sync = self.CLASS(**kwargs)
+        self.concurrency = self.sync.getint(
+            'concurrency', fallback=AsyncTaxaDB.CONCURRENCY)
+        if self.concurrency < 1:
+            self.logger.error("Concurrency must be at least 1")
+            sys.exit(1)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self._semaphore = None
+
+    @property
+    def logger(self):
+        component = "{}.{}".format(type(self).__module__, type(self).__name__)
+        return logging.getLogger(component)
+
+    @property
+    def semaphore(self):
+        """:obj:`asyncio.Semaphore`: Free batch slots, created on first use
+        so that it belongs to the running loop"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Shut the worker threads down, once running batches are done"""
+        self.executor.shutdown(wait=False)
+
+    async def _run(self, func, *args, **kwargs):
+        """Run a blocking function on the shared threads
+
+        Args:
+            func (:obj:`callable`): Function to run
+            *args: Arguments passed to `func`
+            **kwargs: Keyword arguments passed to `func`
+
+        Returns:
+            result of `func`
+        """
+        loop = asyncio.get_event_loop()
+        if isinstance(self.sync.database, PooledDatabase):
+            func = partial(self._pooled, func)
+        async with self.semaphore:
+            return await loop.run_in_executor(
+                self.executor, partial(func, *args, **kwargs))
+
+    def _pooled(self, func, *args, **kwargs):
+        """Run a function with a connection checked out of the pool
+
+        The connection is returned to the pool once done, so that threads
+            waiting for work don't hold pooled connections.
+        """
+        with self.sync.database.connection_context():
+            return func(*args, **kwargs)
+
+    async def _iterate(self, func, *args, **kwargs):
+        """Iterate over a blocking generator on a dedicated thread
+
+        Args:
+            func (:obj:`callable`): Generator function
+            *args: Arguments passed to `func`
+            **kwargs: Keyword arguments passed to `func`
+
+        Yields:
+            results of `func`
+        """
+        loop = asyncio.get_event_loop()
+        worker = ThreadPoolExecutor(max_workers=1)
+        rows = func(*args, **kwargs)
+
+        def step():
+            return list(islice(rows, TaxaDB.MAX_LIST))
+
+        def close():
+            rows.close()
+            # The thread's connection is not reused once it exits
+            self.sync.database.close()
+
+        try:
+            while True:
+                async with self.semaphore:
+                    batch = await loop.run_in_executor(worker, step)
+                if not batch:
+                    break
+                for row in batch:
+                    yield row
+        finally:
+            # The generator is closed on its own thread, e.g. to drop a
+            # temporary table when the consumer stops early
+            await loop.run_in_executor(worker, close)
+            worker.shutdown(wait=False)
+
+
+class AsyncTaxID(AsyncTaxaDB):
+
+    """Asyncio counterpart of `taxadb.taxid.TaxID`
+
+    Args:
+        **kwargs: Arbitrary arguments. Supported (username, password, port,
+            hostname, config, dbtype, dbname, in_memory, cte, cache_size,
+            concurrency)
+
+    Raises:
+        SystemExit: If table `taxa` does not exist
+
+    """
+
+    CLASS = TaxID
+
+    def sci_name(self, taxid):
+        """Get taxonomic scientific name for taxonomy id
+
+        Coroutine, see `taxadb.taxid.TaxID.sci_name`.
+        """
+        return self._run(self.sync.sci_name, taxid)
+
+    def lineage_id(self, taxid, ranks=False, reverse=False):
+        """Get lineage for a taxonomic id
+
+        Coroutine, see `taxadb.taxid.TaxID.lineage_id`.
+        """
+        return self._run(self.sync.lineage_id, taxid, ranks=ranks,
+                         reverse=reverse)
+
+    def lineage_name(self, taxid, ranks=False, reverse=False):
+        """Get a lineage name for a taxonomic id
+
+        Coroutine, see `taxadb.taxid.TaxID.lineage_name`.
+        """
+        return self._run(self.sync.lineage_name, taxid, ranks=ranks,
+                         reverse=reverse)
+
+    def has_parent(self, taxid, parent):
+        """Check if a taxid has a parent in its lineage
+
+        Coroutine, see `taxadb.taxid.TaxID.has_parent`.
+        """
+        return self._run(self.sync.has_parent, taxid, parent)
+
+    def lca(self, taxid1, taxid2):
+        """Get the lowest common ancestor of two taxids
+
+        Coroutine, see `taxadb.taxid.TaxID.lca`.
+        """
+        return self._run(self.sync.lca, taxid1, taxid2)
+
+    def lca_many(self, taxids):
+        """Get the lowest common ancestor of a set of taxids
+
+        Coroutine, see `taxadb.taxid.TaxID.lca_many`.
+        """
+        return self._run(self.sync.lca_many, taxids)
+
+    def sci_name_many(self, taxids):
+        """Get taxonomic scientific names for many taxonomy ids
+
+        Asynchronous generator, see `taxadb.taxid.TaxID.sci_name_many`.
+        """
+        return self._iterate(self.sync.sci_name_many, taxids)
+
+    def lineage_id_many(self, taxids, ranks=False, reverse=False):
+        """Get lineages for many taxonomic ids
+
+        Asynchronous generator, see `taxadb.taxid.TaxID.lineage_id_many`.
+        """
+        return self._iterate(self.sync.lineage_id_many, taxids, ranks=ranks,
+                             reverse=reverse)
+
+    def lineage_name_many(self, taxids, ranks=False, reverse=False):
+        """Get lineage names for many taxonomic ids
+
+        Asynchronous generator, see `taxadb.taxid.TaxID.lineage_name_many`.
+        """
+        return self._iterate(self.sync.lineage_name_many, taxids,
+                             ranks=ranks, reverse=reverse)
+
+    def has_parent_many(self, taxids, parent):
+        """Check if many taxids have a parent in their lineage
+
+        Asynchronous generator, see `taxadb.taxid.TaxID.has_parent_many`.
+        """
+        return self._iterate(self.sync.has_parent_many, taxids, parent)
+
+    def descendants(self, taxid, ranks=None):
+        """Get all taxids under a clade
+
+        Asynchronous generator, see `taxadb.taxid.TaxID.descendants`.
+        """
+        return self._iterate(self.sync.descendants, taxid, ranks=ranks)
+
+
+class AsyncAccessionID(AsyncTaxaDB):
+
+    """Asyncio counterpart of `taxadb.accessionid.AccessionID`
+
+    All methods are asynchronous generators. Accession numbers are read from
+        `acc_number_list` on the thread running the queries.
+
+    Args:
+        **kwargs: Arbitrary arguments. Supported (username, password, port,
+            hostname, config, dbtype, dbname, in_memory, cte,
+            bulk_threshold, cache_size, bloom, concurrency)
+
+    Raises:
+        SystemExit: If table `accession` does not exist
+
+    """
+
+    CLASS = AccessionID
+
+    def taxid(self, acc_number_list):
+        """Get taxonomy of accession ids
+
+        See `taxadb.accessionid.AccessionID.taxid`.
+        """
+        return self._iterate(self.sync.taxid, acc_number_list)
+
+    def sci_name(self, acc_number_list):
+        """Get taxonomic scientific name for accession ids
+
+        See `taxadb.accessionid.AccessionID.sci_name`.
+        """
+        return self._iterate(self.sync.sci_name, acc_number_list)
+
+    def lineage_id(self, acc_number_list):
+        """Get taxonomic lineage name for accession ids
+
+        See `taxadb.accessionid.AccessionID.lineage_id`.
+        """
+        return self._iterate(self.sync.lineage_id, acc_number_list)
+
+    def lineage_name(self, acc_number_list):
+        """Get a lineage name for accession ids
+
+        See `taxadb.accessionid.AccessionID.lineage_name`.
+        """
+        return self._iterate(self.sync.lineage_name, acc_number_list)
+
+    def in_clade(self, taxid):
+        """Get all accessions mapped to a clade
+
+        See `taxadb.accessionid.AccessionID.in_clade`.
+        """
+        return self._iterate(self.sync.in_clade, taxid)
+
+
+class AsyncSciName(AsyncTaxaDB):
+
+    """Asyncio counterpart of `taxadb.names.SciName`
+
+    Args:
+        **kwargs: Arbitrary arguments. Supported (username, password, port,
+            hostname, config, dbtype, dbname, cache_size, concurrency)
+
+    Raises:
+        SystemExit: If table `taxa` does not exist
+
+    """
+
+    CLASS = SciName
+
+    def taxid(self, sci_name, case_sensitive=True, all_names=False):
+        """Get taxid from scientific name
+
+        Coroutine, see `taxadb.names.SciName.taxid`.
+        """
+        return self._run(self.sync.taxid, sci_name,
+                         case_sensitive=case_sensitive, all_names=all_names)
+
+    def search(self, name, limit=10, threshold=0.3, all_names=False):
+        """Search taxa by approximate name
+
+        Coroutine, see `taxadb.names.SciName.search`.
+        """
+        return self._run(self.sync.search, name, limit=limit,
+                         threshold=threshold, all_names=all_names)
+
+    def taxid_many(self, sci_names, case_sensitive=True, all_names=False):
+        """Get taxids from many scientific names
+
+        Asynchronous generator, see `taxadb.names.SciName.taxid_many`.
+        """
+        return self._iterate(self.sync.taxid_many, sci_names,
+                             case_sensitive=case_sensitive,
+                             all_names=all_names)
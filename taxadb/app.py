@@ -3,18 +3,34 @@
 
 import os
 import sys
+import sqlite3
 import logging
 import argparse
 
 from tqdm import tqdm
-from peewee import PeeweeException, OperationalError
+from peewee import PeeweeException, OperationalError, PostgresqlDatabase, fn
 
 from taxadb import util
 from taxadb import download
+from taxadb import trigram
 from taxadb.version import __version__
-from taxadb.schema import DatabaseFactory, db, Taxa, Accession
+from taxadb.tree import TaxaTree
+from taxadb.bloom import BloomFilter
+from taxadb.compiled import CompiledAccessionID
+from taxadb.decompress import Decompressor
+from taxadb.schema import DatabaseFactory, db, Taxa, Accession, Lineage, \
+    Names
 from taxadb.parser import TaxaDumpParser, Accession2TaxidParser
 
+# Session settings of `taxadb create --bulk`, by database type. Durability is
+# traded for speed during the build, the original values are restored once
+# done
+BULK_SETTINGS = {
+    'sqlite': [('synchronous', 'OFF'), ('journal_mode', 'OFF'),
+               ('cache_size', '-1048576')],  # 1 GiB
+    'postgres': [('synchronous_commit', 'off')],
+}
+
 
 def download_files(args):
     """Main function for the `taxadb download` sub-command.
@@ -82,10 +98,36 @@ def create_db(args):
         args.division (:obj:`str`): division to create the db for.
         args.fast (:obj:`bool`): Disables checks for faster db creation. Use
                                  with caution!
+        args.lineage (:obj:`bool`): Precompute the lineage and nested set
+                                    interval of each taxon in table Lineage
+                                    (always rebuilt if it already exists)
+        args.trigram (:obj:`bool`): Build a trigram index of scientific
+                                    names for approximate name search
+                                    (always rebuilt if it already exists)
+        args.bloom (:obj:`bool`): Build a Bloom filter of accessions, saved
+                                  to `<dbname>.bloom` (always rebuilt if it
+                                  already exists)
+        args.bloom_fpr (:obj:`float`): Target false positive rate of the
+                                       Bloom filter
+        args.decompress (:obj:`str`): Decompression backend of the
+                                      accession2taxid files
+        args.workers (:obj:`int`): Number of processes parsing the
+                                   accession2taxid files
+        args.bulk (:obj:`bool`): Relax durability during the build, and
+                                 insert rows in chunks sized from the bind
+                                 variables limit of the database
 
     """
     logger = logging.getLogger(__name__)
-    database = DatabaseFactory(**args.__dict__).get_database()
+    # Check the options of the accessions parser before building the taxa
+    # tables
+    acc_parser = Accession2TaxidParser(verbose=args.verbose, fast=args.fast,
+                                       decompress=args.decompress,
+                                       workers=args.workers)
+    # The database is filled in WAL mode, and left in rollback journal mode
+    # once done (see below)
+    database = DatabaseFactory(journal_mode='wal',
+                               **args.__dict__).get_database()
     div = args.division  # am lazy at typing
     db.initialize(database)
 
@@ -100,30 +142,58 @@ def create_db(args):
                             verbose=args.verbose)
 
     logger.debug('Connected to database')
+    if args.bulk:
+        logger.info('Bulk mode: durability disabled until the end of the '
+                    'build')
+        settings = set_bulk_settings(args.dbtype)
     # If taxa table already exists, do not recreate and fill it
     # safe=True prevent not to create the table if it already exists
     if not Taxa.table_exists():
         logger.info('Creating table %s' % str(Taxa.get_table_name()))
         db.create_tables([Taxa])
 
-    logger.info("Parsing files")
-    taxa_info_list = parser.taxdump()
-
-    logger.info("Inserting taxonomy data")
-    total_size = len(taxa_info_list)
+    logger.info("Parsing files and inserting taxonomy data")
+    fields = [Taxa.ncbi_taxid, Taxa.parent_taxid, Taxa.tax_name,
+              Taxa.lineage_level]
     try:
         with db.atomic():
-            for i in tqdm(range(0, total_size, args.chunk),
-                          unit=' chunks', desc='INFO:taxadb.app',
-                          total=''):
-                Taxa.insert_many(taxa_info_list[i:i+args.chunk]).execute()
+            for chunk in tqdm(util.chunked(parser.taxa(), bulk_chunk(
+                    args, len(fields))), unit=' chunks',
+                    desc='INFO:taxadb.app', total=''):
+                insert_rows(Taxa, fields, chunk, bulk=args.bulk)
     except OperationalError as e:
         print("\n")  # needed because the above counter has none
         logger.error("sqlite3 error: %s" % e)
         logger.error("Maybe retry with a lower chunk size.")
         sys.exit(1)
+    if not Taxa.has_index(name='taxa_parent_taxid'):
+        logger.info('Creating index on %s.parent_taxid'
+                    % str(Taxa.get_table_name()))
+        db.execute(Taxa.index(Taxa.parent_taxid, safe=False))
+    if not Taxa.has_index(name='taxa_tax_name'):
+        logger.info('Creating index on %s.tax_name'
+                    % str(Taxa.get_table_name()))
+        db.execute(Taxa.index(Taxa.tax_name, safe=False))
+    if args.dbtype != 'mysql' and not Taxa.has_index(
+            name='taxa_lower_tax_name'):
+        logger.info('Creating index on LOWER(%s.tax_name)'
+                    % str(Taxa.get_table_name()))
+        db.execute(Taxa.index(fn.LOWER(Taxa.tax_name),
+                              name='taxa_lower_tax_name', safe=False))
     logger.info('Table Taxa completed')
 
+    build_names(parser, args.dbtype, chunk=bulk_chunk(args, 3),
+                bulk=args.bulk)
+    if args.lineage or Lineage.table_exists():
+        # Table Lineage is derived from table Taxa, a table built by a
+        # previous run is rebuilt so that queries never read stale lineages
+        build_lineage(chunk=bulk_chunk(args, 4), bulk=args.bulk)
+    if args.trigram or (args.dbtype == 'sqlite' and set(
+            trigram.FTS_TABLES.values()) & set(db.get_tables())):
+        # The SQLite FTS5 index is not updated with its external content,
+        # an index built by a previous run is rebuilt
+        build_trigram(args.dbtype)
+
     # At first load, table accession does not exist yet, we create it
     db.create_tables([Accession])
 
@@ -133,18 +203,24 @@ def create_db(args):
         acc_dl_list.append(nucl_wgs)
     if div in ['full', 'prot']:
         acc_dl_list.append(prot)
-    parser = Accession2TaxidParser(verbose=args.verbose, fast=args.fast)
+    fields = [Accession.accession, Accession.taxid]
     with db.atomic():
         for acc_file in acc_dl_list:
             inserted_rows = 0
+            acc_path = os.path.join(args.input, acc_file)
+            if not os.path.exists(acc_path) and \
+                    os.path.exists(acc_path[:-len('.gz')]):
+                # Already decompressed
+                acc_path = acc_path[:-len('.gz')]
+                acc_file = acc_file[:-len('.gz')]
             logger.info("Parsing %s" % str(acc_file))
             for data_dict in tqdm(
-                parser.accession2taxid(
-                    acc2taxid=os.path.join(args.input, acc_file),
-                    chunk=args.chunk), unit=' chunks',
+                acc_parser.accession2taxid(
+                    acc2taxid=acc_path,
+                    chunk=bulk_chunk(args, len(fields))), unit=' chunks',
                     desc='INFO:taxadb.app',
                     total=''):
-                Accession.insert_many(data_dict[0:args.chunk]).execute()
+                insert_rows(Accession, fields, data_dict, bulk=args.bulk)
                 inserted_rows += len(data_dict)
             logger.info('%s: %s added to database (%d rows inserted)'
                         % (Accession.get_table_name(),
@@ -160,7 +236,348 @@ def create_db(args):
                 raise Exception("Could not create Accession index: %s"
                                 % str(err))
     logger.info('Table Accession completed')
+    bloom = args.dbname + '.bloom'
+    if args.bloom or os.path.exists(bloom):
+        # A filter missing the new accessions would report them absent,
+        # a filter built by a previous run is rebuilt
+        build_bloom(bloom, args.dbtype, fpr=args.bloom_fpr)
+    if args.bulk:
+        restore_settings(args.dbtype, settings)
+    if args.dbtype == 'sqlite':
+        # Leave WAL mode, so that the file can be opened read-only without
+        # side files
+        db.execute_sql('PRAGMA journal_mode=DELETE')
+    db.close()
+
+
+def max_variables(dbtype):
+    """Get the maximum number of bind variables of a statement
+
+    Args:
+        dbtype (:obj:`str`): type of the database
+
+    Returns:
+        int: 32766 with SQLite >= 3.32 (999 before), 65535 with MySQL and
+            PostgreSQL
+    """
+    if dbtype == 'sqlite':
+        return 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+    return 65535
+
+
+def bulk_chunk(args, columns):
+    """Get the number of rows inserted at once
+
+    Args:
+        args (object): The arguments from argparse (`chunk`, `bulk` and
+            `dbtype`)
+        columns (:obj:`int`): Number of columns of the rows
+
+    Returns:
+        int: `chunk`, or in bulk mode the largest number of rows a
+            multi-row INSERT can bind
+    """
+    if not args.bulk:
+        return args.chunk
+    return max_variables(args.dbtype) // columns
+
+
+def insert_rows(model, fields, rows, bulk=False):
+    """Insert rows into a table
+
+    In bulk mode, a single row INSERT is run over all rows with the
+    `executemany` of the driver, which skips building and parsing a
+    multi-row INSERT per chunk. Not with PostgreSQL, whose driver runs
+    `executemany` row by row.
+
+    Args:
+        model (:obj:`pw.Model`): table to fill
+        fields (:obj:`list`): fields of the values
+        rows (:obj:`list`): tuples of values, in the order of `fields`
+        bulk (:obj:`bool`): use `executemany`
+
+    """
+    if bulk and not isinstance(db.obj, PostgresqlDatabase):
+        # Statement of a single row, with the columns in the order of fields
+        sql, _ = model.insert_many([(None,) * len(fields)],
+                                   fields=fields).sql()
+        db.cursor().executemany(sql, rows)
+    else:
+        model.insert_many(rows, fields=fields).execute()
+
+
+def _get_setting(dbtype, name):
+    """Get a session setting (a pragma with SQLite)"""
+    if dbtype == 'sqlite':
+        return str(db.execute_sql('PRAGMA %s' % name).fetchone()[0])
+    return str(db.execute_sql('SHOW %s' % name).fetchone()[0])
+
+
+def _set_setting(dbtype, name, value):
+    """Set a session setting (a pragma with SQLite)"""
+    if dbtype == 'sqlite':
+        db.execute_sql('PRAGMA %s=%s' % (name, value))
+    else:
+        db.execute_sql('SET %s TO %s' % (name, value))
+
+
+def set_bulk_settings(dbtype):
+    """Relax the durability of the database session for a bulk build
+
+    See `BULK_SETTINGS`. With SQLite, the database is corrupted if the
+    build fails, and must be created again.
+
+    Args:
+        dbtype (:obj:`str`): type of the database
+
+    Returns:
+        list: (name, value) tuples of the replaced settings, see
+            `restore_settings`
+    """
+    logger = logging.getLogger(__name__)
+    settings = []
+    for name, value in BULK_SETTINGS.get(dbtype, []):
+        settings.append((name, _get_setting(dbtype, name)))
+        _set_setting(dbtype, name, value)
+        logger.debug('%s set to %s (was %s)' % (name, value,
+                                                settings[-1][1]))
+    return settings
+
+
+def restore_settings(dbtype, settings):
+    """Restore the settings replaced by `set_bulk_settings`, and check the
+    database
+
+    Args:
+        dbtype (:obj:`str`): type of the database
+        settings (:obj:`list`): (name, value) tuples to restore
+
+    Raises:
+        SystemExit: If a setting can't be restored, or the integrity check
+            of a SQLite database fails
+    """
+    logger = logging.getLogger(__name__)
+    for name, value in reversed(settings):
+        _set_setting(dbtype, name, value)
+        if _get_setting(dbtype, name).lower() != value.lower():
+            logger.error('Could not restore %s to %s' % (name, value))
+            sys.exit(1)
+    if dbtype == 'sqlite':
+        logger.info('Checking database integrity')
+        result = [row[0] for row in db.execute_sql('PRAGMA quick_check')]
+        if result != ['ok']:
+            logger.error('Database integrity check failed: %s'
+                         % '; '.join(result))
+            sys.exit(1)
+    logger.info('Bulk mode: settings restored')
+
+
+def build_bloom(path, dbtype, fpr=0.01):
+    """Build a Bloom filter of the accessions of table Accession
+
+    `AccessionID` checks accessions against the filter before querying the
+    database, so that most accessions absent from the database are not
+    requested (see setting `bloom`).
+
+    Args:
+        path (:obj:`str`): output file
+        dbtype (:obj:`str`): type of the database
+        fpr (:obj:`float`): Target false positive rate
+
+    """
+    logger = logging.getLogger(__name__)
+    count = Accession.select().count()
+    bloom = BloomFilter(count, fpr)
+    logger.info('Building Bloom filter of %d accessions (%d bits, %d hashes)'
+                % (count, bloom.size, bloom.hashes))
+    query = Accession.select(Accession.accession).tuples()
+    with db.atomic():
+        for accession, in util.stream(query, dbtype):
+            bloom.add(accession)
+    bloom.save(path)
+    logger.info('Bloom filter saved to %s (false positive rate %.4g)'
+                % (path, bloom.false_positive_rate()))
+
+
+def build_names(parser, dbtype, chunk=500, bulk=False):
+    """Fill the Names table with all name classes of names.dmp
+
+    The table is rebuilt from scratch, and indexed once filled.
+
+    Args:
+        parser (:obj:`taxadb.parser.TaxaDumpParser`): parser of names.dmp
+        dbtype (:obj:`str`): type of the database
+        chunk (:obj:`int`): Number of rows to insert in bulk
+        bulk (:obj:`bool`): Insert with `executemany`, see `insert_rows`
+
+    """
+    logger = logging.getLogger(__name__)
+    logger.info('Building table %s' % str(Names.get_table_name()))
+    db.drop_tables([Names], safe=True)
+    db.create_tables([Names])
+    with db.atomic():
+        for rows_chunk in tqdm(util.chunked(parser.names(), chunk),
+                               unit=' chunks', desc='INFO:taxadb.app',
+                               total=''):
+            insert_rows(Names, [Names.ncbi_taxid, Names.name,
+                                Names.name_class], rows_chunk, bulk=bulk)
+    logger.info('Creating indexes on %s' % str(Names.get_table_name()))
+    db.execute(Names.index(Names.ncbi_taxid, safe=False))
+    db.execute(Names.index(Names.name, safe=False))
+    if dbtype != 'mysql':
+        db.execute(Names.index(fn.LOWER(Names.name),
+                               name='names_lower_name', safe=False))
+    logger.info('Table Names completed')
+
+
+def build_lineage(chunk=500, bulk=False):
+    """Fill the Lineage table from the Taxa table
+
+    The lineage and nested set interval of each taxon are computed once,
+    from top-down traversals of the taxonomy tree. The table is rebuilt from
+    scratch so it always matches the content of table Taxa.
+
+    Args:
+        chunk (:obj:`int`): Number of rows to insert in bulk
+        bulk (:obj:`bool`): Insert with `executemany`, see `insert_rows`
+
+    """
+    logger = logging.getLogger(__name__)
+    logger.info('Building table %s' % str(Lineage.get_table_name()))
+    db.drop_tables([Lineage], safe=True)
+    db.create_tables([Lineage])
+    tree = TaxaTree.load()
+    left, right = tree.nested_sets()
+    rows = ((taxid, ','.join(map(str, lineage)), left[taxid], right[taxid])
+            for taxid, lineage in tree.lineages())
+    with db.atomic():
+        for rows_chunk in tqdm(util.chunked(rows, chunk), unit=' chunks',
+                               desc='INFO:taxadb.app', total=''):
+            insert_rows(Lineage, [Lineage.ncbi_taxid, Lineage.path,
+                                  Lineage.lft, Lineage.rgt], rows_chunk,
+                        bulk=bulk)
+    logger.info('Table Lineage completed')
+
+
+def build_trigram(dbtype):
+    """Build the trigram indexes of scientific names and other names
+
+    Columns Taxa.tax_name and Names.name are indexed. With SQLite, names are
+    indexed in FTS5 tables `taxa_trigram` and `names_trigram` (trigram
+    tokenizer, requires SQLite >= 3.34), with the indexed table as external
+    content. With PostgreSQL, GIN indexes are built with extension pg_trgm.
+    Otherwise, `SciName.search` falls back to an in-memory index.
+
+    Args:
+        dbtype (:obj:`str`): type of the database
+
+    """
+    logger = logging.getLogger(__name__)
+    if dbtype not in ['sqlite', 'postgres']:
+        logger.warning('No trigram index with %s, name search will use an '
+                       'in-memory index' % dbtype)
+        return
+    if dbtype == 'postgres':
+        db.execute_sql('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for column in [Taxa.tax_name, Names.name]:
+        model = column.model
+        table = model.get_table_name()
+        if not model.table_exists():
+            continue
+        if dbtype == 'sqlite':
+            fts = trigram.FTS_TABLES[table]
+            logger.info('Building table %s' % fts)
+            db.execute_sql('DROP TABLE IF EXISTS %s' % fts)
+            try:
+                db.execute_sql(
+                    "CREATE VIRTUAL TABLE %s USING fts5(%s, content='%s', "
+                    "content_rowid='%s', tokenize='trigram')"
+                    % (fts, column.column_name, table,
+                       model._meta.primary_key.column_name))
+            except OperationalError as err:
+                logger.warning('SQLite FTS5 trigram tokenizer not '
+                               'available (%s), name search will use an '
+                               'in-memory index' % str(err))
+                return
+            db.execute_sql("INSERT INTO %s(%s) VALUES('rebuild')"
+                           % (fts, fts))
+        else:
+            logger.info('Creating trigram index on %s.%s'
+                        % (table, column.column_name))
+            db.execute_sql(
+                'CREATE INDEX IF NOT EXISTS %s ON %s USING gin '
+                '(%s gin_trgm_ops)'
+                % (trigram.PG_INDEXES[table], table, column.column_name))
+    logger.info('Trigram indexes completed')
+
+
+def compile_db(args):
+    """Main function for the 'taxadb compile' sub-command.
+
+    This function compiles the Taxa table of a database to flat binary files,
+    which `taxadb.compiled.CompiledTaxID` memory-maps, and optionally the
+    Accession table, read by `taxadb.compiled.CompiledAccessionID`.
+
+    Args:
+
+        args.output (:obj:`str`): output directory
+        args.dbname (:obj:`str`): name of the database
+        args.dbtype (:obj:`str`): type of database to be used.
+        args.accessions (:obj:`bool`): Also compile the Accession table to a
+                                       sorted accessions file
+
+    """
+    logger = logging.getLogger(__name__)
+    database = DatabaseFactory(**args.__dict__).get_database()
+    db.initialize(database)
+    db.connect()
+    if not Taxa.table_exists():
+        logger.error("Table %s does not exist" % str(Taxa.get_table_name()))
+        sys.exit(1)
+    logger.info('Loading table %s' % str(Taxa.get_table_name()))
+    tree = TaxaTree.load()
+    logger.info('Compiling taxonomy to %s' % str(args.output))
+    tree.save(args.output)
+    if args.accessions:
+        compile_accessions(args.output, args.dbtype)
     db.close()
+    logger.info('Taxonomy compiled')
+
+
+def compile_accessions(directory, dbtype):
+    """Write the Accession table to a sorted accessions file
+
+    Accessions are sorted by the database in byte order (`COLLATE "C"` with
+    PostgreSQL, binary comparison with MySQL), and streamed to the file
+    read by `taxadb.compiled.CompiledAccessionID`.
+
+    Args:
+        directory (:obj:`str`): output directory
+        dbtype (:obj:`str`): type of the database
+
+    """
+    logger = logging.getLogger(__name__)
+    if not Accession.table_exists():
+        logger.error("Table %s does not exist"
+                     % str(Accession.get_table_name()))
+        sys.exit(1)
+    width = Accession.select(
+        fn.MAX(fn.LENGTH(Accession.accession))).scalar() or 0
+    if dbtype == 'postgres':
+        order = Accession.accession.collate('"C"')
+    elif dbtype == 'mysql':
+        order = Accession.accession.cast('BINARY')
+    else:
+        order = Accession.accession
+    query = Accession.select(Accession.accession, Accession.taxid).order_by(
+        order).tuples()
+    rows = util.stream(query, dbtype)
+    path = os.path.join(directory, CompiledAccessionID.FILE)
+    logger.info('Compiling %s to %s'
+                % (str(Accession.get_table_name()), path))
+    with db.atomic():
+        count = CompiledAccessionID.write(path, rows, width)
+    logger.info('%d accessions compiled' % count)
 
 
 def query(args):
@@ -258,6 +675,67 @@ def main():
         default=False,
         help='Disables checks for faster db creation. Use with caution!'
     )
+    parser_create.add_argument(
+        '--lineage',
+        action='store_true',
+        default=False,
+        help='Precompute the lineage and nested set interval of each taxon \
+            for faster lineage and ancestry queries. Takes more disk space. \
+            Always rebuilt if the database already has one \
+            (default: %(default)s)'
+    )
+    parser_create.add_argument(
+        '--trigram',
+        action='store_true',
+        default=False,
+        help='Build a trigram index of names for approximate name search. \
+            Always rebuilt if the database already has one with SQLite \
+            (default: %(default)s)'
+    )
+    parser_create.add_argument(
+        '--bloom',
+        action='store_true',
+        default=False,
+        help='Build a Bloom filter of accessions, saved to <dbname>.bloom, \
+            to skip queries of absent accessions. Always rebuilt if the \
+            file already exists (default: %(default)s)'
+    )
+    parser_create.add_argument(
+        '--bloom-fpr',
+        metavar='<rate>',
+        type=float,
+        default=0.01,
+        help='False positive rate of the Bloom filter (default: \
+            %(default)s)'
+    )
+    parser_create.add_argument(
+        '--decompress',
+        choices=('auto',) + Decompressor.BACKENDS,
+        default='auto',
+        metavar='[auto|%s]' % '|'.join(Decompressor.BACKENDS),
+        help='Decompression backend of the gzipped accession2taxid files, \
+            auto picks the fastest installed one. Uncompressed files are \
+            read as is (default: %(default)s)'
+    )
+    parser_create.add_argument(
+        '--workers',
+        '-w',
+        metavar='<#workers>',
+        type=int,
+        default=1,
+        help='Number of processes parsing the accession2taxid files, while \
+            the main process inserts the accessions (default: %(default)s)'
+    )
+    parser_create.add_argument(
+        '--bulk',
+        action='store_true',
+        default=False,
+        help='Faster build: disable durability (SQLite: no journal nor \
+            sync, a failed build must be restarted from scratch) and insert \
+            rows in chunks sized from the bind variables limit, ignoring \
+            --chunk. Settings are restored and checked at the end \
+            (default: %(default)s)'
+    )
     parser_create.add_argument(
         '--chunk',
         '-c',
@@ -327,6 +805,85 @@ def main():
     )
     parser_create.set_defaults(func=create_db)
 
+    parser_compile = subparsers.add_parser(
+        'compile',
+        prog='taxadb compile',
+        description='compile the taxonomy to memory-mappable files',
+        help='compile the taxonomy to memory-mappable files'
+    )
+    param_logging_co = parser_compile.add_mutually_exclusive_group()
+    param_logging_co.add_argument(
+        '--quiet',
+        action='store_true',
+        default=False,
+        help='Disable info logging. (default: %(default)s).'
+    )
+    param_logging_co.add_argument(
+        '--verbose',
+        action="store_true",
+        default=False,
+        help='Enable debug logging. (default: %(default)s).'
+    )
+    parser_compile.add_argument(
+        '--output',
+        '-o',
+        metavar='<dir>',
+        help='Output directory of the compiled taxonomy',
+        required=True
+    )
+    parser_compile.add_argument(
+        '--accessions',
+        action='store_true',
+        default=False,
+        help='Also compile accessions to a sorted, memory-mappable file \
+            (default: %(default)s)'
+    )
+    parser_compile.add_argument(
+        '--dbname',
+        '-n',
+        default='taxadb',
+        metavar='taxadb',
+        help='name of the database (default: %(default)s))'
+    )
+    parser_compile.add_argument(
+        '--dbtype',
+        '-t',
+        choices=['sqlite', 'mysql', 'postgres'],
+        default='sqlite',
+        metavar='[sqlite|mysql|postgres]',
+        help='type of the database (default: %(default)s))'
+    )
+    parser_compile.add_argument(
+        '--hostname',
+        '-H',
+        default='localhost',
+        action="store",
+        help='Database connection host (Optional, for MySQLdatabase and \
+            PostgreSQLdatabase) (default: %(default)s)'
+    )
+    parser_compile.add_argument(
+        '--password',
+        '-p',
+        default=None,
+        help='Password to use (required for MySQLdatabase \
+            and PostgreSQLdatabase)'
+    )
+    parser_compile.add_argument(
+        '--port',
+        '-P',
+        type=int,
+        help='Database connection port (default: 5432 (postgres), \
+            3306 (MySQL))'
+    )
+    parser_compile.add_argument(
+        '--username',
+        '-u',
+        default=None,
+        help='Username to login as (required for MySQLdatabase \
+            and PostgreSQLdatabase)'
+    )
+    parser_compile.set_defaults(func=compile_db)
+
     parser_query = subparsers.add_parser(
         'query',
         prog='taxadb query',
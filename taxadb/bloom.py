@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import mmap
+import math
+import struct
+import hashlib
+import logging
+
+
+class BloomFilter(object):
+
+    """Bloom filter of accession numbers
+
+    A bit array in which each key sets `hashes` bits, derived from a blake2b
+        digest by double hashing. A key whose bits are not all set was never
+        added, while a key whose bits are set was added with a probability
+        of 1 - `fpr`.
+
+    Filters are saved to a file (a header followed by the bit array), which
+        `load` memory-maps.
+
+    Args:
+        capacity (:obj:`int`): Number of keys to add
+        fpr (:obj:`float`): Target false positive rate, between 0 and 1
+
+    Raises:
+        SystemExit: If `fpr` is not between 0 and 1
+
+    Attributes:
+        MAGIC (:obj:`bytes`): First bytes of a filter file
+        HEADER (:obj:`struct.Struct`): Header of a filter file (magic, number
+            of bits, number of hashes, number of keys, target false positive
+            rate)
+        size (:obj:`int`): Number of bits
+        hashes (:obj:`int`): Number of bits set per key
+        count (:obj:`int`): Number of added keys
+
+    """
+
+    MAGIC = b'TAXADBBF'
+    HEADER = struct.Struct('<8sQHQd')
+
+    def __init__(self, capacity, fpr):
+        if not 0 < fpr < 1:
+            self.logger.error("False positive rate must be between 0 and 1")
+            sys.exit(1)
+        capacity = max(capacity, 1)
+        self.fpr = fpr
+        self.size = max(8, int(math.ceil(
+            -capacity * math.log(fpr) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.count = 0
+        self.bits = bytearray((self.size + 7) // 8)
+
+    @property
+    def logger(self):
+        component = "{}.{}".format(type(self).__module__, type(self).__name__)
+        return logging.getLogger(component)
+
+    def _positions(self, key):
+        """Get the bits of a key"""
+        # hashlib.blake2b requires Python >= 3.6, only needed with a filter
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        hash1 = int.from_bytes(digest[:8], 'little')
+        hash2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hashes):
+            yield (hash1 + i * hash2) % self.size
+
+    def add(self, key):
+        """Add a key
+
+        Args:
+            key (:obj:`str`): an accession number
+        """
+        bits = self.bits
+        for position in self._positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count
+
+    def false_positive_rate(self):
+        """Estimate the false positive rate from the number of added keys
+
+        Returns:
+            float: probability that a key never added is reported present
+        """
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** \
+            self.hashes
+
+    def save(self, path):
+        """Save the filter to a file
+
+        Args:
+            path (:obj:`str`): Output file
+        """
+        with open(path, 'wb') as f:
+            f.write(BloomFilter.HEADER.pack(BloomFilter.MAGIC, self.size,
+                                            self.hashes, self.count,
+                                            self.fpr))
+            f.write(self.bits)
+
+    @classmethod
+    def load(cls, path):
+        """Open a filter saved with `save`
+
+        The bit array is memory-mapped read-only.
+
+        Args:
+            path (:obj:`str`): Filter file
+
+        Returns:
+            :obj:`BloomFilter`
+
+        Raises:
+            SystemExit: If the file can't be opened or is not a filter file
+        """
+        logger = logging.getLogger(__name__)
+        try:
+            with open(path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, size, hashes, count, fpr = BloomFilter.HEADER.unpack_from(
+                data)
+        except (OSError, ValueError, struct.error) as err:
+            logger.error("Can't open Bloom filter: %s" % str(err))
+            sys.exit(1)
+        if magic != BloomFilter.MAGIC or \
+                len(data) != BloomFilter.HEADER.size + (size + 7) // 8:
+            logger.error("%s is not a Bloom filter file" % path)
+            sys.exit(1)
+        bloom = cls.__new__(cls)
+        bloom.fpr = fpr
+        bloom.size = size
+        bloom.hashes = hashes
+        bloom.count = count
+        bloom.bits = memoryview(data)[BloomFilter.HEADER.size:]
+        return bloom
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+
+    """Bounded cache of query results with least recently used eviction
+
+    Entries are stored under a namespace (e.g. the name of the cached
+        method) and a key, and all namespaces share the same size limit.
+        When the cache is full, the least recently used entry is evicted.
+        The cache can be shared by threads (see `taxadb.aio`).
+
+    Args:
+        maxsize (:obj:`int`): Maximum number of entries
+
+    Attributes:
+        MISSING (:obj:`object`): Default value returned by `get` for entries
+            not in cache, as None is a valid cached result
+        hits (:obj:`int`): Number of lookups found in cache
+        misses (:obj:`int`): Number of lookups not found in cache
+        evictions (:obj:`int`): Number of entries evicted to make room for
+            new ones
+
+    """
+
+    MISSING = object()
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, namespace, key, default=MISSING):
+        """Get a cached value and mark it as recently used
+
+        Args:
+            namespace (:obj:`str`): Namespace of the entry
+            key: Key of the entry, must be hashable
+            default: Value returned if the entry is not in cache. Default
+                `MISSING`
+
+        Returns:
+            cached value, `default` if not found
+        """
+        with self._lock:
+            try:
+                value = self._entries[(namespace, key)]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end((namespace, key))
+            self.hits += 1
+            return value
+
+    def put(self, namespace, key, value):
+        """Cache a value, evicting the least recently used entries if full
+
+        Args:
+            namespace (:obj:`str`): Namespace of the entry
+            key: Key of the entry, must be hashable
+            value: Value to cache
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[(namespace, key)] = value
+            self._entries.move_to_end((namespace, key))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, namespace=None):
+        """Remove cached entries
+
+        Args:
+            namespace (:obj:`str`): Only remove entries of this namespace.
+                Default None, remove all entries
+        """
+        with self._lock:
+            if namespace is None:
+                self._entries.clear()
+                return
+            for entry in [entry for entry in self._entries
+                          if entry[0] == namespace]:
+                del self._entries[entry]
+
+    def stats(self):
+        """Get cache statistics
+
+        Returns:
+            dict: hits, misses, evictions, size (number of entries) and
+                maxsize
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'size': len(self._entries),
+                'maxsize': self.maxsize}
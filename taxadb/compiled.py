@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import mmap
+import struct
+import logging
+
+from taxadb.taxid import TaxID
+from taxadb.tree import TaxaTree
+
+
+class CompiledTaxID(object):
+
+    """Query a taxonomy compiled with `taxadb compile`
+
+    Provide the taxid methods of `taxadb.taxid.TaxID`, answered from the
+        memory-mapped files of a compiled taxonomy (see
+        `taxadb.tree.TaxaTree.open`) instead of the database. Opening a
+        compiled taxonomy only maps its files, and processes opening the same
+        files share them through the OS page cache.
+
+    Args:
+        directory (:obj:`str`): Directory of the compiled taxonomy
+
+    Raises:
+        SystemExit: If the compiled taxonomy can't be opened
+
+    """
+
+    def __init__(self, directory):
+        self.tree = TaxaTree.open(directory)
+
+    @property
+    def logger(self):
+        component = "{}.{}".format(type(self).__module__, type(self).__name__)
+        return logging.getLogger(component)
+
+    def sci_name(self, taxid):
+        """Get taxonomic scientific name for taxonomy id
+
+        See `taxadb.taxid.TaxID.sci_name`.
+        """
+        return self.tree.name(taxid)
+
+    def lineage_id(self, taxid, ranks=False, reverse=False):
+        """Get lineage for a taxonomic id
+
+        See `taxadb.taxid.TaxID.lineage_id`.
+        """
+        return TaxID._format_lineage(self._lineage(taxid), 0, ranks=ranks,
+                                     reverse=reverse)
+
+    def lineage_name(self, taxid, ranks=False, reverse=False):
+        """Get a lineage name for a taxonomic id
+
+        See `taxadb.taxid.TaxID.lineage_name`.
+        """
+        return TaxID._format_lineage(self._lineage(taxid), 1, ranks=ranks,
+                                     reverse=reverse)
+
+    def has_parent(self, taxid, parent):
+        """Check if a taxid has a parent in its lineage
+
+        See `taxadb.taxid.TaxID.has_parent`.
+        """
+        return TaxID._in_lineage(self._lineage(taxid), parent)
+
+    def sci_name_many(self, taxids):
+        """Get taxonomic scientific names for many taxonomy ids
+
+        See `taxadb.taxid.TaxID.sci_name_many`.
+        """
+        for taxid in taxids:
+            yield (taxid, self.sci_name(taxid))
+
+    def lineage_id_many(self, taxids, ranks=False, reverse=False):
+        """Get lineages for many taxonomic ids
+
+        See `taxadb.taxid.TaxID.lineage_id_many`.
+        """
+        for taxid in taxids:
+            yield (taxid, self.lineage_id(taxid, ranks=ranks,
+                                          reverse=reverse))
+
+    def lineage_name_many(self, taxids, ranks=False, reverse=False):
+        """Get lineage names for many taxonomic ids
+
+        See `taxadb.taxid.TaxID.lineage_name_many`.
+        """
+        for taxid in taxids:
+            yield (taxid, self.lineage_name(taxid, ranks=ranks,
+                                            reverse=reverse))
+
+    def has_parent_many(self, taxids, parent):
+        """Check if many taxids have a parent in their lineage
+
+        See `taxadb.taxid.TaxID.has_parent_many`.
+        """
+        for taxid in taxids:
+            yield (taxid, self.has_parent(taxid, parent))
+
+    def descendants(self, taxid, ranks=None):
+        """Get all taxids under a clade
+
+        See `taxadb.taxid.TaxID.descendants`.
+        """
+        for ncbi_taxid in self.tree.descendants(taxid):
+            if ranks is None or self.tree.rank(ncbi_taxid) in ranks:
+                yield ncbi_taxid
+
+    def lca(self, taxid1, taxid2):
+        """Get the lowest common ancestor of two taxids
+
+        See `taxadb.taxid.TaxID.lca`. Lineages are climbed up to the
+            common ancestor, in time proportional to the depth of the taxa.
+        """
+        return self.tree.lca(taxid1, taxid2)
+
+    def lca_many(self, taxids):
+        """Get the lowest common ancestor of a set of taxids
+
+        See `taxadb.taxid.TaxID.lca_many`.
+        """
+        return self.tree.lca_many(taxids)
+
+    def _lineage(self, taxid):
+        """Get the taxa from a taxid up to the root, root excluded
+
+        Returns:
+            list: (ncbi_taxid, tax_name, lineage_level) tuples, or None if
+                taxid or one of its parents not found
+        """
+        lineage = self.tree.lineage(taxid)
+        if lineage is None:
+            return None
+        return [(ncbi_taxid, self.tree.name(ncbi_taxid),
+                 self.tree.rank(ncbi_taxid)) for ncbi_taxid in lineage]
+
+
+class CompiledAccessionID(object):
+
+    """Query accessions compiled with `taxadb compile --accessions`
+
+    Provide `taxadb.accessionid.AccessionID.taxid`, answered by binary
+        search over a memory-mapped file of accessions sorted in byte order.
+        The file holds a header (magic, version, key width and number of
+        records) followed by fixed-width records: the accession, padded
+        with null bytes to the key width, and its taxid as a little-endian
+        32 bits integer.
+
+    Args:
+        directory (:obj:`str`): Directory of the compiled taxonomy
+
+    Raises:
+        SystemExit: If the accessions file can't be opened
+
+    Attributes:
+        FILE (:obj:`str`): File name of the accessions file
+        MAGIC (:obj:`bytes`): First bytes of the accessions file
+        HEADER (:obj:`struct.Struct`): Header of the accessions file
+        TAXID (:obj:`struct.Struct`): Taxid of a record
+
+    """
+
+    FILE = 'accessions.bin'
+    MAGIC = b'TAXADBAC'
+    HEADER = struct.Struct('<8sHHQ')
+    TAXID = struct.Struct('<i')
+
+    def __init__(self, directory):
+        path = os.path.join(directory, CompiledAccessionID.FILE)
+        try:
+            with open(path, 'rb') as f:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, width, count = CompiledAccessionID.HEADER.\
+                unpack_from(self.data)
+        except (OSError, ValueError, struct.error) as err:
+            self.logger.error("Can't open compiled accessions: %s"
+                              % str(err))
+            sys.exit(1)
+        if magic != CompiledAccessionID.MAGIC or version != 1:
+            self.logger.error("%s is not a compiled accessions file" % path)
+            sys.exit(1)
+        self.width = width
+        self.count = count
+        self.record = width + CompiledAccessionID.TAXID.size
+
+    @property
+    def logger(self):
+        component = "{}.{}".format(type(self).__module__, type(self).__name__)
+        return logging.getLogger(component)
+
+    def __len__(self):
+        return self.count
+
+    @staticmethod
+    def write(path, rows, width):
+        """Write an accessions file
+
+        Args:
+            path (:obj:`str`): Output file
+            rows (:obj:`iterable`): (accession, taxid) tuples, sorted by
+                accession in byte order
+            width (:obj:`int`): Key width, length of the longest accession
+
+        Returns:
+            int: number of written records
+
+        Raises:
+            SystemExit: If accessions are not sorted, or longer than `width`
+        """
+        logger = logging.getLogger(__name__)
+        taxid = CompiledAccessionID.TAXID
+        count = 0
+        previous = None
+        with open(path, 'wb') as f:
+            f.write(CompiledAccessionID.HEADER.pack(
+                CompiledAccessionID.MAGIC, 1, width, 0))
+            for accession, ncbi_taxid in rows:
+                key = accession.encode()
+                if len(key) > width:
+                    logger.error("Accession %s is longer than %d bytes"
+                                 % (accession, width))
+                    sys.exit(1)
+                key = key.ljust(width, b'\0')
+                if previous is not None and key <= previous:
+                    logger.error("Accessions are not sorted in byte order "
+                                 "(%s after %s)"
+                                 % (accession, previous.rstrip(b'\0')))
+                    sys.exit(1)
+                f.write(key)
+                f.write(taxid.pack(ncbi_taxid))
+                previous = key
+                count += 1
+            f.seek(0)
+            f.write(CompiledAccessionID.HEADER.pack(
+                CompiledAccessionID.MAGIC, 1, width, count))
+        return count
+
+    def taxid(self, acc_number_list):
+        """Get taxonomy of accession ids
+
+        See `taxadb.accessionid.AccessionID.taxid`. Results are yielded in
+            the order of `acc_number_list`.
+
+        Args:
+            acc_number_list (:obj:`iterable`): accession numbers, e.g. a list
+                or a generator
+
+        Yields:
+            tuple: (accession id, taxonomy id)
+
+        """
+        missing = 0
+        try:
+            for accession in acc_number_list:
+                ncbi_taxid = self._find(accession)
+                if ncbi_taxid is None:
+                    missing += 1
+                    self.logger.debug(
+                        "No taxid mapped for accession %s" % str(accession))
+                else:
+                    yield (accession, ncbi_taxid)
+        finally:
+            if missing:
+                self.logger.warning("No taxid mapped for %d accession(s)"
+                                    % missing)
+
+    def _find(self, accession):
+        """Binary search an accession
+
+        Args:
+            accession (:obj:`str`): an accession number
+
+        Returns:
+            int: taxid, None if accession not found
+        """
+        key = accession.encode()
+        if len(key) > self.width:
+            return None
+        key = key.ljust(self.width, b'\0')
+        data, width, record = self.data, self.width, self.record
+        start = CompiledAccessionID.HEADER.size
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            position = start + middle * record
+            if data[position:position + width] < key:
+                low = middle + 1
+            else:
+                high = middle
+        position = start + low * record
+        if low == self.count or data[position:position + width] != key:
+            return None
+        return CompiledAccessionID.TAXID.unpack_from(
+            data, position + width)[0]
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+import shutil
+import logging
+import importlib
+import subprocess
+
+
+class Decompressor(object):
+
+    """Open gzipped input files with a choice of decompression backends
+
+    Backends, fastest first:
+
+    - `pigz`, `igzip`: external program, run as a subprocess whose output
+      is read through a pipe. Decompression runs on another core than the
+      parsing.
+    - `isal`, `zlib-ng`: gzip compatible modules of python-isal and
+      zlib-ng, if installed.
+    - `gzip`: module of the standard library, always available.
+    - `none`: the input is not compressed.
+
+    Uncompressed files are read as is, whatever the backend. With `auto`,
+        gzipped files are read with the first available backend.
+
+    Args:
+        backend (:obj:`str`): Backend name, or `auto`. Default `auto`
+
+    Raises:
+        SystemExit: If `backend` is unknown or not available
+
+    Attributes:
+        BACKENDS (:obj:`tuple`): Backend names, fastest first
+        COMMANDS (:obj:`dict`): Command line of the subprocess backends,
+            without the input file
+        MODULES (:obj:`dict`): Module of the python backends, providing a
+            `gzip.open` compatible `open` function
+        MAGIC (:obj:`bytes`): First bytes of a gzipped file
+
+    """
+
+    BACKENDS = ('pigz', 'igzip', 'isal', 'zlib-ng', 'gzip', 'none')
+    COMMANDS = {
+        'pigz': ['pigz', '-d', '-c'],
+        'igzip': ['igzip', '-d', '-c'],
+    }
+    MODULES = {
+        'isal': 'isal.igzip',
+        'zlib-ng': 'zlib_ng.gzip_ng',
+        'gzip': 'gzip',
+    }
+    MAGIC = b'\x1f\x8b'
+
+    def __init__(self, backend='auto'):
+        if backend != 'auto' and backend not in Decompressor.BACKENDS:
+            self.logger.error("Unknown decompression backend %s (choose from "
+                              "auto, %s)" % (backend,
+                                             ', '.join(Decompressor.BACKENDS)))
+            sys.exit(1)
+        if backend != 'auto' and not self.available(backend):
+            self.logger.error("Decompression backend %s is not available"
+                              % backend)
+            sys.exit(1)
+        self.backend = backend
+
+    @property
+    def logger(self):
+        component = "{}.{}".format(type(self).__module__, type(self).__name__)
+        return logging.getLogger(component)
+
+    @staticmethod
+    def available(backend):
+        """Check a backend can be used
+
+        Args:
+            backend (:obj:`str`): Backend name
+
+        Returns:
+            bool: True if the program or module of `backend` is installed
+        """
+        if backend in Decompressor.COMMANDS:
+            return shutil.which(Decompressor.COMMANDS[backend][0]) is not None
+        if backend in Decompressor.MODULES:
+            try:
+                importlib.import_module(Decompressor.MODULES[backend])
+            except ImportError:
+                return False
+        return True
+
+    def select(self, path):
+        """Get the backend used to read a file
+
+        Args:
+            path (:obj:`str`): Input file
+
+        Returns:
+            str: `none` for an uncompressed file, `backend` otherwise, or
+                with `auto` the first available backend
+
+        Raises:
+            SystemExit: If `backend` is `none` and the file is gzipped
+        """
+        with open(path, 'rb') as f:
+            if f.read(len(Decompressor.MAGIC)) != Decompressor.MAGIC:
+                return 'none'
+        if self.backend == 'none':
+            self.logger.error("%s is gzipped, it can't be read with "
+                              "decompression backend none" % path)
+            sys.exit(1)
+        if self.backend != 'auto':
+            return self.backend
+        for backend in Decompressor.BACKENDS:
+            if self.available(backend):
+                return backend
+
+    def open(self, path):
+        """Open a file for reading its decompressed bytes
+
+        Args:
+            path (:obj:`str`): Input file
+
+        Returns:
+            :obj:`DecompressedFile`: binary file object
+        """
+        backend = self.select(path)
+        self.logger.debug("Reading %s with backend %s" % (path, backend))
+        return DecompressedFile(path, backend)
+
+
+class DecompressedFile(object):
+
+    """Decompressed content of a file, read with a `Decompressor` backend
+
+    A binary file object providing `read` and `readline`, which counts the
+        bytes read and the time spent waiting for them. Once closed, the
+        decompression throughput is logged.
+
+    Args:
+        path (:obj:`str`): Input file
+        backend (:obj:`str`): Backend name, see `Decompressor`
+
+    Attributes:
+        size (:obj:`int`): Number of decompressed bytes read
+        elapsed (:obj:`float`): Seconds spent opening and reading the file
+
+    """
+
+    def __init__(self, path, backend):
+        self.path = path
+        self.backend = backend
+        self.size = 0
+        self.process = None
+        start = time.perf_counter()
+        if backend in Decompressor.COMMANDS:
+            self.process = subprocess.Popen(
+                Decompressor.COMMANDS[backend] + [path],
+                stdout=subprocess.PIPE)
+            self.file = self.process.stdout
+        elif backend == 'none':
+            self.file = open(path, 'rb')
+        else:
+            module = importlib.import_module(Decompressor.MODULES[backend])
+            self.file = module.open(path, 'rb')
+        self.elapsed = time.perf_counter() - start
+
+    @property
+    def logger(self):
+        component = "{}.{}".format(type(self).__module__, type(self).__name__)
+        return logging.getLogger(component)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read(self, size=-1):
+        start = time.perf_counter()
+        data = self.file.read(size)
+        self.elapsed += time.perf_counter() - start
+        self.size += len(data)
+        return data
+
+    def readline(self):
+        start = time.perf_counter()
+        line = self.file.readline()
+        self.elapsed += time.perf_counter() - start
+        self.size += len(line)
+        return line
+
+    def throughput(self):
+        """Get the decompression throughput
+
+        Returns:
+            float: decompressed bytes read per second spent reading
+        """
+        return self.size / self.elapsed if self.elapsed else 0.0
+
+    def close(self):
+        """Close the file, and log the throughput
+
+        Raises:
+            SystemExit: If the subprocess of the backend failed
+        """
+        if self.file.closed:
+            return
+        if self.process is not None:
+            finished = not self.file.read(1)
+        self.file.close()
+        if self.process is not None:
+            if not finished:
+                # Closed before the end of the file
+                self.process.kill()
+            if self.process.wait() and finished:
+                self.logger.error("Can't decompress %s: %s exited with status "
+                                  "%d" % (self.path, self.backend,
+                                          self.process.returncode))
+                sys.exit(1)
+        self.logger.info("%s: %.1f MB read in %.1fs (%.1f MB/s, %s)"
+                         % (self.path, self.size / 1e6, self.elapsed,
+                            self.throughput() / 1e6, self.backend))
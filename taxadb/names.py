@@ -1,4 +1,7 @@
-from taxadb.schema import Taxa
+from peewee import Expression, fn
+
+from taxadb import trigram
+from taxadb.util import chunked
 from taxadb.taxadb import TaxaDB
 
 
@@ -9,28 +12,217 @@ class SciName(TaxaDB):
 
     Args:
         **kwargs: Arbitrary arguments. Supported (username, password, port,
-            hostname, config, dbtype, dbname)
+            hostname, config, dbtype, dbname, cache_size) and the database
+            settings of `taxadb.taxadb.TaxaDB`
 
     Raises:
         SystemExit: If table `taxa` does not exist
+
+    Attributes:
+        SEARCH_CANDIDATES (:obj:`int`): Number of candidates fetched from
+            the trigram index per requested result of `search`, before
+            ranking them by similarity
+        synonyms (:obj:`bool`): True if the database contains table `Names`,
+            holding all name classes (synonyms, common names...)
+        trigram_indexes (:obj:`dict`): In-memory trigram indexes
+            (`taxadb.trigram.TrigramIndex`) by table name, built on first
+            `search` if the database has no trigram index
     """
+
+    SEARCH_CANDIDATES = 20
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.check_table_exists(Taxa)
+        self.check_table_exists(self.Taxa)
+        self.synonyms = self.Names.table_exists()
+        self.trigram_indexes = {}
 
-    def taxid(self, sci_name):
+    def taxid(self, sci_name, case_sensitive=True, all_names=False):
         """Get taxid from scientific name
 
         Given a taxid, return its associated scientific name
 
         Args:
             sci_name (:obj:`int`): a scientific name
+            case_sensitive (:obj:`bool`): Match names exactly. If False,
+                names differing by case are matched, exact matches being
+                preferred. Default True
+            all_names (:obj:`bool`): Match names of any class (synonyms,
+                common names...) from table `Names`, scientific names being
+                preferred. Default False
         Returns:
             int: ncbi_taxid, taxid matching scientific name or None if
                 taxid not found
         """
-        try:
-            ncbi_taxid = Taxa.get(Taxa.tax_name == sci_name).ncbi_taxid
-            return ncbi_taxid
-        except Taxa.DoesNotExist:
-            return None
+        return self._cached('taxid', (sci_name, case_sensitive, all_names),
+                            self._taxids, [sci_name], case_sensitive,
+                            all_names).get(sci_name)
+
+    def taxid_many(self, sci_names, case_sensitive=True, all_names=False):
+        """Get taxids from many scientific names
+
+        Given a list of scientific names, yield the names and their
+            associated taxid as tuples. Names are requested `MAX_LIST` at a
+            time, with indexed lookups.
+
+        Args:
+            sci_names (:obj:`iterable`): scientific names, e.g. a list or a
+                generator
+            case_sensitive (:obj:`bool`): Match names exactly, see `taxid`.
+                Default True
+            all_names (:obj:`bool`): Match names of any class, see `taxid`.
+                Default False
+
+        Yields:
+            tuple: (scientific name, taxid), taxid is None if name not found
+
+        """
+        # Read twice, a generator would be exhausted by the first pass
+        sci_names = list(sci_names)
+        taxids = self._taxids(sci_names, case_sensitive=case_sensitive,
+                              all_names=all_names)
+        for sci_name in sci_names:
+            yield (sci_name, taxids.get(sci_name))
+
+    def _name_column(self, all_names):
+        """Get the column holding the names to look up
+
+        Args:
+            all_names (:obj:`bool`): Look up names of any class
+
+        Returns:
+            :obj:`pw.Field`: `Names.name` if `all_names` and table `Names`
+                exists, `Taxa.tax_name` otherwise
+        """
+        if not all_names:
+            return self.Taxa.tax_name
+        if not self.synonyms:
+            self.logger.warning("Table %s does not exist, only scientific "
+                                "names are looked up"
+                                % str(self.Names.get_table_name()))
+            return self.Taxa.tax_name
+        return self.Names.name
+
+    def _taxids(self, sci_names, case_sensitive=True, all_names=False):
+        """Get the taxids of scientific names
+
+        Case-insensitive lookups compare `LOWER(tax_name)`, indexed by
+            `taxadb create`. MySQL default collation being case-insensitive,
+            `tax_name` is compared directly with MySQL. When several taxa
+            match a name, exact matches are preferred, then scientific names,
+            then the lowest taxid.
+
+        Args:
+            sci_names (:obj:`list`): a list of scientific names
+            case_sensitive (:obj:`bool`): Match names exactly. Default True
+            all_names (:obj:`bool`): Match names of any class. Default False
+
+        Returns:
+            dict: scientific name as key, taxid as value. Names not found are
+                missing
+        """
+        column = self._name_column(all_names)
+        model = column.model
+        fields = [model.ncbi_taxid, column]
+        if model is self.Names:
+            fields.append(self.Names.name_class)
+        exact = {}
+        folded = {}
+        mysql = self.get('dbtype') == 'mysql'
+        # Case-insensitive lookups bind each name twice
+        size = TaxaDB.MAX_LIST if case_sensitive else TaxaDB.MAX_LIST // 2
+        for chunk in chunked(set(sci_names), size):
+            lowered = list(set(name.lower() for name in chunk))
+            if case_sensitive:
+                match = column << chunk
+            elif mysql:
+                match = column << chunk + lowered
+            else:
+                match = (column << chunk) | (fn.LOWER(column) << lowered)
+            query = model.select(*fields).where(match)
+            for row in query.tuples():
+                ncbi_taxid, name = row[:2]
+                rank = (len(row) > 2 and row[2] != 'scientific name',
+                        ncbi_taxid)
+                for matches, key in ((exact, name), (folded, name.lower())):
+                    if key not in matches or rank < matches[key]:
+                        matches[key] = rank
+        taxids = {}
+        for sci_name in sci_names:
+            if sci_name in exact:
+                taxids[sci_name] = exact[sci_name][1]
+            elif not case_sensitive and sci_name.lower() in folded:
+                taxids[sci_name] = folded[sci_name.lower()][1]
+        return taxids
+
+    def search(self, name, limit=10, threshold=0.3, all_names=False):
+        """Search scientific names approximately matching a name
+
+        Names are ranked by trigram similarity (see
+            `taxadb.trigram.similarity`), so that misspelled or partial
+            names find their taxa. Candidates are fetched from the trigram
+            index built by `taxadb create --trigram` (SQLite FTS5 or
+            PostgreSQL pg_trgm), or from an in-memory index built on first
+            call otherwise.
+
+        Args:
+            name (:obj:`str`): a name, possibly misspelled or partial
+            limit (:obj:`int`): Maximum number of results. Default 10
+            threshold (:obj:`float`): Minimum similarity, between 0 and 1.
+                Default 0.3
+            all_names (:obj:`bool`): Search names of any class (synonyms,
+                common names...) from table `Names`. Default False
+
+        Returns:
+            list: (taxid, matched name, similarity) tuples, most similar
+                first, one per taxid
+        """
+        column = self._name_column(all_names)
+        model = column.model
+        table = model.get_table_name()
+        size = limit * SciName.SEARCH_CANDIDATES
+        dbtype = self.get('dbtype')
+        if dbtype == 'sqlite' and trigram.FTS_TABLES[table] in \
+                self.database.get_tables():
+            grams = set(name[i:i + 3] for i in range(len(name) - 2))
+            if not grams:
+                return []
+            match = ' OR '.join('"%s"' % gram.replace('"', '""')
+                                for gram in grams)
+            fts = trigram.FTS_TABLES[table]
+            candidates = self.database.execute_sql(
+                'SELECT t.ncbi_taxid, t.%s FROM %s AS f JOIN %s AS t '
+                'ON t.%s = f.rowid WHERE %s MATCH ? ORDER BY f.rank LIMIT ?'
+                % (column.column_name, fts, table,
+                   model._meta.primary_key.column_name, fts),
+                (match, size)).fetchall()
+        elif dbtype == 'postgres' and model.has_index(
+                name=trigram.PG_INDEXES[table]):
+            with self.database.atomic():
+                self.database.execute_sql(
+                    "SELECT set_config('pg_trgm.similarity_threshold', "
+                    "%s, true)", (str(threshold),))
+                candidates = list(model.select(
+                    model.ncbi_taxid, column).where(
+                    Expression(column, '%%', name)).order_by(
+                    fn.similarity(column, name).desc()).limit(
+                    size).tuples())
+        else:
+            if table not in self.trigram_indexes:
+                self.trigram_indexes[table] = trigram.TrigramIndex.load(
+                    column)
+            candidates = []
+            taxids = self.trigram_indexes[table].candidates(name, size)
+            for chunk in chunked(taxids, TaxaDB.MAX_LIST):
+                query = model.select(model.ncbi_taxid, column).where(
+                    model.ncbi_taxid << chunk)
+                candidates.extend(query.tuples())
+        best = {}
+        for ncbi_taxid, candidate in candidates:
+            score = trigram.similarity(name, candidate)
+            if score >= threshold and (ncbi_taxid not in best or
+                                       score > best[ncbi_taxid][2]):
+                best[ncbi_taxid] = (ncbi_taxid, candidate, score)
+        results = sorted(best.values(),
+                         key=lambda result: (-result[2], result[0]))
+        return results[:limit]
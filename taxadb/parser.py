@@ -3,10 +3,17 @@
 
 import os
 import sys
-import gzip
+import queue
 import logging
+import threading
+import multiprocessing
+
+from peewee import fn
 
 from taxadb.schema import Taxa, Accession
+from taxadb.decompress import Decompressor
+from taxadb.taxadb import TaxaDB
+from taxadb.util import chunked
 
 
 class TaxaParser(object):
@@ -35,6 +42,21 @@ class TaxaParser(object):
             data[str(x['ncbi_taxid'])] = True
         return data
 
+    @staticmethod
+    def taxid_bitmap():
+        """Load the taxids of table Taxa into a membership table
+
+        Returns:
+            bytearray: one byte per taxid from 0 to the highest taxid, set
+                to 1 if the taxid is in table Taxa
+
+        """
+        highest = Taxa.select(fn.MAX(Taxa.ncbi_taxid)).scalar()
+        present = bytearray((highest or 0) + 1)
+        for taxid, in Taxa.select(Taxa.ncbi_taxid).tuples().iterator():
+            present[taxid] = 1
+        return present
+
     @staticmethod
     def check_file(element):
         """Make some check on a file
@@ -88,14 +110,41 @@ class TaxaDumpParser(TaxaParser):
         """Parse .dmp files
 
         Parse nodes.dmp and names.dmp files (from taxdump.tgz) and insert
-            taxons in Taxa table.
+            taxons in Taxa table. The whole taxonomy is loaded in memory,
+            prefer `taxa` to stream it.
 
         Args:
             nodes_file (:obj:`str`): Path to nodes.dmp file
             names_file (:obj:`str`): Path to names.dmp file
 
         Returns:
-            list: Zipped data from both files
+            list: taxa as dictionaries, with the columns of table Taxa as keys
+
+        """
+        fields = ('ncbi_taxid', 'parent_taxid', 'tax_name', 'lineage_level')
+        return [dict(zip(fields, row))
+                for row in self.taxa(nodes_file=nodes_file,
+                                     names_file=names_file)]
+
+    def taxa(self, nodes_file=None, names_file=None):
+        """Join nodes.dmp and names.dmp on taxids, as a stream
+
+        Both files are read together, always advancing the one whose last
+            read taxid is the lowest, and each row is kept in a hash table
+            until the row of the other file with the same taxid is read
+            (symmetric hash join). As NCBI sorts both files by taxid, only
+            a handful of rows are pending at a time, while files sorted in
+            any other order are still joined correctly. Taxa already in
+            table Taxa are skipped, as well as taxids found in only one
+            file, which are reported once both files are read.
+
+        Args:
+            nodes_file (:obj:`str`): Path to nodes.dmp file
+            names_file (:obj:`str`): Path to names.dmp file
+
+        Yields:
+            tuple: (ncbi_taxid, parent_taxid, tax_name, lineage_level), in
+                the order of the columns of table Taxa
 
         """
         if nodes_file is None:
@@ -104,51 +153,93 @@ class TaxaDumpParser(TaxaParser):
             names_file = self.names_file
         self.check_file(names_file)
         self.check_file(nodes_file)
-        # parse nodes.dmp
-        nodes_data = list()
         self.logger.debug("Loading taxa data ...")
-        ncbi_ids = self.cache_taxids()
+        present = self.taxid_bitmap()
+        nodes = self.nodes(nodes_file)
+        names = ((taxid, name) for taxid, name, name_class
+                 in self.names(names_file)
+                 if name_class == 'scientific name')
+        pending_nodes = {}
+        pending_names = {}
+        node = next(nodes, None)
+        name = next(names, None)
+        while node is not None or name is not None:
+            if name is None or (node is not None and node[0] <= name[0]):
+                taxid = node[0]
+                if taxid in pending_names:
+                    row = (taxid, node[1], pending_names.pop(taxid), node[2])
+                else:
+                    pending_nodes[taxid] = node
+                    row = None
+                node = next(nodes, None)
+            else:
+                taxid = name[0]
+                if taxid in pending_nodes:
+                    row = pending_nodes.pop(taxid)
+                    row = (taxid, row[1], name[1], row[2])
+                else:
+                    pending_names[taxid] = name[1]
+                    row = None
+                name = next(names, None)
+            if row is not None and not (taxid < len(present) and
+                                        present[taxid]):
+                yield row
+        if pending_nodes:
+            self.logger.warning("%d taxa of %s without scientific name "
+                                "skipped (e.g. %d)"
+                                % (len(pending_nodes), nodes_file,
+                                   min(pending_nodes)))
+        if pending_names:
+            self.logger.warning("%d scientific names of %s without taxon "
+                                "skipped (e.g. %d)"
+                                % (len(pending_names), names_file,
+                                   min(pending_names)))
+        self.logger.debug('merge successful')
+
+    def nodes(self, nodes_file=None):
+        """Parse nodes.dmp
+
+        Args:
+            nodes_file (:obj:`str`): Path to nodes.dmp file
+
+        Yields:
+            tuple: (ncbi_taxid, parent_taxid, lineage_level)
+
+        """
+        if nodes_file is None:
+            nodes_file = self.nodes_file
+        self.check_file(nodes_file)
         self.logger.debug("Parsing %s" % str(nodes_file))
         with open(nodes_file, 'r') as f:
             for line in f:
-                line_list = line.split('|')
-                ncbi_id = line_list[0].strip('\t')
-                if ncbi_id in ncbi_ids:
-                    continue
-                data_dict = {
-                    'ncbi_taxid': ncbi_id,
-                    'parent_taxid': line_list[1].strip('\t'),
-                    'tax_name': '',
-                    'lineage_level': line_list[2].strip('\t')
-                }
-                nodes_data.append(data_dict)
+                line_list = line.split('\t|\t', 3)
+                yield (int(line_list[0]), int(line_list[1]), line_list[2])
         self.logger.info('Parsed nodes.dmp')
 
-        # parse names.dmp
-        names_data = list()
+    def names(self, names_file=None):
+        """Parse all name classes of names.dmp
+
+        Unlike `taxdump`, which only keeps scientific names, synonyms,
+            common names, authorities and other name classes are kept.
+
+        Args:
+            names_file (:obj:`str`): Path to names.dmp file
+
+        Yields:
+            tuple: (ncbi_taxid, name, name class)
+
+        """
+        if names_file is None:
+            names_file = self.names_file
+        self.check_file(names_file)
         self.logger.debug("Parsing %s" % str(names_file))
         with open(names_file, 'r') as f:
             for line in f:
-                if 'scientific name' in line:
-                    line_list = line.split('|')
-                    ncbi_id = line_list[0].strip('\t')
-                    if ncbi_id in ncbi_ids:
-                        continue
-                    data_dict = {
-                        'ncbi_taxid': line_list[0].strip('\t'),
-                        'tax_name': line_list[1].strip('\t')
-                    }
-                    names_data.append(data_dict)
+                line_list = line.split('\t|\t')
+                yield (int(line_list[0]), line_list[1],
+                       line_list[3].rstrip('\t|\n'))
         self.logger.info('Parsed names.dmp')
 
-        # merge the two dictionaries
-        taxa_info_list = list()
-        for nodes, names in zip(nodes_data, names_data):
-            taxa_info = {**nodes, **names}  # PEP 448, requires python 3.5
-            taxa_info_list.append(taxa_info)
-        self.logger.debug('merge successful')
-        return taxa_info_list
-
     def set_nodes_file(self, nodes_file):
         """Set nodes_file
 
@@ -205,83 +296,284 @@ class Accession2TaxidParser(TaxaParser):
         chunk (:obj:`int`): Chunk insert size. Default 500
         fast (:obj:`bool`): Directly load accession into database, do not check
                             existence.
+        decompress (:obj:`str`): Decompression backend, see
+            `taxadb.decompress.Decompressor`. Default `auto`
+        workers (:obj:`int`): Number of processes parsing blocks. Default 1,
+            blocks are parsed by the calling process
+
+    Raises:
+        SystemExit: If `workers` is lower than 1
+
+    Attributes:
+        BLOCK_SIZE (:obj:`int`): Number of decompressed bytes parsed at a
+            time
+        TIMEOUT (:obj:`float`): Seconds between checks of the reader and
+            worker processes, while waiting for them
     """
 
-    def __init__(self, acc_file=None, chunk=500, fast=False, **kwargs):
+    BLOCK_SIZE = 4 * 1024 * 1024
+    TIMEOUT = 1.0
+
+    def __init__(self, acc_file=None, chunk=500, fast=False,
+                 decompress='auto', workers=1, **kwargs):
         super().__init__(**kwargs)
         self.acc_file = acc_file
         self.chunk = chunk
         self.fast = fast
+        self.decompressor = Decompressor(decompress)
+        if workers < 1:
+            self.logger.error("Number of workers must be at least 1")
+            sys.exit(1)
+        self.workers = workers
 
     def accession2taxid(self, acc2taxid=None, chunk=None):
         """Parses the accession2taxid files
 
-        This method parses the accession2taxid file, build a dictionary,
-            stores it in a list and yield for insertion in the database.
-
-        ::
-
-            {
-                'accession': accession_id_from_file,
-                'taxid': associated_taxonomic_id
-            }
+        This method parses the accession2taxid file and yields chunks of
+            (accession, taxid) tuples for insertion in the database.
+            Accessions mapped to a taxid missing from table Taxa (e.g.
+            AAA22826, mapped to 0) are skipped. Unless `fast` is set,
+            accessions already in table Accession, or already read, are
+            skipped too.
 
+        The file is read with the `decompress` backend, `BLOCK_SIZE`
+            decompressed bytes at a time, and each block of complete lines is
+            split into columns at once (see `_parse_block`), instead of line
+            by line. With several `workers`, blocks are parsed by worker
+            processes (see `_parse_parallel`), while the calling process
+            checks and inserts the rows.
 
         Args:
-            acc2taxid (:obj:`str`): Path to acc2taxid input file (gzipped)
+            acc2taxid (:obj:`str`): Path to acc2taxid input file (gzipped,
+                or uncompressed)
             chunk (:obj:`int`): Chunk size of entries to gather before
                 yielding. Default 500 (set at object construction)
 
         Yields:
-            list: Chunk size of read entries
+            list: Chunk size of read entries, as (accession, taxid) tuples
 
         """
-        # Some accessions (e.g.: AAA22826) have a taxid = 0
-        entries = []
-        counter = 0
-        taxids = self.cache_taxids()
-        if not self.fast:
-            accessions = {}
         if acc2taxid is None:
             acc2taxid = self.acc_file
         self.check_file(acc2taxid)
         if chunk is None:
             chunk = self.chunk
+        present = self.taxid_bitmap()
+        seen = set()
         self.logger.debug("Parsing %s" % str(acc2taxid))
-        self.logger.debug("Fast mode %s" % "ON" if self.fast else "OFF")
-        with gzip.open(acc2taxid, 'rb') as f:
-            f.readline()  # discard the header
-            for line in f:
-                line_list = line.decode().rstrip('\n').split('\t')
-                # Check the taxid already exists and get its id
-                if line_list[2] not in taxids:
-                    continue
-                # In case of an update or parsing an already inserted list of
-                # accessions
-                if not self.fast:
-                    if line_list[0] in accessions:
-                        continue
-                    try:
-                        Accession.get(Accession.accession == line_list[0])
-                    except Accession.DoesNotExist:
-                        accessions[line_list[0]] = True
-                    data_dict = {
-                        'accession': line_list[0],
-                        'taxid': line_list[2]
-                    }
-                else:
-                    data_dict = {
-                        'accession': line_list[0],
-                        'taxid': line_list[2]
-                    }
-                entries.append(data_dict)
-                counter += 1
-                if counter == chunk:
-                    yield(entries)
-                    entries = []
-                    counter = 0
+        self.logger.debug("Fast mode %s" % ("ON" if self.fast else "OFF"))
+        if self.workers > 1:
+            blocks = self._parse_parallel(acc2taxid, present)
+        else:
+            blocks = self._parse_serial(acc2taxid, present)
+        entries = []
+        for rows in blocks:
+            if not self.fast:
+                rows = self._new_accessions(rows, seen)
+            entries.extend(rows)
+            start = 0
+            while len(entries) - start >= chunk:
+                yield entries[start:start + chunk]
+                start += chunk
+            entries = entries[start:]
         if len(entries):
-            yield(entries)
+            yield entries
+
+    @staticmethod
+    def _read_blocks(f):
+        """Read an accession2taxid file by blocks of complete lines
+
+        Args:
+            f (:obj:`taxadb.decompress.DecompressedFile`): Opened file
+
+        Yields:
+            bytes: `BLOCK_SIZE` bytes, completed to the end of their last
+                line. The header is skipped
+        """
+        f.readline()  # discard the header
+        while True:
+            block = f.read(Accession2TaxidParser.BLOCK_SIZE)
+            if not block:
+                break
+            # Complete the last line of the block
+            yield block + f.readline()
+
+    def _parse_serial(self, acc2taxid, present):
+        """Parse the blocks of a file in the calling process
+
+        Args:
+            acc2taxid (:obj:`str`): Path to acc2taxid input file
+            present (:obj:`bytearray`): Taxids membership table
+
+        Yields:
+            list: (accession, taxid) tuples of a block
+        """
+        with self.decompressor.open(acc2taxid) as f:
+            for block in self._read_blocks(f):
+                yield self._parse_block(block, present)
+
+    def _parse_parallel(self, acc2taxid, present):
+        """Parse the blocks of a file with worker processes
+
+        A pipeline of three stages, connected by queues of at most `workers`
+            items, so that a slow stage holds the others back instead of
+            filling memory:
+
+        - a reader thread decompresses the file and queues its blocks;
+        - `workers` processes parse blocks (see `_parse_worker`);
+        - the calling process yields the parsed blocks in file order.
+
+        Args:
+            acc2taxid (:obj:`str`): Path to acc2taxid input file
+            present (:obj:`bytearray`): Taxids membership table
+
+        Yields:
+            list: (accession, taxid) tuples of a block
+
+        Raises:
+            SystemExit: If the file can't be read, or a worker failed
+        """
+        tasks = multiprocessing.Queue(self.workers)
+        results = multiprocessing.Queue(self.workers)
+        # Workers are started before any thread, as they may be forked
+        processes = [multiprocessing.Process(
+            target=_parse_worker, args=(tasks, results, present), daemon=True)
+            for _ in range(self.workers)]
+        for process in processes:
+            process.start()
+        stop = threading.Event()
+        state = {'blocks': None, 'error': None}
+
+        def put(item):
+            # Give up once the pipeline is stopped
+            while not stop.is_set():
+                try:
+                    tasks.put(item, timeout=Accession2TaxidParser.TIMEOUT)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def read():
+            try:
+                index = 0
+                with self.decompressor.open(acc2taxid) as f:
+                    for block in self._read_blocks(f):
+                        if not put((index, block)):
+                            return
+                        index += 1
+                state['blocks'] = index
+            except BaseException as err:
+                state['error'] = err
+            finally:
+                for process in processes:
+                    put(None)
+
+        reader = threading.Thread(target=read, daemon=True)
+        reader.start()
+        pending = {}
+        index = 0
+        try:
+            while state['blocks'] is None or index < state['blocks']:
+                if index in pending:
+                    yield pending.pop(index)
+                    index += 1
+                    continue
+                try:
+                    position, rows = results.get(
+                        timeout=Accession2TaxidParser.TIMEOUT)
+                    pending[position] = rows
+                except queue.Empty:
+                    error = state['error']
+                    if error is not None:
+                        # SystemExit errors are already logged
+                        if not isinstance(error, SystemExit):
+                            self.logger.error("Can't read %s: %s"
+                                              % (acc2taxid, str(error)))
+                        sys.exit(1)
+                    if any(process.exitcode for process in processes):
+                        self.logger.error("A worker failed to parse %s"
+                                          % acc2taxid)
+                        sys.exit(1)
+        finally:
+            stop.set()
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+            # Don't wait for blocks still queued for terminated workers
+            tasks.cancel_join_thread()
+            reader.join()
+
+    @staticmethod
+    def _parse_block(block, present):
+        """Parse a block of complete lines of an accession2taxid file
+
+        Lines have four columns (accession, accession.version, taxid, gi).
+            The whole block is decoded and split into fields at once, so
+            that accessions and taxids are every fourth field. If the block
+            has malformed lines (missing columns, or a taxid that is not an
+            integer), it is split line by line instead, and the malformed
+            lines are skipped with a warning.
+
+        Args:
+            block (:obj:`bytes`): Complete lines
+            present (:obj:`bytearray`): Taxids membership table, see
+                `taxid_bitmap`
+
+        Returns:
+            list: (accession, taxid) tuples of the taxids in `present`
+        """
+        text = block.decode()
+        if not text.endswith('\n'):
+            text += '\n'
+        fields = text.replace('\n', '\t').split('\t')
+        try:
+            if len(fields) % 4 != 1:
+                raise ValueError("lines without four columns")
+            rows = zip(fields[0:-1:4], list(map(int, fields[2:-1:4])))
+        except ValueError as err:
+            # Malformed lines, split lines one by one
+            rows = []
+            skipped = 0
+            for line in text.splitlines():
+                line_list = line.split('\t')
+                try:
+                    rows.append((line_list[0], int(line_list[2])))
+                except (IndexError, ValueError):
+                    if line:
+                        skipped += 1
+            logging.getLogger(__name__).warning(
+                "Malformed lines in block (%s), %d line(s) skipped"
+                % (str(err), skipped))
+        size = len(present)
+        return [(accession, taxid) for accession, taxid in rows
+                if 0 <= taxid < size and present[taxid]]
+
+    @staticmethod
+    def _new_accessions(rows, seen):
+        """Drop accessions already in table Accession or already read
+
+        Accessions are looked up in the database `MAX_LIST` at a time.
+
+        Args:
+            rows (:obj:`list`): (accession, taxid) tuples
+            seen (:obj:`set`): Accessions already read, updated with the
+                new ones
+
+        Returns:
+            list: (accession, taxid) tuples of new accessions
+        """
+        new = []
+        for batch in chunked(rows, TaxaDB.MAX_LIST):
+            query = Accession.select(Accession.accession).where(
+                Accession.accession << [row[0] for row in batch])
+            existing = set(accession for accession, in query.tuples())
+            for row in batch:
+                if row[0] not in existing and row[0] not in seen:
+                    seen.add(row[0])
+                    new.append(row)
+        return new
 
     def set_accession_file(self, acc_file):
         """Set the accession file to use
@@ -301,3 +593,18 @@ class Accession2TaxidParser(TaxaParser):
         self.check_file(acc_file)
         self.acc_file = acc_file
         return True
+
+
+def _parse_worker(tasks, results, present):
+    """Parse blocks of an accession2taxid file, in a worker process
+
+    Args:
+        tasks (:obj:`multiprocessing.Queue`): (index, block) tuples, then
+            None once all blocks are queued
+        results (:obj:`multiprocessing.Queue`): (index, rows) tuples, see
+            `Accession2TaxidParser._parse_block`
+        present (:obj:`bytearray`): Taxids membership table
+    """
+    for index, block in iter(tasks.get, None):
+        results.put((index, Accession2TaxidParser._parse_block(block,
+                                                                present)))
@@ -4,6 +4,9 @@
 import os
 import peewee as pw
 
+from urllib.request import pathname2url
+
+from playhouse.pool import PooledMySQLDatabase, PooledSqliteDatabase
 from configparser import ConfigParser, NoSectionError
 
 
@@ -51,7 +54,7 @@ class BaseModel(pw.Model):
 
     @classmethod
     def _has_named_index(cls, name):
-        indexes = db.get_indexes(cls.get_table_name())
+        indexes = cls._meta.database.get_indexes(cls.get_table_name())
         for idx in indexes:
             if idx[0] == name:
                 return True
@@ -61,7 +64,7 @@ class BaseModel(pw.Model):
     def _has_columns_index(cls, columns):
         if type(columns) is not list:
             return False
-        indexes = db.get_indexes(cls.get_table_name())
+        indexes = cls._meta.database.get_indexes(cls.get_table_name())
         for idx in indexes:
             if sorted(columns) == sorted(idx[2]):
                 return True
@@ -84,6 +87,11 @@ class Taxa(BaseModel):
         lineage_level (:obj:`pw.CharField`): the level of lineage of
             the taxon (from nodes.dmp)
 
+    Columns `parent_taxid` and `tax_name` are indexed by `taxadb create`,
+        once the table is filled, as well as `LOWER(tax_name)` for
+        case-insensitive name lookups (except with MySQL, whose default
+        collation is already case-insensitive).
+
     """
 
     ncbi_taxid = pw.IntegerField(null=False, primary_key=True, unique=True)
@@ -112,6 +120,101 @@ class Accession(BaseModel):
     accession = pw.CharField(null=False, unique=True)
 
 
+class Names(BaseModel):
+
+    """table Names.
+
+    Each row is a name of a taxon, of any name class (scientific name,
+        synonym, common name, authority...).
+
+    Attributes:
+        id (:obj:`pw.PrimaryKeyField`): the primary key
+        ncbi_taxid (:obj:`pw.IntegerField`): the TaxID of the taxon
+        name (:obj:`pw.CharField`): the name (from names.dmp)
+        name_class (:obj:`pw.CharField`): the class of the name (from
+            names.dmp)
+
+    Columns `ncbi_taxid`, `name` and `LOWER(name)` (except with MySQL) are
+        indexed by `taxadb create`, once the table is filled.
+
+    """
+
+    id = pw.PrimaryKeyField()
+    ncbi_taxid = pw.IntegerField(null=False)
+    name = pw.CharField(null=False)
+    name_class = pw.CharField(null=False)
+
+
+class AccessionBatch(BaseModel):
+
+    """table AccessionBatch.
+
+    Temporary table, private to a database connection, used to join a large
+        batch of requested accession numbers against table Accession in a
+        single statement.
+
+    Attributes:
+        accession (:obj:`pw.CharField`): a requested accession number
+
+    """
+
+    accession = pw.CharField(null=False)
+
+    class Meta:
+        temporary = True
+        primary_key = False
+
+
+class Lineage(BaseModel):
+
+    """table Lineage.
+
+    Each row is a taxon with its precomputed lineage and nested set
+        interval. This table is optional and built by
+        `taxadb create --lineage`.
+
+    Attributes:
+        ncbi_taxid (:obj:`pw.IntegerField`): the TaxID of the taxon
+        path (:obj:`pw.TextField`): comma separated taxids of the lineage,
+            from the taxon up to the root (root excluded)
+        lft (:obj:`pw.IntegerField`): pre-order number of the taxon
+        rgt (:obj:`pw.IntegerField`): greatest pre-order number of the
+            descendants of the taxon. Descendants of a taxon have their `lft`
+            between its `lft` and `rgt`
+
+    """
+
+    ncbi_taxid = pw.IntegerField(null=False, primary_key=True)
+    path = pw.TextField()
+    lft = pw.IntegerField(index=True)
+    rgt = pw.IntegerField()
+
+
+MODELS = (Taxa, Accession, Names, AccessionBatch, Lineage)
+
+
+def bind_models(database):
+    """Get copies of the models bound to a database
+
+    Models of this module are bound to the proxy `db`, shared by the whole
+        process. Copies are subclasses reading the same tables, so that
+        several databases can be queried side by side.
+
+    Args:
+        database (:obj:`pw.Database`): Database to bind the models to
+
+    Returns:
+        dict: model name as key, bound model as value
+    """
+    models = {}
+    for model in MODELS:
+        meta = type('Meta', (object,), {
+            'database': database, 'table_name': model._meta.table_name})
+        models[model.__name__] = type(model.__name__, (model,), {
+            'Meta': meta, '__module__': model.__module__})
+    return models
+
+
 class DatabaseFactory(object):
 
     """Database factory to support multiple database type.
@@ -119,10 +222,28 @@ class DatabaseFactory(object):
     This class may be used to create a database for different type (SQLite,
         PostgreSQL, MySQL).
 
+    SQLite databases are opened with a page cache of `sqlite_cache_size`
+        KiB (default 64000) and, if set, up to `mmap_size` bytes
+        memory-mapped. The journal mode is stored in the file, and is only
+        changed if `journal_mode` is set (e.g. WAL while `taxadb create`
+        fills it), so that queries never switch a file back to a mode with
+        side files. When `read_only` is set, the file is opened read-only
+        (URI `mode=ro`) and only queried (`query_only`). When `immutable` is
+        set, the file is also assumed never to change (URI `immutable=1`),
+        so that SQLite takes no lock and creates no side file, e.g. for a
+        file shared by many processes over NFS.
+
+    When `pool_size` is set, the database is a connection pool
+        (`playhouse.pool`) of at most `pool_size` connections. Each thread
+        checks a connection out on its first query and returns it to the
+        pool when closing it. Connections idle for more than
+        `stale_timeout` seconds are recycled.
+
     Args:
         config (:obj:`str`): Path to configuration file.
         **kwargs: Arbitrary arguments. Supported (username, password, port,
-            hostname)
+            hostname, pool_size, stale_timeout, read_only, immutable,
+            mmap_size, sqlite_cache_size, journal_mode)
     Raises:
         AttributeError: If error occurred during database object build
 
@@ -156,10 +277,34 @@ class DatabaseFactory(object):
                 (if `--dbtype [postgres|mysql]`)
 
         """
+        # Keyword arguments of the database class
+        options = {}
+        pool = self.getint('pool_size', fallback=0) > 0
+        if pool:
+            options = {'max_connections': self.getint('pool_size'),
+                       'stale_timeout': self.getint('stale_timeout')}
         if self.get('dbtype') == 'sqlite':
-            return pw.SqliteDatabase(self.get('dbname'),
-                                     pragmas={'journal_mode': 'wal',
-                                              'cache_size': -1 * 64000})
+            database = pw.SqliteDatabase
+            if pool:
+                # Pooled connections are handed from a thread to another
+                database = PooledSqliteDatabase
+                options['check_same_thread'] = False
+            name = self.get('dbname')
+            pragmas = {}
+            if self.getboolean('read_only') or self.getboolean('immutable'):
+                mode = 'immutable=1' if self.getboolean('immutable') \
+                    else 'mode=ro'
+                name = 'file:%s?%s' % (pathname2url(os.path.abspath(name)),
+                                       mode)
+                options['uri'] = True
+                pragmas['query_only'] = 1
+            elif self.get('journal_mode'):
+                pragmas['journal_mode'] = self.get('journal_mode')
+            pragmas['cache_size'] = -1 * self.getint('sqlite_cache_size',
+                                                     fallback=64000)
+            if self.getint('mmap_size') is not None:
+                pragmas['mmap_size'] = self.getint('mmap_size')
+            return database(name, pragmas=pragmas, **options)
         else:
             if self.get('username') is None or self.get('password') is None:
                 raise AttributeError('[ERROR] dbtype %s requires username and'
@@ -169,21 +314,31 @@ class DatabaseFactory(object):
             if self.get('dbtype') == 'mysql':
                 if self.get('port') is None or self.get('port') == '':
                     self.set('port', str(3306))
-                return pw.MySQLDatabase(
+                database = PooledMySQLDatabase if pool else pw.MySQLDatabase
+                return database(
                     self.get('dbname'),
                     user=self.get('username'),
                     password=self.get('password'),
                     host=self.get('hostname'),
-                    port=int(self.get('port')))
+                    port=int(self.get('port')), **options)
             elif self.get('dbtype') == 'postgres':
                 if self.get('port') is None or self.get('port') == '':
                     self.set('port', str(5432))
-                return pw.PostgresqlDatabase(
+                # Extended database class, needed for server-side cursors
+                try:
+                    from playhouse.postgres_ext import PostgresqlExtDatabase
+                    from playhouse.pool import PooledPostgresqlExtDatabase
+                except ImportError as err:
+                    raise AttributeError('[ERROR] dbtype postgres requires '
+                                         'psycopg2: %s\n' % str(err))
+                database = PooledPostgresqlExtDatabase if pool else \
+                    PostgresqlExtDatabase
+                return database(
                     self.get('dbname'),
                     user=self.get('username'),
                     password=self.get('password'),
                     host=self.get('hostname'),
-                    port=int(self.get('port')))
+                    port=int(self.get('port')), **options)
 
     def get(self, name, section=DEFAULT_SECTION):
         """Get a database connection setting
@@ -207,6 +362,42 @@ class DatabaseFactory(object):
                 return value
         return None
 
+    def getboolean(self, name, section=DEFAULT_SECTION, fallback=False):
+        """Get a database setting as a boolean
+
+        Args:
+            name (:obj:`str`): Database setting to request
+            section (:obj:`str`): Section to look for, default 'DBSETTINGS'
+            fallback (:obj:`bool`): Value returned if setting is not set
+        Returns:
+            value (:obj:`bool`)
+        """
+        value = self.get(name, section=section)
+        if value is None:
+            return fallback
+        return ConfigParser.BOOLEAN_STATES.get(value.lower(), fallback)
+
+    def getint(self, name, section=DEFAULT_SECTION, fallback=None):
+        """Get a database setting as an integer
+
+        Args:
+            name (:obj:`str`): Database setting to request
+            section (:obj:`str`): Section to look for, default 'DBSETTINGS'
+            fallback (:obj:`int`): Value returned if setting is not set
+        Returns:
+            value (:obj:`int`)
+        Raises:
+            AttributeError: If the setting is not an integer
+        """
+        value = self.get(name, section=section)
+        if value is None or value == '':
+            return fallback
+        try:
+            return int(value)
+        except ValueError:
+            raise AttributeError("Setting '%s' must be an integer, got '%s'"
+                                 % (name, value))
+
     def set(self, option, value, section=DEFAULT_SECTION):
         """Set a configuration value
 
@@ -1,9 +1,12 @@
 import sys
 import logging
 
-from peewee import PeeweeException
+from peewee import PeeweeException, Value
 
-from taxadb.schema import db, DatabaseFactory
+from taxadb.cache import LRUCache
+from taxadb.util import chunked, stream
+from taxadb.schema import db, bind_models, DatabaseFactory
+from taxadb.tree import TaxaTree
 
 
 class TaxaDB(object):
@@ -13,17 +16,41 @@ class TaxaDB(object):
     Parent class of the Taxadb application. Use this class to create inheriting
     classes.
 
+    Each instance queries its own database object, through copies of the
+    models of `taxadb.schema` bound to it, so that instances connected to
+    different databases can be used side by side. The models of
+    `taxadb.schema` themselves are bound to the database of the last built
+    instance.
+
     Args:
         **kwargs: Arbitrary arguments. Supported (username, password, port,
-            hostname, config, dbtype, dbname)
+            hostname, config, dbtype, dbname, in_memory, cte, cache_size,
+            pool_size, stale_timeout, read_only, immutable, mmap_size,
+            sqlite_cache_size)
 
     Raises:
         AttributeError: If cannot instantiate `taxadb.schema.DatabaseFactory`.
     Attributes:
         MAX_LIST (:obj:`int`): Maximum number of bind variables to pass to
             request methods. Due to SQLite limit of passed arguments to a
-            statement, we limit number of accession and taxid to
-            request to 999 (https://www.sqlite.org/c3ref/bind_blob.html)
+            statement, accessions and taxids are requested by chunks of
+            999 (https://www.sqlite.org/c3ref/bind_blob.html)
+        database (:obj:`pw.Database`): Database of the instance, a
+            connection pool if `pool_size` is set (see
+            `taxadb.schema.DatabaseFactory`)
+        Taxa, Accession, Names, AccessionBatch, Lineage (:obj:`pw.Model`):
+            Models of `taxadb.schema` bound to `database`
+        read_only (:obj:`bool`): True if the SQLite database is opened
+            read-only, with `read_only` or `immutable`
+        tree (:obj:`taxadb.tree.TaxaTree`): In-memory taxonomy tree, loaded
+            once at object build when `in_memory` is set. None otherwise
+        materialized (:obj:`bool`): True if the database contains the
+            precomputed `Lineage` table
+        recursive (:obj:`bool`): Resolve lineages with a recursive common
+            table expression (`WITH RECURSIVE`), in a single statement. Set
+            with `cte`, requires SQLite >= 3.8.3, PostgreSQL or MySQL >= 8.0
+        cache (:obj:`taxadb.cache.LRUCache`): Cache of query results, holding
+            at most `cache_size` entries. None if `cache_size` is not set
     """
 
     MAX_LIST = 999
@@ -40,15 +67,33 @@ class TaxaDB(object):
             self.database = self.dbfact.get_database()
             self.db = db
             self.db.initialize(self.database)
-            self.db.connect()
+            self.database.connect()
         except (AttributeError, PeeweeException) as err:
             self.logger.error("Can't create database object: %s" % str(err))
             sys.exit(1)
+        models = bind_models(self.database)
+        self.Taxa = models['Taxa']
+        self.Accession = models['Accession']
+        self.Names = models['Names']
+        self.AccessionBatch = models['AccessionBatch']
+        self.Lineage = models['Lineage']
+        self.read_only = self.get('dbtype') == 'sqlite' and (
+            self.getboolean('read_only') or self.getboolean('immutable'))
+        self.tree = None
+        if self.getboolean('in_memory'):
+            self.tree = TaxaTree.load(self.Taxa)
+        self.materialized = self.Lineage.table_exists()
+        self.recursive = self.getboolean('cte')
+        self.cache = None
+        cache_size = self.getint('cache_size', fallback=0)
+        if cache_size > 0:
+            self.cache = LRUCache(cache_size)
 
     def __del__(self):
         """Ensure database connection is closed"""
-        if self.db and self.db is not None and not self.db.is_closed():
-            self.db.close()
+        if self.db and self.db is not None and \
+                not self.database.is_closed():
+            self.database.close()
 
     def check_table_exists(cls, table):
         """Check a table exists in the database
@@ -99,6 +144,22 @@ class TaxaDB(object):
         value = self.dbfact.get(name)
         return value
 
+    def getboolean(self, name, fallback=False):
+        """Get a database setting from the connection arguments as a boolean
+
+        Returns:
+            value (:obj:`bool`) if found, `fallback` otherwise
+        """
+        return self.dbfact.getboolean(name, fallback=fallback)
+
+    def getint(self, name, fallback=None):
+        """Get a database setting from the connection arguments as an integer
+
+        Returns:
+            value (:obj:`int`) if found, `fallback` otherwise
+        """
+        return self.dbfact.getint(name, fallback=fallback)
+
     def set(self, option, value, section=DatabaseFactory.DEFAULT_SECTION):
         """Set a configuration value
 
@@ -112,6 +173,28 @@ class TaxaDB(object):
         """
         return self.dbfact.set(option, value, section=section)
 
+    def _cached(self, namespace, key, func, *args):
+        """Get a query result from cache, or compute and cache it
+
+        Args:
+            namespace (:obj:`str`): Cache namespace, the name of the cached
+                method
+            key: Cache key
+            func (:obj:`callable`): Function computing the result if not
+                cached
+            *args: Arguments passed to `func`
+
+        Returns:
+            result of `func`
+        """
+        if self.cache is None:
+            return func(*args)
+        value = self.cache.get(namespace, key)
+        if value is LRUCache.MISSING:
+            value = func(*args)
+            self.cache.put(namespace, key, value)
+        return value
+
     def _unmapped_taxid(self, acc, do_exit=False):
         """Prints error message to stderr if an accession number is not
         mapped with a taxid
@@ -129,3 +212,234 @@ class TaxaDB(object):
         if do_exit:
             sys.exit(1)
         return True
+
+    def _lineage(self, taxid):
+        """Get the taxa from a taxid up to the root, root excluded
+
+        Uses the in-memory tree if loaded, then the precomputed `Lineage`
+            table if it exists, then a recursive query if enabled, and walks
+            the taxa table otherwise.
+
+        Args:
+            taxid (:obj:`int`): a taxid
+
+        Returns:
+            list: (ncbi_taxid, tax_name, lineage_level) tuples, or None if
+                taxid or one of its parents not found
+        """
+        if self.tree is not None:
+            lineage = self.tree.lineage(taxid)
+            if lineage is None:
+                return None
+            return [(ncbi_taxid, self.tree.name(ncbi_taxid),
+                     self.tree.rank(ncbi_taxid)) for ncbi_taxid in lineage]
+        if self.materialized:
+            try:
+                path = self.Lineage.get(
+                    self.Lineage.ncbi_taxid == taxid).path
+            except self.Lineage.DoesNotExist:
+                return None
+            lineage = [int(ncbi_taxid) for ncbi_taxid in path.split(',')
+                       if ncbi_taxid]
+            query = self.Taxa.select(
+                self.Taxa.ncbi_taxid, self.Taxa.tax_name,
+                self.Taxa.lineage_level).where(
+                self.Taxa.ncbi_taxid << lineage)
+            nodes = {node[0]: node for node in query.tuples()}
+            return [nodes[ncbi_taxid] for ncbi_taxid in lineage]
+        if self.recursive:
+            return self._recursive_lineages([taxid])[taxid]
+        lineage = []
+        try:
+            node = self.Taxa.get(self.Taxa.ncbi_taxid == taxid)
+            while node.parent_taxid != node.ncbi_taxid:
+                lineage.append(
+                    (node.ncbi_taxid, node.tax_name, node.lineage_level))
+                node = self.Taxa.get(
+                    self.Taxa.ncbi_taxid == node.parent_taxid)
+        except self.Taxa.DoesNotExist:
+            return None
+        return lineage
+
+    def _lineages(self, taxids, nodes=None):
+        """Get the lineages of many taxids at once
+
+        Lineages are walked together, one level at a time, with one query
+            per level (and per `MAX_LIST` taxids). Ancestors shared by several
+            lineages are only requested once.
+
+        Args:
+            taxids (:obj:`list`): a list of taxids
+            nodes (:obj:`dict`): Taxa rows already requested, by taxid. It is
+                filled with the rows requested by this call, so that a caller
+                resolving lineages batch after batch can share ancestors
+                between batches. Default None
+
+        Returns:
+            dict: taxid as key, list of (ncbi_taxid, tax_name, lineage_level)
+                tuples as value (see `_lineage`), None if taxid or one of its
+                parents not found
+        """
+        taxids = set(taxids)
+        if nodes is None:
+            nodes = {}
+        if self.tree is not None:
+            return {taxid: self._lineage(taxid) for taxid in taxids}
+        if self.materialized:
+            paths = {}
+            for chunk in chunked(taxids, TaxaDB.MAX_LIST):
+                query = self.Lineage.select(
+                    self.Lineage.ncbi_taxid, self.Lineage.path).where(
+                    self.Lineage.ncbi_taxid << chunk)
+                for ncbi_taxid, path in query.tuples():
+                    paths[ncbi_taxid] = [int(parent) for parent
+                                         in path.split(',') if parent]
+            ancestors = set(parent for path in paths.values()
+                            for parent in path) - nodes.keys()
+            for chunk in chunked(ancestors, TaxaDB.MAX_LIST):
+                query = self.Taxa.select(
+                    self.Taxa.ncbi_taxid, self.Taxa.tax_name,
+                    self.Taxa.lineage_level, self.Taxa.parent_taxid).where(
+                    self.Taxa.ncbi_taxid << chunk)
+                for node in query.tuples():
+                    nodes[node[0]] = node
+            return {taxid: [nodes[parent][:3] for parent in paths[taxid]]
+                    if taxid in paths else None for taxid in taxids}
+        if self.recursive:
+            lineages = {}
+            for chunk in chunked(taxids, TaxaDB.MAX_LIST):
+                lineages.update(self._recursive_lineages(chunk))
+            return lineages
+        # Walk all lineages together, one level at a time
+        requested = set(nodes)
+        level = taxids - requested
+        while level:
+            requested.update(level)
+            for chunk in chunked(level, TaxaDB.MAX_LIST):
+                query = self.Taxa.select(
+                    self.Taxa.ncbi_taxid, self.Taxa.tax_name,
+                    self.Taxa.lineage_level, self.Taxa.parent_taxid).where(
+                    self.Taxa.ncbi_taxid << chunk)
+                for node in query.tuples():
+                    nodes[node[0]] = node
+            level = set(nodes[taxid][3] for taxid in level
+                        if taxid in nodes) - requested
+        lineages = {}
+        for taxid in taxids:
+            lineage = []
+            node = nodes.get(taxid)
+            while node is not None and node[3] != node[0]:
+                lineage.append(node[:3])
+                node = nodes.get(node[3])
+            lineages[taxid] = lineage if node is not None else None
+        return lineages
+
+    def _recursive_lineages(self, taxids):
+        """Get lineages with a single recursive query
+
+        A recursive common table expression walks up from each requested
+            taxid over `Taxa.parent_taxid`, so that the database returns all
+            lineages in one statement.
+
+        Args:
+            taxids (:obj:`list`): a list of taxids, at most `MAX_LIST`
+
+        Returns:
+            dict: taxid as key, lineage as value (see `_lineages`)
+        """
+        columns = (self.Taxa.ncbi_taxid, self.Taxa.tax_name,
+                   self.Taxa.lineage_level, self.Taxa.parent_taxid)
+        base = self.Taxa.select(
+            *columns, self.Taxa.ncbi_taxid.alias('origin'),
+            Value(0).alias('depth')).where(
+            self.Taxa.ncbi_taxid << list(taxids)).cte(
+            'lineage', recursive=True,
+            columns=('ncbi_taxid', 'tax_name', 'lineage_level',
+                     'parent_taxid', 'origin', 'depth'))
+        parent = self.Taxa.alias()
+        recursive = parent.select(
+            parent.ncbi_taxid, parent.tax_name, parent.lineage_level,
+            parent.parent_taxid, base.c.origin, base.c.depth + 1).join(
+            base, on=(parent.ncbi_taxid == base.c.parent_taxid)).where(
+            base.c.ncbi_taxid != base.c.parent_taxid)
+        cte = base.union_all(recursive)
+        query = cte.select_from(
+            cte.c.origin, cte.c.ncbi_taxid, cte.c.tax_name,
+            cte.c.lineage_level, cte.c.parent_taxid).order_by(
+            cte.c.origin, cte.c.depth)
+        lineages = dict((taxid, None) for taxid in taxids)
+        walked = {}
+        for origin, ncbi_taxid, name, rank, parent_taxid in query.tuples():
+            if ncbi_taxid == parent_taxid:
+                # Reached the root, the lineage is complete
+                lineages[origin] = walked.get(origin, [])
+            else:
+                walked.setdefault(origin, []).append((ncbi_taxid, name, rank))
+        return lineages
+
+    def _descendants(self, taxid, ranks=None):
+        """Walk the subtree of a taxid
+
+        Uses the in-memory tree if loaded, then a range scan over the nested
+            set intervals of table `Lineage` if it exists, and walks the taxa
+            table one level at a time otherwise.
+
+        Args:
+            taxid (:obj:`int`): a taxid
+            ranks (:obj:`list`): Lineage levels to keep. Default None, all
+
+        Yields:
+            int: taxids of all descendants of `taxid`, `taxid` excluded
+        """
+        if self.tree is not None:
+            for ncbi_taxid in self.tree.descendants(taxid):
+                if ranks is None or self.tree.rank(ncbi_taxid) in ranks:
+                    yield ncbi_taxid
+            return
+        if self.materialized:
+            try:
+                clade = self.Lineage.get(self.Lineage.ncbi_taxid == taxid)
+            except self.Lineage.DoesNotExist:
+                return
+            query = self.Lineage.select(self.Lineage.ncbi_taxid).where(
+                self.Lineage.lft > clade.lft, self.Lineage.lft <= clade.rgt)
+            if ranks is not None:
+                query = query.join(
+                    self.Taxa, on=(self.Lineage.ncbi_taxid ==
+                                   self.Taxa.ncbi_taxid)).where(
+                    self.Taxa.lineage_level << list(ranks))
+            query = query.order_by(self.Lineage.lft).tuples()
+            for ncbi_taxid, in self._stream(query):
+                yield ncbi_taxid
+            return
+        level = [taxid]
+        while level:
+            children = []
+            for chunk in chunked(level, TaxaDB.MAX_LIST):
+                query = self.Taxa.select(
+                    self.Taxa.ncbi_taxid, self.Taxa.lineage_level).where(
+                    self.Taxa.parent_taxid << chunk,
+                    self.Taxa.ncbi_taxid != self.Taxa.parent_taxid).tuples()
+                for ncbi_taxid, rank in query.iterator():
+                    children.append(ncbi_taxid)
+                    if ranks is None or rank in ranks:
+                        yield ncbi_taxid
+            level = children
+
+    def _stream(self, query, private=False):
+        """Iterate over the rows of a query without caching them
+
+        See `taxadb.util.stream`: rows are fetched in batches with
+            PostgreSQL, and read one at a time on a dedicated connection
+            with MySQL, unless the query reads tables private to the
+            connection.
+
+        Args:
+            query (:obj:`pw.SelectQuery`): query to run
+            private (:obj:`bool`): Query reads tables private to the
+                connection (e.g. a temporary table). Default False
+
+        Returns:
+            iterator: query rows
+        """
+        return stream(query, self.get('dbtype'), private=private)
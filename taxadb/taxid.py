@@ -1,5 +1,6 @@
-from taxadb.schema import Taxa
+from taxadb.util import chunked
 from taxadb.taxadb import TaxaDB
+from taxadb.tree import TaxaTree
 
 
 class TaxID(TaxaDB):
@@ -10,7 +11,8 @@ class TaxID(TaxaDB):
 
     Args:
         **kwargs: Arbitrary arguments. Supported (username, password, port,
-            hostname, config, dbtype, dbname)
+            hostname, config, dbtype, dbname, in_memory, cte, cache_size) and
+            the database settings of `taxadb.taxadb.TaxaDB`
 
     Raises:
         SystemExit: If table `taxa` does not exist
@@ -19,7 +21,9 @@ class TaxID(TaxaDB):
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.check_table_exists(Taxa)
+        self.check_table_exists(self.Taxa)
+        # Tree of the LCA queries, loaded on first use unless `in_memory`
+        self._lca_tree = self.tree
 
     def sci_name(self, taxid):
         """Get taxonomic scientific name for taxonomy id
@@ -32,11 +36,7 @@ class TaxID(TaxaDB):
             str: name, scientific name or None if taxid not found
 
         """
-        try:
-            name = Taxa.get(Taxa.ncbi_taxid == taxid).tax_name
-            return name
-        except Taxa.DoesNotExist:
-            return None
+        return self._cached('sci_name', taxid, self._sci_name, taxid)
 
     def lineage_id(self, taxid, ranks=False, reverse=False):
         """Get lineage for a taxonomic id
@@ -55,30 +55,8 @@ class TaxID(TaxaDB):
                 taxid not found
 
         """
-        try:
-            lineages = []
-            # lineage_list = []
-            current_lineage = Taxa.get(Taxa.ncbi_taxid == taxid).tax_name
-            current_lineage_id = Taxa.get(Taxa.ncbi_taxid == taxid).ncbi_taxid
-            parent = Taxa.get(Taxa.ncbi_taxid == taxid).parent_taxid
-            rank = Taxa.get(Taxa.ncbi_taxid == taxid).lineage_level
-            while current_lineage != 'root':
-                if ranks:
-                    lineages.append((rank, current_lineage_id))
-                else:
-                    lineages.append(current_lineage_id)
-
-                new_query = Taxa.get(Taxa.ncbi_taxid == parent)
-
-                current_lineage = new_query.tax_name
-                current_lineage_id = new_query.ncbi_taxid
-                parent = new_query.parent_taxid
-                rank = new_query.lineage_level
-            if reverse is True and ranks is False:
-                lineages.reverse()
-            return lineages
-        except Taxa.DoesNotExist:
-            return None
+        lineage = self._cached('lineage_id', taxid, self._lineage, taxid)
+        return self._format_lineage(lineage, 0, ranks=ranks, reverse=reverse)
 
     def lineage_name(self, taxid, ranks=False, reverse=False):
         """Get a lineage name for a taxonomic id
@@ -97,26 +75,8 @@ class TaxID(TaxaDB):
                 taxid not found
 
         """
-        try:
-            lineages = []
-            current_lineage = Taxa.get(Taxa.ncbi_taxid == taxid).tax_name
-            parent = Taxa.get(Taxa.ncbi_taxid == taxid).parent_taxid
-            rank = Taxa.get(Taxa.ncbi_taxid == taxid).lineage_level
-            while current_lineage != 'root':
-                if ranks:
-                    lineages.append((rank, current_lineage))
-                else:
-                    lineages.append(current_lineage)
-                new_query = Taxa.get(Taxa.ncbi_taxid == parent)
-
-                current_lineage = new_query.tax_name
-                parent = new_query.parent_taxid
-                rank = new_query.lineage_level
-            if reverse is True and ranks is False:
-                lineages.reverse()
-            return lineages
-        except Taxa.DoesNotExist:
-            return None
+        lineage = self._cached('lineage_name', taxid, self._lineage, taxid)
+        return self._format_lineage(lineage, 1, ranks=ranks, reverse=reverse)
 
     def has_parent(self, taxid, parent):
         """Check if a taxid has a parent in its lineage
@@ -132,11 +92,290 @@ class TaxID(TaxaDB):
             bool: True if the taxid contains the parent in its lineage, False
                 otherwise. None if taxid not found
         """
-        lineage_id = self.lineage_id(taxid)
-        lineage_name = self.lineage_name(taxid)
-        if lineage_id is None:
+        if self.tree is None and self.materialized:
+            # Intervals are keyed by integer taxids, also accept a taxid
+            # given as a string
+            taxid = int(taxid)
+            intervals = self._intervals([taxid])
+            if taxid not in intervals:
+                return None
+            return self._in_intervals(intervals[taxid],
+                                      self._parent_intervals(parent))
+        return self._in_lineage(self._lineage(taxid), parent)
+
+    def sci_name_many(self, taxids):
+        """Get taxonomic scientific names for many taxonomy ids
+
+        Given a list of taxids, yield the taxids and their associated
+            scientific name as tuples. Taxids are requested `MAX_LIST` at
+            a time.
+
+        Args:
+            taxids (:obj:`iterable`): taxids, e.g. a list or a generator
+
+        Yields:
+            tuple: (taxid, scientific name), name is None if taxid not found
+
+        """
+        # Read twice, a generator would be exhausted by the first pass
+        taxids = list(taxids)
+        if self.tree is not None:
+            for taxid in taxids:
+                yield (taxid, self.tree.name(taxid))
+            return
+        names = {}
+        for chunk in chunked(set(taxids), TaxaDB.MAX_LIST):
+            query = self.Taxa.select(
+                self.Taxa.ncbi_taxid, self.Taxa.tax_name).where(
+                self.Taxa.ncbi_taxid << chunk)
+            names.update(query.tuples())
+        for taxid in taxids:
+            yield (taxid, names.get(taxid))
+
+    def lineage_id_many(self, taxids, ranks=False, reverse=False):
+        """Get lineages for many taxonomic ids
+
+        Given a list of taxids, yield the taxids and their associated lineage
+            (see `lineage_id`) as tuples. All lineages are walked together,
+            one level at a time.
+
+        Args:
+            taxids (:obj:`iterable`): taxids, e.g. a list or a generator
+            ranks (:obj:`bool`): Wether to return the the tax ranks or
+                not. Default False
+            reverse (:obj:`bool`): Inverted lineage, from top to bottom
+                taxonomy hierarchy. Default False
+
+        Yields:
+            tuple: (taxid, lineage list), lineage is None if taxid not found
+
+        """
+        taxids = list(taxids)
+        lineages = self._lineages(taxids)
+        for taxid in taxids:
+            yield (taxid, self._format_lineage(lineages[taxid], 0,
+                                               ranks=ranks, reverse=reverse))
+
+    def lineage_name_many(self, taxids, ranks=False, reverse=False):
+        """Get lineage names for many taxonomic ids
+
+        Given a list of taxids, yield the taxids and their associated lineage
+            (see `lineage_name`) as tuples. All lineages are walked together,
+            one level at a time.
+
+        Args:
+            taxids (:obj:`iterable`): taxids, e.g. a list or a generator
+            ranks (:obj:`bool`): Wether to return the tax ranks or
+                not. Default False
+            reverse (:obj:`bool`): Inverted lineage, from top to bottom
+                taxonomy hierarchy. Default False
+
+        Yields:
+            tuple: (taxid, lineage name), lineage is None if taxid not found
+
+        """
+        taxids = list(taxids)
+        lineages = self._lineages(taxids)
+        for taxid in taxids:
+            yield (taxid, self._format_lineage(lineages[taxid], 1,
+                                               ranks=ranks, reverse=reverse))
+
+    def has_parent_many(self, taxids, parent):
+        """Check if many taxids have a parent in their lineage
+
+        Args:
+            taxids (:obj:`iterable`): taxids, e.g. a list or a generator
+            parent (:obj:`int|str`): taxid or scientific name
+
+        Yields:
+            tuple: (taxid, bool), see `has_parent`
+
+        """
+        taxids = list(taxids)
+        # Results are keyed by integer taxids, also accept taxids given as
+        # strings
+        ncbi_taxids = [int(taxid) for taxid in taxids]
+        if self.tree is None and self.materialized:
+            intervals = self._intervals(ncbi_taxids)
+            parents = self._parent_intervals(parent)
+            for taxid, ncbi_taxid in zip(taxids, ncbi_taxids):
+                if ncbi_taxid not in intervals:
+                    yield (taxid, None)
+                else:
+                    yield (taxid, self._in_intervals(intervals[ncbi_taxid],
+                                                     parents))
+            return
+        lineages = self._lineages(ncbi_taxids)
+        for taxid, ncbi_taxid in zip(taxids, ncbi_taxids):
+            yield (taxid, self._in_lineage(lineages[ncbi_taxid], parent))
+
+    def descendants(self, taxid, ranks=None):
+        """Get all taxids under a clade
+
+        Given a taxid, yield the taxids of all the taxa below it. Results are
+            streamed from a range scan over table `Lineage` when the database
+            was built with `--lineage`.
+
+        Args:
+            taxid (:obj:`int`): a taxid
+            ranks (:obj:`list`): Lineage levels to keep (e.g. ['species']).
+                Default None, all ranks
+
+        Yields:
+            int: descendant taxid, `taxid` excluded. Nothing if taxid not
+                found
+
+        """
+        for ncbi_taxid in self._descendants(taxid, ranks=ranks):
+            yield ncbi_taxid
+
+    def lca(self, taxid1, taxid2):
+        """Get the lowest common ancestor of two taxids
+
+        Queries are answered from the in-memory taxonomy tree, which is
+            loaded on first call if `in_memory` is not set, in constant time
+            once the tree has built its Euler tour. The compiled tree of
+            `taxadb.compiled.CompiledTaxID` builds none: its queries climb
+            the lineages, in time proportional to the depth of the taxa
+            (see `taxadb.tree.TaxaTree.lca_many`).
+
+        Args:
+            taxid1 (:obj:`int`): a taxid
+            taxid2 (:obj:`int`): a taxid
+
+        Returns:
+            int: taxid of the lowest common ancestor, None if a taxid is not
+                found
+
+        """
+        return self.lca_many([taxid1, taxid2])
+
+    def lca_many(self, taxids):
+        """Get the lowest common ancestor of a set of taxids
+
+        See `lca`.
+
+        Args:
+            taxids (:obj:`list`): a list of taxids
+
+        Returns:
+            int: taxid of the lowest common ancestor, None if `taxids` is
+                empty or a taxid is not found
+
+        """
+        if self._lca_tree is None:
+            self._lca_tree = TaxaTree.load(self.Taxa)
+        return self._lca_tree.lca_many(taxids)
+
+    def _sci_name(self, taxid):
+        """Get the scientific name of a taxid, see `sci_name`"""
+        if self.tree is not None:
+            return self.tree.name(taxid)
+        try:
+            name = self.Taxa.get(self.Taxa.ncbi_taxid == taxid).tax_name
+            return name
+        except self.Taxa.DoesNotExist:
             return None
-        if parent in lineage_id[1:] or parent in lineage_name[1:]:
-            return True
+
+    def _intervals(self, taxids):
+        """Get nested set intervals of taxids from table Lineage
+
+        Args:
+            taxids (:obj:`list`): a list of taxids
+
+        Returns:
+            dict: taxid as key, (lft, rgt) as value. Taxids not found are
+                missing
+        """
+        intervals = {}
+        for chunk in chunked(set(taxids), TaxaDB.MAX_LIST):
+            query = self.Lineage.select(
+                self.Lineage.ncbi_taxid, self.Lineage.lft,
+                self.Lineage.rgt).where(
+                self.Lineage.ncbi_taxid << chunk)
+            for ncbi_taxid, lft, rgt in query.tuples():
+                intervals[ncbi_taxid] = (lft, rgt)
+        return intervals
+
+    def _parent_intervals(self, parent):
+        """Get nested set intervals of the taxa matching a parent
+
+        The root is not considered a parent, as it is not part of lineages.
+
+        Args:
+            parent (:obj:`int|str`): taxid or scientific name
+
+        Returns:
+            list: (lft, rgt) tuples
+        """
+        if isinstance(parent, str):
+            match = self.Taxa.tax_name == parent
         else:
-            return False
+            match = self.Taxa.ncbi_taxid == parent
+        query = self.Lineage.select(self.Lineage.lft, self.Lineage.rgt).join(
+            self.Taxa,
+            on=(self.Lineage.ncbi_taxid == self.Taxa.ncbi_taxid)).where(
+            match, self.Taxa.ncbi_taxid != self.Taxa.parent_taxid)
+        return list(query.tuples())
+
+    @staticmethod
+    def _in_intervals(interval, parents):
+        """Check a nested set interval is strictly within a parent interval
+
+        Args:
+            interval (:obj:`tuple`): (lft, rgt) of a taxon
+            parents (:obj:`list`): (lft, rgt) tuples of candidate parents
+
+        Returns:
+            bool: True if a candidate is a parent of the taxon
+        """
+        lft, rgt = interval
+        for parent_lft, parent_rgt in parents:
+            if parent_lft < lft and rgt <= parent_rgt:
+                return True
+        return False
+
+    @staticmethod
+    def _format_lineage(lineage, field, ranks=False, reverse=False):
+        """Format a lineage as returned by `TaxaDB._lineage`
+
+        Args:
+            lineage (:obj:`list`): (ncbi_taxid, tax_name, lineage_level)
+                tuples
+            field (:obj:`int`): Index of the field to return, 0 for taxids,
+                1 for names
+            ranks (:obj:`bool`): Return (rank, field) tuples. Default False
+            reverse (:obj:`bool`): Inverted lineage, ignored if `ranks`.
+                Default False
+
+        Returns:
+            list: formatted lineage, None if `lineage` is None
+        """
+        if lineage is None:
+            return None
+        if ranks:
+            return [(node[2], node[field]) for node in lineage]
+        lineages = [node[field] for node in lineage]
+        if reverse is True:
+            lineages.reverse()
+        return lineages
+
+    @staticmethod
+    def _in_lineage(lineage, parent):
+        """Check a taxid or name is a parent in a lineage
+
+        Args:
+            lineage (:obj:`list`): (ncbi_taxid, tax_name, lineage_level)
+                tuples
+            parent (:obj:`int|str`): taxid or scientific name
+
+        Returns:
+            bool: True if found in lineage (first taxon excluded), None if
+                `lineage` is None
+        """
+        if lineage is None:
+            return None
+        for ncbi_taxid, name, _ in lineage[1:]:
+            if parent == ncbi_taxid or parent == name:
+                return True
+        return False
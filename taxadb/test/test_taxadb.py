@@ -2,19 +2,41 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
+import gzip
+import asyncio
+import argparse
+import shutil
+import tempfile
 import unittest
 
+from concurrent.futures import ThreadPoolExecutor
+from peewee import OperationalError
+from playhouse.pool import PooledDatabase
+
+from taxadb.tree import TaxaTree
+from taxadb.bloom import BloomFilter
+from taxadb.cache import LRUCache
 from taxadb.taxid import TaxID
+from taxadb.compiled import CompiledAccessionID, CompiledTaxID
+from taxadb.decompress import Decompressor
 from taxadb.names import SciName
 from taxadb.taxadb import TaxaDB
-from taxadb.util import md5_check
-from taxadb.schema import Accession, Taxa
+from taxadb.util import chunked, md5_check
+from taxadb.app import build_bloom, build_lineage, build_names, \
+    build_trigram, bulk_chunk, compile_accessions, max_variables, \
+    restore_settings, set_bulk_settings
+from taxadb.trigram import similarity, trigrams
+from taxadb.schema import Accession, AccessionBatch, Taxa, Lineage, Names
 from taxadb.accessionid import AccessionID
 from taxadb.parser import TaxaParser, TaxaDumpParser, Accession2TaxidParser
 
 from testconfig import config
 from nose.plugins.attrib import attr
 
+if sys.version_info >= (3, 6):
+    from taxadb.aio import AsyncAccessionID, AsyncSciName, AsyncTaxID
+
 
 class TestMainFunc(unittest.TestCase):
     """Class to test global methods"""
@@ -54,6 +76,78 @@ class TestUtils(unittest.TestCase):
             md5_check(badfile)
 
 
+class TestLRUCache(unittest.TestCase):
+    """Class to test taxadb.cache"""
+
+    @attr('cache')
+    def test_cache_eviction(self):
+        """Check least recently used entries are evicted first"""
+        cache = LRUCache(2)
+        cache.put('sci_name', 1, 'root')
+        cache.put('sci_name', 2, 'Bacteria')
+        self.assertEqual(cache.get('sci_name', 1), 'root')
+        cache.put('taxid', 'root', 1)
+        self.assertIs(cache.get('sci_name', 2), LRUCache.MISSING)
+        self.assertEqual(cache.get('taxid', 'root'), 1)
+        self.assertDictEqual(cache.stats(), {
+            'hits': 2, 'misses': 1, 'evictions': 1, 'size': 2,
+            'maxsize': 2})
+
+    @attr('cache')
+    def test_cache_none(self):
+        """Check None is a valid cached value"""
+        cache = LRUCache(2)
+        cache.put('sci_name', 6, None)
+        self.assertIsNone(cache.get('sci_name', 6))
+        self.assertIsNone(cache.get('sci_name', 7, None))
+
+    @attr('cache')
+    def test_cache_invalidate(self):
+        """Check entries are removed by namespace or all at once"""
+        cache = LRUCache(10)
+        cache.put('sci_name', 1, 'root')
+        cache.put('taxid', 'root', 1)
+        cache.invalidate('sci_name')
+        self.assertEqual(len(cache), 1)
+        self.assertIs(cache.get('sci_name', 1), LRUCache.MISSING)
+        cache.invalidate()
+        self.assertEqual(len(cache), 0)
+
+
+class TestBloomFilter(unittest.TestCase):
+    """Class to test taxadb.bloom"""
+
+    @attr('bloom')
+    def test_bloom_membership(self):
+        """Check added keys are found and most others are not"""
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add('A%d' % i)
+        self.assertEqual(len(bloom), 1000)
+        self.assertTrue(all('A%d' % i in bloom for i in range(1000)))
+        false_positives = sum('B%d' % i in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+        self.assertAlmostEqual(bloom.false_positive_rate(), 0.01, places=2)
+
+    @attr('bloom')
+    def test_bloom_save_load(self):
+        """Check a saved filter answers the same once loaded"""
+        path = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                            'test.bloom')
+        self.addCleanup(os.unlink, path)
+        bloom = BloomFilter(10, 0.05)
+        bloom.add('X17276')
+        bloom.save(path)
+        loaded = BloomFilter.load(path)
+        self.assertEqual((loaded.size, loaded.hashes, len(loaded)),
+                         (bloom.size, bloom.hashes, 1))
+        self.assertIn('X17276', loaded)
+        with self.assertRaises(SystemExit):
+            BloomFilter.load(path + '.missing')
+        with self.assertRaises(SystemExit):
+            BloomFilter(10, 1.5)
+
+
 class TestTaxadb(unittest.TestCase):
     """Main class to test AccessionID and TaxID method with sqlite"""
 
@@ -104,10 +198,10 @@ class TestTaxadb(unittest.TestCase):
         """Remove previously stuff set"""
         self._set_config_back()
 
-    def _buildTaxaDBObject(self, obj):
+    def _buildTaxaDBObject(self, obj, **kwargs):
         sql = obj(dbname=self.dbname, dbtype=self.dbtype,
                   username=self.username, password=self.password,
-                  hostname=self.hostname, port=self.port)
+                  hostname=self.hostname, port=self.port, **kwargs)
         return sql
 
     def _unset_user_env(self):
@@ -458,6 +552,131 @@ class TestTaxadb(unittest.TestCase):
         name = taxid.lineage_name(0000, reverse=True)
         self.assertIsNone(name)
 
+    @attr('taxid')
+    def test_taxid_in_memory_sci_name(self):
+        taxid = self._buildTaxaDBObject(TaxID, in_memory=True)
+        self.assertIsNotNone(taxid.tree)
+        self.assertEqual(taxid.sci_name(37572), 'Papilionoidea')
+        self.assertIsNone(taxid.sci_name(0000))
+
+    @attr('taxid')
+    def test_taxid_in_memory_lineage_id_reverse(self):
+        taxid = self._buildTaxaDBObject(TaxID, in_memory=True)
+        lineage = taxid.lineage_id(9986, reverse=True)
+        self.assertListEqual(lineage, [
+            131567, 2759, 33154, 33208, 6072, 33213, 33511, 7711, 89593,
+            7742, 7776, 117570, 117571, 8287, 1338369, 32523, 32524, 40674,
+            32525, 9347, 1437010, 314146, 314147, 9975, 9979, 9984, 9986])
+        self.assertIsNone(taxid.lineage_id(0000))
+
+    @attr('taxid')
+    def test_taxid_in_memory_lineage_name_ranks(self):
+        taxid = self._buildTaxaDBObject(TaxID, in_memory=True)
+        lineage = taxid.lineage_name(33208, ranks=True)
+        self.assertListEqual(lineage, [('kingdom', 'Metazoa'),
+                                       ('no rank', 'Opisthokonta'),
+                                       ('superkingdom', 'Eukaryota'),
+                                       ('no rank', 'cellular organisms')])
+
+    @attr('taxid')
+    def test_taxid_in_memory_has_parent(self):
+        taxid = self._buildTaxaDBObject(TaxID, in_memory=True)
+        self.assertTrue(taxid.has_parent(37572, 'Insecta'))
+        self.assertFalse(taxid.has_parent(33208, 'Insecta'))
+        self.assertIsNone(taxid.has_parent(0000, 'Insecta'))
+
+    @attr('taxid')
+    def test_taxid_cte_lineage_id_ranks(self):
+        taxid = self._buildTaxaDBObject(TaxID, cte=True)
+        self.assertTrue(taxid.recursive)
+        lineage = taxid.lineage_id(33208, ranks=True)
+        self.assertListEqual(lineage, [('kingdom', 33208), ('no rank', 33154),
+                                       ('superkingdom', 2759),
+                                       ('no rank', 131567)])
+        self.assertIsNone(taxid.lineage_id(0000, ranks=True))
+
+    @attr('accessionid')
+    def test_accession_cte_lineage_name(self):
+        accession = self._buildTaxaDBObject(AccessionID, cte=True)
+        lineage_name = dict(accession.lineage_name(['X60065']))
+        self.assertEqual(lineage_name['X60065'][0:3],
+                         ['Bos taurus', 'Bos', 'Bovinae'])
+        self.assertEqual(lineage_name['X60065'][-1], 'cellular organisms')
+
+    @attr('taxid')
+    def test_taxid_lca(self):
+        taxid = self._buildTaxaDBObject(TaxID)
+        self.assertEqual(taxid.lca(9986, 33208), 33208)
+        self.assertEqual(taxid.lca(9986, 37572), 33213)
+        self.assertEqual(taxid.lca_many([9986, 33208, 37572]), 33208)
+        self.assertIsNone(taxid.lca(9986, 0000))
+
+    @attr('taxid')
+    def test_taxid_descendants(self):
+        taxid = self._buildTaxaDBObject(TaxID)
+        descendants = list(taxid.descendants(33208))
+        self.assertIn(9986, descendants)
+        self.assertIn(37572, descendants)
+        self.assertNotIn(33208, descendants)
+        species = list(taxid.descendants(9984, ranks=['species']))
+        self.assertIn(9986, species)
+        self.assertListEqual(list(taxid.descendants(0000)), [])
+
+    @attr('accessionid')
+    def test_accession_taxid_iterable(self):
+        """Check method accepts generators longer than MAX_LIST"""
+        accession = self._buildTaxaDBObject(AccessionID)
+        accs = (acc for acc in ['X17276'] + ['%d' % i for i in range(1500)])
+        self.assertListEqual(list(accession.taxid(accs)), [('X17276', 9646)])
+
+    @attr('accessionid')
+    def test_accession_sci_name_bulk(self):
+        """Check large batches are joined through a temporary table"""
+        accession = self._buildTaxaDBObject(AccessionID, bulk_threshold=2)
+        self.assertEqual(accession.bulk_threshold, 2)
+        names = dict(accession.sci_name(['Z12029', 'X17276', '111111']))
+        self.assertDictEqual(names, {'Z12029': 'Bos indicus',
+                                     'X17276': accession.sci_name(
+                                         ['X17276']).__next__()[1]})
+
+    @attr('accessionid')
+    def test_accession_in_clade(self):
+        accession = self._buildTaxaDBObject(AccessionID)
+        accessions = list(accession.in_clade(9913))
+        self.assertIn(('X60065', 9913), accessions)
+        self.assertListEqual(list(accession.in_clade(0000)), [])
+
+    @attr('taxid')
+    def test_taxid_sci_name_many(self):
+        taxid = self._buildTaxaDBObject(TaxID)
+        names = list(taxid.sci_name_many([37572, 0000, 33208]))
+        self.assertListEqual(names, [(37572, 'Papilionoidea'), (0000, None),
+                                     (33208, 'Metazoa')])
+
+    @attr('taxid')
+    def test_taxid_lineage_name_many(self):
+        taxid = self._buildTaxaDBObject(TaxID)
+        lineages = list(taxid.lineage_name_many([33208, 0000]))
+        self.assertListEqual(lineages, [
+            (33208, ['Metazoa', 'Opisthokonta', 'Eukaryota',
+                     'cellular organisms']),
+            (0000, None)])
+
+    @attr('taxid')
+    def test_taxid_lineage_id_many_reverse(self):
+        taxid = self._buildTaxaDBObject(TaxID)
+        lineages = dict(taxid.lineage_id_many([9986, 33208], reverse=True))
+        self.assertListEqual(lineages[33208], [131567, 2759, 33154, 33208])
+        self.assertListEqual(lineages[9986], taxid.lineage_id(9986,
+                                                              reverse=True))
+
+    @attr('taxid')
+    def test_taxid_has_parent_many(self):
+        taxid = self._buildTaxaDBObject(TaxID)
+        parents = list(taxid.has_parent_many([37572, 33208, 0000], 'Insecta'))
+        self.assertListEqual(parents, [(37572, True), (33208, False),
+                                       (0000, None)])
+
     @attr('taxid')
     def test_taxid_unmapped_taxid_throws(self):
         """Check method throws SystemExit on demand"""
@@ -512,6 +731,42 @@ class TestTaxadbParser(unittest.TestCase):
         l = dp.taxdump()
         self.assertEqual(len(l), 14)
 
+    @attr('parser')
+    def test_taxadumpparser_taxa_unordered(self):
+        """Check taxa are joined on taxids whatever the order of the files"""
+        db = TaxaDB(dbtype='sqlite', dbname=self.testdb)
+        db.db.create_tables([Taxa])
+        dp = TaxaDumpParser(nodes_file=self.nodes, names_file=self.names)
+        taxa = sorted(dp.taxa())
+        self.assertEqual(len(taxa), 14)
+        self.assertEqual(taxa[0], (1, 1, 'root', 'no rank'))
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        nodes = os.path.join(directory, 'nodes.dmp')
+        names = os.path.join(directory, 'names.dmp')
+        with open(self.nodes) as f:
+            lines = f.readlines()
+        with open(nodes, 'w') as f:
+            # Reversed, without the first taxon
+            f.writelines(reversed(lines[1:]))
+        with open(self.names) as f:
+            lines = f.readlines()
+        with open(names, 'w') as f:
+            f.writelines(lines[1::2] + lines[::2])
+        with self.assertLogs(level='WARNING') as logs:
+            shuffled = sorted(dp.taxa(nodes_file=nodes, names_file=names))
+        self.assertEqual(len(logs.output), 1)
+        self.assertListEqual(shuffled, taxa[1:])
+
+    @attr('parser')
+    def test_taxadumpparser_names(self):
+        """Check all name classes are parsed"""
+        dp = TaxaDumpParser(names_file=self.names)
+        names = list(dp.names())
+        self.assertEqual(len(names), 77)
+        self.assertTupleEqual(names[0], (1, 'all', 'synonym'))
+        self.assertIn((2, 'eubacteria', 'genbank common name'), names)
+
     @attr('parser')
     def test_taxadumpparser_setnodes_throws(self):
         """Check method throws when None arg is given"""
@@ -568,6 +823,126 @@ class TestTaxadbParser(unittest.TestCase):
             total_entrires += len(accs)
         self.assertEqual(total_entrires, 55211)
 
+    @attr('parser')
+    def test_accessionparser_workers(self):
+        """Check worker processes yield the same entries as the calling
+        process, in file order"""
+        db = TaxaDB(dbtype='sqlite', dbname=self.testdb)
+        db.db.create_tables([Taxa, Accession])
+        tp = TaxaDumpParser(nodes_file=self.nodes, names_file=self.names)
+        with db.db.atomic():
+            for chunk in chunked(tp.taxa(), self.chunk):
+                Taxa.insert_many(chunk, fields=[
+                    Taxa.ncbi_taxid, Taxa.parent_taxid, Taxa.tax_name,
+                    Taxa.lineage_level]).execute()
+        block_size = Accession2TaxidParser.BLOCK_SIZE
+        # Small blocks, so that each worker parses several of them
+        Accession2TaxidParser.BLOCK_SIZE = 64 * 1024
+        try:
+            entries = {}
+            for workers in [1, 3]:
+                ap = Accession2TaxidParser(acc_file=self.acc, chunk=1000,
+                                           workers=workers)
+                entries[workers] = [row for chunk in ap.accession2taxid()
+                                    for row in chunk]
+            self.assertEqual(len(entries[1]), 55211)
+            self.assertListEqual(entries[1], entries[3])
+            # Stop before the end of the file
+            ap = Accession2TaxidParser(acc_file=self.acc, chunk=10,
+                                       workers=3)
+            rows = ap.accession2taxid()
+            self.assertListEqual(next(rows), entries[1][:10])
+            rows.close()
+        finally:
+            Accession2TaxidParser.BLOCK_SIZE = block_size
+        with self.assertRaises(SystemExit):
+            Accession2TaxidParser(acc_file=self.acc, workers=0)
+
+    @attr('parser')
+    def test_accessionparser_parse_block(self):
+        """Check a block is split into (accession, taxid) tuples of known
+        taxids"""
+        present = bytearray(5)
+        present[1] = present[4] = 1
+        block = b'A1\tA1.1\t1\t10\nA2\tA2.1\t0\t11\nA3\tA3.1\t7\t12\n' \
+            b'A4\tA4.1\t4\t13'
+        self.assertListEqual(Accession2TaxidParser._parse_block(
+            block, present), [('A1', 1), ('A4', 4)])
+        # Malformed lines are parsed one by one, and skipped
+        block = b'A1\tA1.1\t1\t10\nA2\tA2.1\nA4\tA4.1\t4\n'
+        with self.assertLogs(level='WARNING') as logs:
+            self.assertListEqual(Accession2TaxidParser._parse_block(
+                block, present), [('A1', 1), ('A4', 4)])
+        self.assertIn('1 line(s) skipped', logs.output[0])
+        block = b'accession\taccession.version\ttaxid\tgi\n' \
+            b'A1\tA1.1\t1\t10\nA2\tA2.1\t-1\t11\nA4\tA4.1\t4'
+        with self.assertLogs(level='WARNING') as logs:
+            self.assertListEqual(Accession2TaxidParser._parse_block(
+                block, present), [('A1', 1), ('A4', 4)])
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('1 line(s) skipped', logs.output[0])
+
+    @attr('parser')
+    def test_decompressor_backends(self):
+        """Check backends read the same bytes, and auto detects uncompressed
+        files"""
+        plain = os.path.join(self.testdir, 'test-acc2taxid')
+        with gzip.open(self.acc, 'rb') as f:
+            content = f.read()
+        with open(plain, 'wb') as f:
+            f.write(content)
+        try:
+            self.assertEqual(Decompressor().select(plain), 'none')
+            self.assertEqual(Decompressor('gzip').select(plain), 'none')
+            self.assertNotEqual(Decompressor().select(self.acc), 'none')
+            for backend, path in [('gzip', self.acc), ('none', plain),
+                                  ('auto', self.acc), ('auto', plain),
+                                  ('gzip', plain)]:
+                with Decompressor(backend).open(path) as f:
+                    self.assertEqual(f.readline() + f.read(), content)
+                    self.assertEqual(f.size, len(content))
+                self.assertGreater(f.throughput(), 0)
+        finally:
+            os.unlink(plain)
+        with self.assertRaises(SystemExit):
+            Decompressor('bzip2')
+        with self.assertRaises(SystemExit):
+            Decompressor('none').select(self.acc)
+
+    @attr('parser')
+    def test_decompressor_subprocess(self):
+        """Check a subprocess backend reads the file, and fails on a
+        corrupted file"""
+        commands = Decompressor.COMMANDS
+        Decompressor.COMMANDS = dict(commands, pigz=['gzip', '-d', '-c'])
+        corrupted = os.path.join(self.testdir, 'test-corrupted.gz')
+        try:
+            ap = Accession2TaxidParser(acc_file=self.acc, fast=True,
+                                       decompress='pigz')
+            with ap.decompressor.open(self.acc) as f:
+                self.assertIsNotNone(f.process)
+                content = f.read()
+            with gzip.open(self.acc, 'rb') as f:
+                self.assertEqual(content, f.read())
+            # Closed before the end of the file
+            with ap.decompressor.open(self.acc) as f:
+                f.readline()
+            # Uncompressed files are not piped to the subprocess
+            with open(corrupted, 'wb') as f:
+                f.write(content)
+            with ap.decompressor.open(corrupted) as f:
+                self.assertIsNone(f.process)
+                self.assertEqual(f.read(), content)
+            with open(corrupted, 'wb') as f:
+                f.write(gzip.compress(content)[:1000])
+            with self.assertRaises(SystemExit):
+                with ap.decompressor.open(corrupted) as f:
+                    f.read()
+        finally:
+            Decompressor.COMMANDS = commands
+            if os.path.exists(corrupted):
+                os.unlink(corrupted)
+
     @attr('parser')
     def test_accessionparser_set_accession_file_throws(self):
         """Check method throws when file is None or does not exists"""
@@ -582,3 +957,721 @@ class TestTaxadbParser(unittest.TestCase):
         """Check method returns True when correct file is set"""
         ap = Accession2TaxidParser()
         self.assertTrue(ap.set_accession_file(self.acc))
+
+
+class TestTaxaTree(unittest.TestCase):
+    """Test class for taxadb.tree and the queries relying on the tree
+    structure, against a small hand-made taxonomy"""
+
+    def setUp(self):
+        self.testdir = os.path.dirname(os.path.realpath(__file__))
+        self.testdb = os.path.join(self.testdir, 'tree_db.sqlite')
+        self.db = TaxaDB(dbtype='sqlite', dbname=self.testdb)
+        self.db.db.create_tables([Taxa])
+        Taxa.insert_many([
+            (1, 1, 'root', 'no rank'),
+            (2, 131567, 'Bacteria', 'superkingdom'),
+            (1224, 2, 'Proteobacteria', 'phylum'),
+            (562, 1224, 'Escherichia coli', 'species'),
+            (2759, 131567, 'Eukaryota', 'superkingdom'),
+            (131567, 1, 'cellular organisms', 'no rank'),
+            (7, 6, 'Azorhizobium caulinodans', 'species')],
+            fields=[Taxa.ncbi_taxid, Taxa.parent_taxid, Taxa.tax_name,
+                    Taxa.lineage_level]).execute()
+
+    def tearDown(self):
+        self.db.db.close()
+        if os.path.exists(self.testdb):
+            os.unlink(self.testdb)
+
+    @attr('tree')
+    def test_tree_load(self):
+        """Check taxa are loaded with their name, rank and parent"""
+        tree = TaxaTree.load()
+        self.assertIn(562, tree)
+        self.assertNotIn(6, tree)
+        self.assertNotIn(200000, tree)
+        self.assertEqual(len(tree), 7)
+        self.assertEqual(tree.name(562), 'Escherichia coli')
+        self.assertEqual(tree.rank(1224), 'phylum')
+        self.assertEqual(tree.parent(1224), 2)
+        self.assertIsNone(tree.name(6))
+
+    @attr('tree')
+    def test_tree_lineage(self):
+        """Check lineage stops at root and is None for broken lineages"""
+        tree = TaxaTree.load()
+        self.assertListEqual(tree.lineage(562), [562, 1224, 2, 131567])
+        self.assertListEqual(tree.lineage(1), [])
+        self.assertIsNone(tree.lineage(7))
+        self.assertIsNone(tree.lineage(6))
+
+    @attr('tree')
+    def test_tree_lineages(self):
+        """Check top-down traversal yields the same lineages"""
+        tree = TaxaTree.load()
+        lineages = dict(tree.lineages())
+        self.assertEqual(len(lineages), 6)
+        for taxid, lineage in lineages.items():
+            self.assertListEqual(lineage, tree.lineage(taxid))
+
+    @attr('tree')
+    def test_build_lineage_bulk(self):
+        """Check bulk mode builds the same table, and restores the
+        settings"""
+        build_lineage()
+        expected = list(Lineage.select().order_by(
+            Lineage.ncbi_taxid).tuples())
+        pragmas = [self.db.db.execute_sql('PRAGMA %s' % name).fetchone()[0]
+                   for name in ['synchronous', 'journal_mode', 'cache_size']]
+        settings = set_bulk_settings('sqlite')
+        self.assertEqual(self.db.db.execute_sql(
+            'PRAGMA journal_mode').fetchone()[0], 'off')
+        build_lineage(chunk=2, bulk=True)
+        restore_settings('sqlite', settings)
+        self.assertListEqual(list(Lineage.select().order_by(
+            Lineage.ncbi_taxid).tuples()), expected)
+        self.assertListEqual([
+            self.db.db.execute_sql('PRAGMA %s' % name).fetchone()[0]
+            for name in ['synchronous', 'journal_mode', 'cache_size']],
+            pragmas)
+        args = argparse.Namespace(chunk=500, bulk=False, dbtype='sqlite')
+        self.assertEqual(bulk_chunk(args, 2), 500)
+        args.bulk = True
+        self.assertEqual(bulk_chunk(args, 4), max_variables('sqlite') // 4)
+        # A chunk binds at most the maximum number of variables
+        Taxa.insert_many([
+            (taxid, 1, str(taxid), 'species') for taxid in range(
+                1000000, 1000000 + bulk_chunk(args, 4))],
+            fields=[Taxa.ncbi_taxid, Taxa.parent_taxid, Taxa.tax_name,
+                    Taxa.lineage_level]).execute()
+
+    @attr('tree')
+    def test_build_lineage(self):
+        """Check TaxID reads lineages from the Lineage table once built"""
+        build_lineage()
+        taxid = TaxID(dbtype='sqlite', dbname=self.testdb)
+        self.assertTrue(taxid.materialized)
+        self.assertEqual(Lineage.select().count(), 6)
+        self.assertListEqual(taxid.lineage_id(562), [562, 1224, 2, 131567])
+        self.assertListEqual(taxid.lineage_name(562, reverse=True), [
+            'cellular organisms', 'Bacteria', 'Proteobacteria',
+            'Escherichia coli'])
+        self.assertIsNone(taxid.lineage_id(7))
+        self.assertTrue(taxid.has_parent(562, 'Bacteria'))
+        self.assertTrue(taxid.has_parent(562, 131567))
+        self.assertFalse(taxid.has_parent(562, 562))
+        self.assertFalse(taxid.has_parent(562, 1))
+        self.assertFalse(taxid.has_parent(2759, 'Bacteria'))
+        self.assertIsNone(taxid.has_parent(7, 'Bacteria'))
+        self.assertListEqual(list(taxid.has_parent_many([562, 2759, 6], 2)),
+                             [(562, True), (2759, False), (6, None)])
+
+    @attr('tree')
+    def test_has_parent_string_taxids(self):
+        """Check taxids given as strings give the same answer per engine"""
+        walk = TaxID(dbtype='sqlite', dbname=self.testdb)
+        build_lineage()
+        intervals = TaxID(dbtype='sqlite', dbname=self.testdb)
+        self.assertFalse(walk.materialized)
+        self.assertTrue(intervals.materialized)
+        for taxid in [walk, intervals]:
+            self.assertTrue(taxid.has_parent('562', 'Bacteria'))
+            self.assertIsNone(taxid.has_parent('7', 'Bacteria'))
+            self.assertListEqual(
+                list(taxid.has_parent_many(['562', '2759', '6'], 2)),
+                [('562', True), ('2759', False), ('6', None)])
+
+    @attr('tree')
+    def test_tree_nested_sets(self):
+        """Check nested set intervals contain exactly the descendants"""
+        tree = TaxaTree.load()
+        left, right = tree.nested_sets()
+        self.assertEqual((left[1], right[1]), (1, 6))
+        self.assertEqual((left[7], right[7]), (-1, -1))
+        for taxid, lineage in tree.lineages():
+            for parent in lineage[1:]:
+                self.assertTrue(left[parent] < left[taxid] and
+                                right[taxid] <= right[parent])
+        self.assertEqual(right[2] - left[2], 2)
+
+    @attr('tree')
+    def test_lineage_id_many(self):
+        """Check lineages walked level by level match single lineages"""
+        taxid = TaxID(dbtype='sqlite', dbname=self.testdb)
+        taxids = [562, 2759, 1, 7, 6, 562]
+        lineages = list(taxid.lineage_id_many(taxids, ranks=True))
+        self.assertListEqual(lineages, [
+            (t, taxid.lineage_id(t, ranks=True)) for t in taxids])
+
+    @attr('tree')
+    def test_many_generators(self):
+        """Check the *_many methods accept generators"""
+        taxids = [562, 2759, 7]
+        name = SciName(dbtype='sqlite', dbname=self.testdb)
+        self.assertListEqual(list(name.taxid_many(
+            n for n in ['Bacteria', 'Unknown'])),
+            [('Bacteria', 2), ('Unknown', None)])
+        for kwargs in [{}, {'in_memory': True}]:
+            taxid = TaxID(dbtype='sqlite', dbname=self.testdb, **kwargs)
+            self.assertListEqual(
+                list(taxid.sci_name_many(t for t in taxids)),
+                [(t, taxid.sci_name(t)) for t in taxids])
+            self.assertListEqual(
+                list(taxid.lineage_id_many(t for t in taxids)),
+                [(t, taxid.lineage_id(t)) for t in taxids])
+            self.assertListEqual(
+                list(taxid.lineage_name_many(t for t in taxids)),
+                [(t, taxid.lineage_name(t)) for t in taxids])
+            self.assertListEqual(
+                list(taxid.has_parent_many((t for t in taxids), 2)),
+                [(t, taxid.has_parent(t, 2)) for t in taxids])
+
+    @attr('tree')
+    def test_lineage_cte(self):
+        """Check lineages from the recursive query match walked lineages"""
+        walked = TaxID(dbtype='sqlite', dbname=self.testdb)
+        taxid = TaxID(dbtype='sqlite', dbname=self.testdb, cte=True)
+        for t in [562, 2759, 1, 7, 6]:
+            self.assertEqual(taxid.lineage_name(t, ranks=True),
+                             walked.lineage_name(t, ranks=True))
+        self.assertListEqual(list(taxid.lineage_id_many([562, 7])),
+                             [(562, [562, 1224, 2, 131567]), (7, None)])
+
+    @attr('tree')
+    def test_tree_lca(self):
+        """Check lowest common ancestors of pairs and sets of taxids"""
+        tree = TaxaTree.load()
+        self.assertEqual(tree.lca(562, 2759), 131567)
+        self.assertEqual(tree.lca(562, 1224), 1224)
+        self.assertEqual(tree.lca(562, 562), 562)
+        self.assertEqual(tree.lca_many([562, 1224, 2]), 2)
+        self.assertEqual(tree.lca_many([562, 1]), 1)
+        self.assertIsNone(tree.lca(562, 7))
+        self.assertIsNone(tree.lca(562, 6))
+        self.assertIsNone(tree.lca_many([]))
+
+    @attr('tree')
+    def test_taxid_lca_tree(self):
+        """Check LCA queries don't switch other queries to memory"""
+        taxid = TaxID(dbtype='sqlite', dbname=self.testdb)
+        self.assertEqual(taxid.lca(562, 2759), 131567)
+        self.assertIsNone(taxid.tree)
+        Taxa.update(tax_name='E. coli').where(
+            Taxa.ncbi_taxid == 562).execute()
+        self.assertEqual(taxid.sci_name(562), 'E. coli')
+        memory = TaxID(dbtype='sqlite', dbname=self.testdb, in_memory=True)
+        self.assertEqual(memory.lca_many([562, 1224, 2]), 2)
+        self.assertIs(memory._lca_tree, memory.tree)
+
+    @attr('tree')
+    def test_descendants(self):
+        """Check descendants are the same from memory, table and walk"""
+        build_lineage()
+        for kwargs in [{}, {'in_memory': True}]:
+            taxid = TaxID(dbtype='sqlite', dbname=self.testdb, **kwargs)
+            self.assertListEqual(sorted(taxid.descendants(131567)),
+                                 [2, 562, 1224, 2759])
+            self.assertListEqual(
+                list(taxid.descendants(1, ranks=['superkingdom'])),
+                [2, 2759])
+            self.assertListEqual(list(taxid.descendants(562)), [])
+        Lineage.drop_table()
+        taxid = TaxID(dbtype='sqlite', dbname=self.testdb)
+        self.assertFalse(taxid.materialized)
+        self.assertListEqual(sorted(taxid.descendants(131567)),
+                             [2, 562, 1224, 2759])
+
+    @attr('tree')
+    def test_accession_in_clade(self):
+        """Check accessions of a clade are streamed"""
+        self.db.db.create_tables([Accession])
+        Accession.insert_many([('A1', 562), ('A2', 2), ('A3', 2759)],
+                              fields=[Accession.accession,
+                                      Accession.taxid]).execute()
+        accession = AccessionID(dbtype='sqlite', dbname=self.testdb)
+        self.assertListEqual(sorted(accession.in_clade(2)),
+                             [('A1', 562), ('A2', 2)])
+        build_lineage()
+        accession = AccessionID(dbtype='sqlite', dbname=self.testdb)
+        self.assertListEqual(sorted(accession.in_clade(131567)),
+                             [('A1', 562), ('A2', 2), ('A3', 2759)])
+        self.assertListEqual(list(accession.in_clade(1224)), [('A1', 562)])
+
+    @attr('tree')
+    def test_accession_lookup_chunks(self):
+        """Check lookups are chunked and missing accessions reported"""
+        self.db.db.create_tables([Accession])
+        accs = ['A%d' % i for i in range(TaxaDB.MAX_LIST + 10)]
+        Accession.insert_many([(acc, 562) for acc in accs],
+                              fields=[Accession.accession,
+                                      Accession.taxid]).execute()
+        accession = AccessionID(dbtype='sqlite', dbname=self.testdb)
+        with self.assertLogs('taxadb', level='DEBUG') as logs:
+            taxids = list(accession.taxid(iter(accs + ['missing'])))
+        self.assertEqual(len(taxids), len(accs))
+        self.assertListEqual(logs.output, [
+            'DEBUG:taxadb.accessionid.AccessionID:No taxid mapped for '
+            'accession missing',
+            'WARNING:taxadb.accessionid.AccessionID:No taxid mapped for 1 '
+            'accession(s)'])
+        names = dict(accession.sci_name(acc for acc in accs[-2:]))
+        self.assertDictEqual(names, {accs[-2]: 'Escherichia coli',
+                                     accs[-1]: 'Escherichia coli'})
+
+    @attr('tree')
+    def test_accession_lookup_bulk(self):
+        """Check temporary table join returns the same as chunked lookups"""
+        self.db.db.create_tables([Accession])
+        accs = ['A%d' % i for i in range(50)]
+        Accession.insert_many([(acc, 562) for acc in accs[:40]],
+                              fields=[Accession.accession,
+                                      Accession.taxid]).execute()
+        accession = AccessionID(dbtype='sqlite', dbname=self.testdb,
+                                bulk_threshold=10)
+        with self.assertLogs(level='WARNING') as logs:
+            lineages = list(accession.lineage_id(accs + accs[:5]))
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('for 10 accession(s)', logs.output[0])
+        self.assertListEqual(sorted(lineages), [
+            (acc, [562, 1224, 2, 131567]) for acc in sorted(accs[:40])])
+        self.assertFalse(AccessionBatch.table_exists())
+
+    @attr('tree')
+    def test_accession_lookup_bulk_side_by_side(self):
+        """Check bulk lookups iterated together don't share their input"""
+        self.db.db.create_tables([Accession])
+        first = ['A%d' % i for i in range(30)]
+        second = ['B%d' % i for i in range(30)]
+        Accession.insert_many([(acc, 562) for acc in first] +
+                              [(acc, 2759) for acc in second],
+                              fields=[Accession.accession,
+                                      Accession.taxid]).execute()
+        accession = AccessionID(dbtype='sqlite', dbname=self.testdb,
+                                bulk_threshold=10)
+        pairs = list(zip(accession.taxid(first), accession.sci_name(second)))
+        self.assertListEqual(sorted(pair[0] for pair in pairs),
+                             sorted((acc, 562) for acc in first))
+        self.assertListEqual(sorted(pair[1] for pair in pairs),
+                             sorted((acc, 'Eukaryota') for acc in second))
+        taxids = []
+        for row in accession.taxid(first):
+            if not taxids:
+                nested = list(accession.taxid(second))
+            taxids.append(row)
+        self.assertEqual(len(taxids), len(first))
+        self.assertListEqual(sorted(nested),
+                             sorted((acc, 2759) for acc in second))
+        list(accession.taxid(first))
+        tables = accession.database.execute_sql(
+            "SELECT name FROM sqlite_temp_master WHERE type = 'table'")
+        self.assertListEqual(list(tables), [])
+
+    @attr('tree')
+    def test_accession_lookup_duplicates(self):
+        """Check repeated accessions are yielded and counted missing once"""
+        self.db.db.create_tables([Accession])
+        accs = ['A%d' % i for i in range(2000)]
+        Accession.insert_many([(acc, 562) for acc in accs[:1500]],
+                              fields=[Accession.accession,
+                                      Accession.taxid]).execute()
+        requested = accs + accs[::-1] + accs[:10]
+        settings = [{}, {'bulk_threshold': 10}, {'read_only': True},
+                    {'cache_size': 5000}]
+        for kwargs in settings:
+            accession = AccessionID(dbtype='sqlite', dbname=self.testdb,
+                                    **kwargs)
+            for _ in range(2):
+                with self.assertLogs(level='WARNING') as logs:
+                    taxids = list(accession.taxid(iter(requested)))
+                self.assertListEqual(sorted(taxids), sorted(
+                    (acc, 562) for acc in accs[:1500]))
+                self.assertEqual(len(logs.output), 1)
+                self.assertIn('for 500 accession(s)', logs.output[0])
+            accession.database.close()
+
+    @attr('tree')
+    def test_lineages_shared_nodes(self):
+        """Check ancestors requested for a batch are reused by the next"""
+        nodes = {}
+        lineages = self.db._lineages([562], nodes=nodes)
+        self.assertListEqual([n[0] for n in lineages[562]],
+                             [562, 1224, 2, 131567])
+        self.assertIn(131567, nodes)
+        lineages = self.db._lineages([2759, 562, 7], nodes=nodes)
+        self.assertListEqual([n[0] for n in lineages[2759]], [2759, 131567])
+        self.assertListEqual([n[0] for n in lineages[562]],
+                             [562, 1224, 2, 131567])
+        self.assertIsNone(lineages[7])
+
+    @attr('tree')
+    def test_accession_lookup_lineages(self):
+        """Check lineages of accessions sharing taxids across chunks"""
+        self.db.db.create_tables([Accession])
+        taxids = [562, 2759, 7]
+        accs = ['A%d' % i for i in range(2100)]
+        Accession.insert_many([(acc, taxids[i % 3])
+                               for i, acc in enumerate(accs)],
+                              fields=[Accession.accession,
+                                      Accession.taxid]).execute()
+        accession = AccessionID(dbtype='sqlite', dbname=self.testdb)
+        lineages = dict(accession.lineage_name(accs))
+        self.assertEqual(len(lineages), 2100)
+        self.assertListEqual(lineages['A0'], [
+            'Escherichia coli', 'Proteobacteria', 'Bacteria',
+            'cellular organisms'])
+        self.assertListEqual(lineages['A1999'],
+                             ['Eukaryota', 'cellular organisms'])
+        self.assertIsNone(lineages['A2000'])
+
+    @attr('cache')
+    def test_taxid_cache(self):
+        """Check TaxID and SciName results are cached"""
+        taxid = TaxID(dbtype='sqlite', dbname=self.testdb, cache_size=10)
+        self.assertListEqual(taxid.lineage_id(562), [562, 1224, 2, 131567])
+        lineage = taxid.lineage_id(562, reverse=True)
+        lineage.append(1)
+        self.assertListEqual(taxid.lineage_id(562), [562, 1224, 2, 131567])
+        self.assertIsNone(taxid.sci_name(6))
+        self.assertIsNone(taxid.sci_name(6))
+        stats = taxid.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']),
+                         (3, 2, 2))
+        name = SciName(dbtype='sqlite', dbname=self.testdb, cache_size=10)
+        self.assertEqual(name.taxid('Bacteria'), 2)
+        self.assertEqual(name.taxid('Bacteria'), 2)
+        self.assertEqual(name.cache.hits, 1)
+        self.assertIsNone(TaxID(dbtype='sqlite', dbname=self.testdb).cache)
+
+    @attr('cache')
+    def test_accession_cache(self):
+        """Check accessions found in cache are not requested again"""
+        self.db.db.create_tables([Accession])
+        Accession.insert_many([('A1', 562), ('A2', 2759)],
+                              fields=[Accession.accession,
+                                      Accession.taxid]).execute()
+        accession = AccessionID(dbtype='sqlite', dbname=self.testdb,
+                                cache_size=10)
+        self.assertListEqual(list(accession.taxid(['A1'])), [('A1', 562)])
+        with self.assertLogs(level='WARNING') as logs:
+            taxids = list(accession.taxid(['A1', 'A2', 'A3']))
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('for 1 accession(s)', logs.output[0])
+        self.assertListEqual(sorted(taxids), [('A1', 562), ('A2', 2759)])
+        self.assertEqual(accession.cache.hits, 1)
+        Accession.delete().execute()
+        self.assertListEqual(list(accession.lineage_name(['A2'])), [])
+        accession.cache.invalidate('taxid')
+        self.assertListEqual(list(accession.taxid(['A1'])), [])
+
+    @attr('tree')
+    def test_bound_instances(self):
+        """Check instances query their own database side by side"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        other = os.path.join(directory, 'other_db.sqlite')
+        taxid = TaxID(dbtype='sqlite', dbname=self.testdb)
+        other_db = TaxaDB(dbtype='sqlite', dbname=other)
+        self.addCleanup(other_db.database.close)
+        # Filled through the models bound to the instance
+        other_db.database.create_tables([other_db.Taxa])
+        OtherTaxa = other_db.Taxa
+        OtherTaxa.insert_many([(1, 1, 'root', 'no rank'),
+                               (562, 1, 'Other coli', 'species')],
+                              fields=[OtherTaxa.ncbi_taxid,
+                                      OtherTaxa.parent_taxid,
+                                      OtherTaxa.tax_name,
+                                      OtherTaxa.lineage_level]).execute()
+        other_taxid = TaxID(dbtype='sqlite', dbname=other)
+        self.addCleanup(other_taxid.database.close)
+        self.addCleanup(taxid.database.close)
+        self.assertEqual(taxid.sci_name(562), 'Escherichia coli')
+        self.assertEqual(other_taxid.sci_name(562), 'Other coli')
+        self.assertListEqual(taxid.lineage_id(562), [562, 1224, 2, 131567])
+        self.assertListEqual(other_taxid.lineage_id(562), [562])
+        self.assertIsNot(taxid.Taxa, other_taxid.Taxa)
+        self.assertEqual(taxid.Taxa.get_table_name(), 'taxa')
+
+    @attr('tree')
+    def test_pooled_connections(self):
+        """Check threads check connections out of the pool and return them"""
+        taxid = TaxID(dbtype='sqlite', dbname=self.testdb, pool_size=2,
+                      stale_timeout=60)
+        self.assertIsInstance(taxid.database, PooledDatabase)
+        # Return the connection of this thread to the pool
+        taxid.database.close()
+
+        def query(ncbi_taxid):
+            with taxid.database.connection_context():
+                return taxid.sci_name(ncbi_taxid)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            names = list(executor.map(query, [562, 2759, 6] * 10))
+        self.assertListEqual(names, ['Escherichia coli', 'Eukaryota',
+                                     None] * 10)
+        self.assertLessEqual(len(taxid.database._in_use), 1)
+        with self.assertRaises(SystemExit):
+            TaxID(dbtype='sqlite', dbname=self.testdb, pool_size='many')
+
+    @attr('tree')
+    def test_read_only(self):
+        """Check read-only databases are queried but never written"""
+        self.db.db.create_tables([Accession])
+        Accession.insert_many([('A1', 562), ('A2', 2759)],
+                              fields=[Accession.accession,
+                                      Accession.taxid]).execute()
+        self.db.db.execute_sql('PRAGMA journal_mode=DELETE')
+        # A query opening the file normally keeps its journal mode
+        taxid = TaxID(dbtype='sqlite', dbname=self.testdb)
+        self.assertEqual(taxid.sci_name(562), 'Escherichia coli')
+        self.assertEqual(taxid.database.execute_sql(
+            'PRAGMA journal_mode').fetchone()[0], 'delete')
+        taxid.database.close()
+        for mode in ['read_only', 'immutable']:
+            accession = AccessionID(dbtype='sqlite', dbname=self.testdb,
+                                    bulk_threshold=1, mmap_size=2 ** 20,
+                                    sqlite_cache_size=1000, **{mode: True})
+            self.assertTrue(accession.read_only)
+            self.assertListEqual(sorted(accession.taxid(['A1', 'A2'])),
+                                 [('A1', 562), ('A2', 2759)])
+            pragmas = [accession.database.execute_sql(
+                'PRAGMA %s' % pragma).fetchone()[0] for pragma in
+                ['mmap_size', 'cache_size', 'query_only', 'journal_mode']]
+            self.assertListEqual(pragmas, [2 ** 20, -1000, 1, 'delete'])
+            with self.assertRaises(OperationalError):
+                accession.Taxa.delete().execute()
+            accession.database.close()
+            self.assertFalse(os.path.exists(self.testdb + '-wal'))
+            self.assertFalse(os.path.exists(self.testdb + '-shm'))
+        self.assertFalse(TaxID(dbtype='sqlite', dbname=self.testdb).read_only)
+        with self.assertRaises(SystemExit):
+            TaxID(dbtype='sqlite', read_only=True,
+                  dbname=os.path.join(self.testdir, 'nothing.sqlite'))
+
+    @attr('aio')
+    @unittest.skipIf(sys.version_info < (3, 6), "requires Python >= 3.6")
+    def test_async_taxid(self):
+        """Check async queries answer as TaxID, batches running concurrently"""
+        taxid = TaxID(dbtype='sqlite', dbname=self.testdb)
+        taxids = [562, 2759, 1, 7, 6]
+
+        async def queries(aiotaxid):
+            async with aiotaxid:
+                names = await asyncio.gather(
+                    *[aiotaxid.sci_name(t) for t in taxids])
+                # No async comprehensions, the module must compile on 3.5
+                lineages = []
+                async for row in aiotaxid.lineage_name_many(taxids,
+                                                            ranks=True):
+                    lineages.append(row)
+                # Awaiting while iterating does not wait for a free slot
+                parents = []
+                async for row in aiotaxid.has_parent_many(taxids, 2):
+                    parents.append((row, await aiotaxid.lineage_id(row[0])))
+                lca = await aiotaxid.lca(562, 2759)
+            return names, lineages, parents, lca
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        names, lineages, parents, lca = loop.run_until_complete(queries(
+            AsyncTaxID(dbtype='sqlite', dbname=self.testdb, concurrency=1)))
+        self.assertListEqual(names, [taxid.sci_name(t) for t in taxids])
+        self.assertListEqual(lineages, list(taxid.lineage_name_many(
+            taxids, ranks=True)))
+        self.assertListEqual(parents, [
+            (row, taxid.lineage_id(row[0]))
+            for row in taxid.has_parent_many(taxids, 2)])
+        self.assertEqual(lca, 131567)
+        with self.assertRaises(SystemExit):
+            AsyncTaxID(dbtype='sqlite', dbname=self.testdb, concurrency=0)
+
+    @attr('aio')
+    @unittest.skipIf(sys.version_info < (3, 6), "requires Python >= 3.6")
+    def test_async_accession(self):
+        """Check async accession lookups, stopped early or not"""
+        self.db.db.create_tables([Accession])
+        accs = ['A%d' % i for i in range(2500)]
+        Accession.insert_many([(acc, 562) for acc in accs],
+                              fields=[Accession.accession,
+                                      Accession.taxid]).execute()
+
+        async def queries(accession, name):
+            first = None
+            # Bulk lookup through a temporary table, dropped on early stop
+            async for row in accession.taxid(accs):
+                first = row
+                break
+            taxids, names = [], []
+            async for row in accession.taxid(accs):
+                taxids.append(row)
+            async for row in name.taxid_many(['bacteria', 'Eukaryota'],
+                                             case_sensitive=False):
+                names.append(row)
+            return first, taxids, names
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        first, taxids, names = loop.run_until_complete(queries(
+            AsyncAccessionID(dbtype='sqlite', dbname=self.testdb,
+                             bulk_threshold=100),
+            AsyncSciName(dbtype='sqlite', dbname=self.testdb)))
+        self.assertEqual(first[1], 562)
+        self.assertEqual(sorted(taxids), sorted((acc, 562) for acc in accs))
+        self.assertListEqual(names, [('bacteria', 2), ('Eukaryota', 2759)])
+
+    @attr('names')
+    def test_sciname_taxid_many(self):
+        """Check names are resolved exactly or case-insensitively"""
+        Taxa.insert_many([(3, 1, 'bacteria', 'no rank')],
+                         fields=[Taxa.ncbi_taxid, Taxa.parent_taxid,
+                                 Taxa.tax_name,
+                                 Taxa.lineage_level]).execute()
+        names = ['Bacteria', 'escherichia COLI', 'bacteria', 'Unknown']
+        name = SciName(dbtype='sqlite', dbname=self.testdb)
+        self.assertListEqual(list(name.taxid_many(names)), [
+            ('Bacteria', 2), ('escherichia COLI', None), ('bacteria', 3),
+            ('Unknown', None)])
+        self.assertListEqual(
+            list(name.taxid_many(names, case_sensitive=False)), [
+                ('Bacteria', 2), ('escherichia COLI', 562), ('bacteria', 3),
+                ('Unknown', None)])
+        self.assertEqual(name.taxid('BACTERIA', case_sensitive=False), 2)
+        self.assertIsNone(name.taxid('BACTERIA'))
+
+    @attr('names')
+    def test_trigrams(self):
+        """Check trigrams are computed as pg_trgm"""
+        self.assertSetEqual(trigrams('E. coli'), {
+            '  e', ' e ', '  c', ' co', 'col', 'oli', 'li '})
+        self.assertEqual(similarity('Bacteria', 'bacteria'), 1.0)
+        self.assertEqual(similarity('Bacteria', ''), 0.0)
+        self.assertGreater(similarity('Escherichia coli', 'Escherichia'),
+                           similarity('Escherichia coli', 'Eukaryota'))
+
+    @attr('names')
+    def test_sciname_search(self):
+        """Check misspelled names are found with or without trigram index"""
+        name = SciName(dbtype='sqlite', dbname=self.testdb)
+        results = name.search('Escherichia colli')
+        self.assertEqual(results[0][:2], (562, 'Escherichia coli'))
+        self.assertIn('taxa', name.trigram_indexes)
+        self.assertListEqual(name.search('Eukaryota', threshold=1.0),
+                             [(2759, 'Eukaryota', 1.0)])
+        build_trigram('sqlite')
+        name = SciName(dbtype='sqlite', dbname=self.testdb)
+        self.assertListEqual(name.search('Proteobacter', limit=1),
+                             [(1224, 'Proteobacteria',
+                               similarity('Proteobacter', 'Proteobacteria'))])
+        self.assertDictEqual(name.trigram_indexes, {})
+        self.assertListEqual(name.search('zz'), [])
+
+    @attr('names')
+    def test_sciname_all_names(self):
+        """Check names of any class are resolved, scientific names first"""
+        names = os.path.join(self.testdir, 'test-names.dmp')
+        build_names(TaxaDumpParser(names_file=names), 'sqlite')
+        self.assertTrue(Names.has_index(name='names_lower_name'))
+        name = SciName(dbtype='sqlite', dbname=self.testdb)
+        self.assertTrue(name.synonyms)
+        self.assertIsNone(name.taxid('eubacteria'))
+        self.assertEqual(name.taxid('eubacteria', all_names=True), 2)
+        self.assertListEqual(list(name.taxid_many(
+            ['bacteria', 'AZOTIRHIZOBIUM caulinodans', 'all', 'Unknown'],
+            case_sensitive=False, all_names=True)), [
+            ('bacteria', 2), ('AZOTIRHIZOBIUM caulinodans', 7), ('all', 1),
+            ('Unknown', None)])
+        results = name.search('Azotirhizobium caulinodan', all_names=True)
+        self.assertEqual(results[0][:2], (7, 'Azotirhizobium caulinodans'))
+        self.assertEqual(len(set(result[0] for result in results)),
+                         len(results))
+
+    @attr('tree')
+    def test_compiled_taxid(self):
+        """Check a compiled taxonomy answers as TaxID"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        TaxaTree.load().save(directory)
+        compiled = CompiledTaxID(directory)
+        self.assertIsInstance(compiled.tree.parents, memoryview)
+        taxid = TaxID(dbtype='sqlite', dbname=self.testdb)
+        memory = TaxID(dbtype='sqlite', dbname=self.testdb, in_memory=True)
+        for ncbi_taxid in [1, 2, 6, 7, 562, 2759, 131567, 200000]:
+            self.assertEqual(compiled.sci_name(ncbi_taxid),
+                             taxid.sci_name(ncbi_taxid))
+            self.assertEqual(compiled.lineage_name(ncbi_taxid, ranks=True),
+                             taxid.lineage_name(ncbi_taxid, ranks=True))
+            self.assertEqual(compiled.lineage_id(ncbi_taxid, reverse=True),
+                             taxid.lineage_id(ncbi_taxid, reverse=True))
+            self.assertEqual(compiled.has_parent(ncbi_taxid, 'Bacteria'),
+                             taxid.has_parent(ncbi_taxid, 'Bacteria'))
+            self.assertListEqual(sorted(compiled.descendants(ncbi_taxid)),
+                                 sorted(memory.descendants(ncbi_taxid)))
+        self.assertListEqual(list(compiled.sci_name_many([562, 6])),
+                             [(562, 'Escherichia coli'), (6, None)])
+        self.assertEqual(compiled.lca(562, 2759), 131567)
+        self.assertEqual(compiled.lca_many([562, 1224, 2]), 2)
+        self.assertEqual(compiled.lca(562, 1), 1)
+        self.assertIsNone(compiled.lca(562, 7))
+        self.assertIsNone(compiled.lca_many([]))
+
+    @attr('tree')
+    def test_compiled_open_fails(self):
+        """Check opening a missing compiled taxonomy exits"""
+        with self.assertRaises(SystemExit):
+            CompiledTaxID(os.path.join(self.testdir, 'nothing'))
+
+    @attr('tree')
+    def test_compiled_accessions(self):
+        """Check compiled accessions answer as AccessionID.taxid"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.db.db.create_tables([Accession])
+        accs = ['B2', 'A10', 'A1', 'A2.1', 'AB1']
+        Accession.insert_many([(acc, 562 + i) for i, acc in enumerate(accs)],
+                              fields=[Accession.accession,
+                                      Accession.taxid]).execute()
+        compile_accessions(directory, 'sqlite')
+        compiled = CompiledAccessionID(directory)
+        self.assertEqual(len(compiled), 5)
+        self.assertEqual(compiled.width, 4)
+        with self.assertLogs(level='WARNING') as logs:
+            taxids = list(compiled.taxid(['A1', 'A', 'AB1', 'B2', 'A10',
+                                          'A2.1', 'A2.10', 'C']))
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('for 3 accession(s)', logs.output[0])
+        self.assertListEqual(taxids, [('A1', 564), ('AB1', 566),
+                                      ('B2', 562), ('A10', 563),
+                                      ('A2.1', 565)])
+
+    @attr('tree')
+    def test_compiled_accessions_unsorted(self):
+        """Check unsorted accessions are not compiled"""
+        path = os.path.join(self.testdir, CompiledAccessionID.FILE)
+        self.addCleanup(os.unlink, path)
+        self.assertEqual(CompiledAccessionID.write(
+            path, [('A1', 1), ('A2', 2)], 2), 2)
+        with self.assertRaises(SystemExit):
+            CompiledAccessionID.write(path, [('A2', 2), ('A1', 1)], 2)
+        with self.assertRaises(SystemExit):
+            CompiledAccessionID.write(path, [('A10', 2)], 2)
+
+    @attr('bloom')
+    def test_accession_bloom(self):
+        """Check accessions absent from the Bloom filter are not requested"""
+        self.db.db.create_tables([Accession])
+        Accession.insert_many([('A1', 562), ('A2', 2759)],
+                              fields=[Accession.accession,
+                                      Accession.taxid]).execute()
+        path = self.testdb + '.bloom'
+        self.addCleanup(os.unlink, path)
+        build_bloom(path, 'sqlite')
+        accession = AccessionID(dbtype='sqlite', dbname=self.testdb,
+                                bloom=path)
+        self.assertEqual(len(accession.bloom), 2)
+        Accession.insert_many([('A3', 562)], fields=[
+            Accession.accession, Accession.taxid]).execute()
+        with self.assertLogs(level='WARNING') as logs:
+            taxids = list(accession.taxid(['A1', 'A2', 'A3']))
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('for 1 accession(s)', logs.output[0])
+        self.assertListEqual(sorted(taxids), [('A1', 562), ('A2', 2759)])
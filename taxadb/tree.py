@@ -0,0 +1,494 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import mmap
+import json
+import logging
+
+from array import array
+
+from taxadb.schema import Taxa
+
+
+class TaxaTree(object):
+
+    """In-memory taxonomy tree
+
+    Hold the whole `Taxa` table as compact arrays indexed by taxid, so that
+        names, ranks and lineages are resolved without querying the database.
+        Taxids missing from the table have a parent set to -1.
+
+    Lowest common ancestor queries use an Euler tour of the tree with a range
+        minimum query structure (per-block prefix and suffix minima, and a
+        sparse table over blocks), built on first use.
+
+    A tree can be compiled to flat binary files with `save`, and opened
+        back with `open`, which memory-maps them: opening costs no parsing,
+        and processes opening the same files share their pages through the
+        OS page cache. Compiled trees also hold the depth of each taxon and
+        the children index, so that lowest common ancestor and descendants
+        queries need no warmup (lowest common ancestors are then found in
+        time proportional to the depth of the taxa, see `lca_many`).
+
+    Arrays may be `array.array` or `memoryview` objects.
+
+    Args:
+        parents (:obj:`array.array`): Parent taxid of each taxid
+        ranks (:obj:`array.array`): Rank code of each taxid
+        rank_names (:obj:`list`): Rank names, indexed by rank code
+        offsets (:obj:`array.array`): Start offset of each taxid name in
+            `names`. Contains one more item than `parents`
+        names (:obj:`bytes`): Concatenated utf-8 encoded scientific names
+        depths (:obj:`array.array`): Depth of each taxid, the root having a
+            depth of 0, -1 if not connected to the root. Default None, not
+            used
+        children (:obj:`tuple`): Children index, as returned by
+            `children`. Default None, built on first use
+
+    Attributes:
+        LCA_BLOCK (:obj:`int`): Block size of the range minimum query
+            structure used for lowest common ancestor queries
+        ARRAYS (:obj:`dict`): Type code of the arrays of a compiled tree,
+            by file name
+        HEADER (:obj:`str`): File name of the header of a compiled tree
+
+    """
+
+    LCA_BLOCK = 32
+    ARRAYS = {'parents': 'i', 'ranks': 'B', 'depths': 'i', 'offsets': 'q',
+              'children_offsets': 'q', 'children': 'i', 'names': 'B'}
+    HEADER = 'taxonomy.json'
+
+    def __init__(self, parents, ranks, rank_names, offsets, names,
+                 depths=None, children=None):
+        self.parents = parents
+        self.ranks = ranks
+        self.rank_names = rank_names
+        self.offsets = offsets
+        self.names = names
+        self.depths = depths
+        self._children = children
+        self._euler = None
+
+    @property
+    def logger(self):
+        component = "{}.{}".format(type(self).__module__, type(self).__name__)
+        return logging.getLogger(component)
+
+    @classmethod
+    def load(cls, taxa=Taxa):
+        """Load the taxonomy tree from the `Taxa` table
+
+        Args:
+            taxa (:obj:`pw.Model`): Model of the `Taxa` table, e.g. bound to
+                another database (see `taxadb.schema.bind_models`). Default
+                `taxadb.schema.Taxa`
+
+        Returns:
+            :obj:`TaxaTree`
+        """
+        parents = array('i')
+        ranks = array('B')
+        offsets = array('q', [0])
+        names = bytearray()
+        rank_codes = {}
+        total = 0
+        query = taxa.select(taxa.ncbi_taxid, taxa.parent_taxid, taxa.tax_name,
+                            taxa.lineage_level).order_by(taxa.ncbi_taxid)
+        for taxid, parent, name, rank in query.tuples().iterator():
+            # Fill the gap between two consecutive taxids with empty nodes
+            while len(parents) < taxid:
+                parents.append(-1)
+                ranks.append(0)
+                offsets.append(len(names))
+            if rank not in rank_codes:
+                rank_codes[rank] = len(rank_codes)
+            parents.append(parent)
+            ranks.append(rank_codes[rank])
+            names += name.encode()
+            offsets.append(len(names))
+            total += 1
+        rank_names = sorted(rank_codes, key=rank_codes.get)
+        tree = cls(parents, ranks, rank_names, offsets, bytes(names))
+        tree.logger.debug("Loaded %d taxa in memory" % total)
+        return tree
+
+    def save(self, directory):
+        """Compile the tree to flat binary files
+
+        Each array is written to a `.bin` file of `directory`, in native
+            byte order, and rank names to a JSON header.
+
+        Args:
+            directory (:obj:`str`): Output directory, created if needed
+        """
+        os.makedirs(directory, exist_ok=True)
+        depths = array('i', [-1]) * len(self.parents)
+        for taxid, depth in self.preorder():
+            depths[taxid] = depth
+        if self._children is None:
+            self._children = self.children()
+        children_offsets, children = self._children
+        arrays = {'parents': self.parents, 'ranks': self.ranks,
+                  'depths': depths, 'offsets': self.offsets,
+                  'children_offsets': children_offsets,
+                  'children': children, 'names': self.names}
+        for name, values in arrays.items():
+            with open(os.path.join(directory, name + '.bin'), 'wb') as f:
+                f.write(memoryview(values).cast('B'))
+        header = {'byteorder': sys.byteorder, 'size': len(self.parents),
+                  'rank_names': self.rank_names,
+                  'arrays': TaxaTree.ARRAYS}
+        with open(os.path.join(directory, TaxaTree.HEADER), 'w') as f:
+            json.dump(header, f)
+        self.logger.debug("Compiled %d taxids to %s"
+                          % (len(self.parents), directory))
+
+    @classmethod
+    def open(cls, directory):
+        """Open a tree compiled with `save`
+
+        Files are memory-mapped read-only, nothing is loaded in memory.
+
+        Args:
+            directory (:obj:`str`): Directory of the compiled tree
+
+        Returns:
+            :obj:`TaxaTree`
+
+        Raises:
+            SystemExit: If the header is missing, or the tree was compiled
+                on a platform of another byte order
+        """
+        logger = logging.getLogger(__name__)
+        try:
+            with open(os.path.join(directory, TaxaTree.HEADER)) as f:
+                header = json.load(f)
+        except (OSError, ValueError) as err:
+            logger.error("Can't open compiled taxonomy: %s" % str(err))
+            sys.exit(1)
+        if header['byteorder'] != sys.byteorder or \
+                header['arrays'] != TaxaTree.ARRAYS:
+            logger.error("Compiled taxonomy %s is not compatible with this "
+                         "platform, compile it again" % directory)
+            sys.exit(1)
+        arrays = {}
+        for name, typecode in TaxaTree.ARRAYS.items():
+            with open(os.path.join(directory, name + '.bin'), 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    arrays[name] = array(typecode)
+                    continue
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            arrays[name] = memoryview(data).cast(typecode)
+        return cls(arrays['parents'], arrays['ranks'], header['rank_names'],
+                   arrays['offsets'], arrays['names'],
+                   depths=arrays['depths'],
+                   children=(arrays['children_offsets'],
+                             arrays['children']))
+
+    def __contains__(self, taxid):
+        try:
+            taxid = int(taxid)
+        except (TypeError, ValueError):
+            return False
+        return 0 <= taxid < len(self.parents) and self.parents[taxid] != -1
+
+    def __len__(self):
+        return sum(1 for parent in self.parents if parent != -1)
+
+    def parent(self, taxid):
+        """Get the parent taxid of a taxid, None if taxid not found"""
+        if taxid not in self:
+            return None
+        return self.parents[int(taxid)]
+
+    def rank(self, taxid):
+        """Get the rank of a taxid, None if taxid not found"""
+        if taxid not in self:
+            return None
+        return self.rank_names[self.ranks[int(taxid)]]
+
+    def name(self, taxid):
+        """Get the scientific name of a taxid, None if taxid not found"""
+        if taxid not in self:
+            return None
+        taxid = int(taxid)
+        start, end = self.offsets[taxid], self.offsets[taxid + 1]
+        return bytes(self.names[start:end]).decode()
+
+    def lineage(self, taxid):
+        """Get the taxids from `taxid` up to the root, root excluded
+
+        Args:
+            taxid (:obj:`int`): a taxid
+
+        Returns:
+            list: taxids, None if taxid or one of its parents not found
+        """
+        if taxid not in self:
+            return None
+        lineage = []
+        parents = self.parents
+        size = len(parents)
+        taxid = int(taxid)
+        parent = parents[taxid]
+        while parent != taxid:
+            lineage.append(taxid)
+            if not 0 <= parent < size or parents[parent] == -1:
+                return None
+            taxid, parent = parent, parents[parent]
+        return lineage
+
+    def children(self):
+        """Build the index of children of each taxid
+
+        Returns:
+            tuple: (offsets, children) arrays. Children of a taxid `t` are
+                `children[offsets[t]:offsets[t + 1]]`, sorted by taxid
+        """
+        size = len(self.parents)
+        offsets = array('q', bytes(8 * (size + 1)))
+        for taxid, parent in enumerate(self.parents):
+            if parent != taxid and 0 <= parent < size:
+                offsets[parent + 1] += 1
+        for i in range(1, size + 1):
+            offsets[i] += offsets[i - 1]
+        children = array('i', bytes(4 * offsets[size]))
+        fill = array('q', offsets)
+        for taxid, parent in enumerate(self.parents):
+            if parent != taxid and 0 <= parent < size:
+                children[fill[parent]] = taxid
+                fill[parent] += 1
+        return offsets, children
+
+    def preorder(self):
+        """Walk the tree depth first, from the root down
+
+        Taxa not connected to the root (e.g. whose parent is missing) are not
+            visited.
+
+        Yields:
+            tuple: (taxid, depth), the root having a depth of 0
+        """
+        offsets, children = self.children()
+        roots = [taxid for taxid, parent in enumerate(self.parents)
+                 if parent == taxid]
+        stack = [(root, 0) for root in reversed(roots)]
+        while stack:
+            taxid, depth = stack.pop()
+            yield taxid, depth
+            for i in range(offsets[taxid + 1] - 1, offsets[taxid] - 1, -1):
+                stack.append((children[i], depth + 1))
+
+    def lineages(self):
+        """Compute the lineage of every taxon in a single top-down traversal
+
+        Yields:
+            tuple: (taxid, lineage), lineage being the list of taxids from
+                `taxid` up to the root, root excluded (as `lineage`)
+        """
+        path = []
+        for taxid, depth in self.preorder():
+            del path[depth:]
+            path.append(taxid)
+            yield taxid, path[:0:-1]
+
+    def descendants(self, taxid):
+        """Walk the subtree of a taxid, depth first
+
+        Args:
+            taxid (:obj:`int`): a taxid
+
+        Yields:
+            int: taxids of all descendants of `taxid`, `taxid` excluded
+        """
+        if taxid not in self:
+            return
+        if self._children is None:
+            self._children = self.children()
+        offsets, children = self._children
+        stack = list(reversed(children[offsets[int(taxid)]:
+                                       offsets[int(taxid) + 1]]))
+        while stack:
+            taxid = stack.pop()
+            yield taxid
+            stack.extend(reversed(children[offsets[taxid]:
+                                           offsets[taxid + 1]]))
+
+    def nested_sets(self):
+        """Number taxa with nested set intervals
+
+        Taxa are numbered in depth-first pre-order, starting at 1. The
+            interval of a taxon spans the numbers of all its descendants, so
+            that `a` is an ancestor of `b` if `left[a] < left[b]` and
+            `right[b] <= right[a]`.
+
+        Returns:
+            tuple: (left, right) arrays indexed by taxid, -1 for taxa not
+                connected to the root
+        """
+        order = array('i', (taxid for taxid, _ in self.preorder()))
+        left = array('i', [-1]) * len(self.parents)
+        right = array('i', [-1]) * len(self.parents)
+        sizes = array('i', bytes(4 * len(self.parents)))
+        for number, taxid in enumerate(order, 1):
+            left[taxid] = number
+        for taxid in reversed(order):
+            sizes[taxid] += 1
+            parent = self.parents[taxid]
+            if parent != taxid:
+                sizes[parent] += sizes[taxid]
+        for taxid in order:
+            right[taxid] = left[taxid] + sizes[taxid] - 1
+        return left, right
+
+    def lca(self, taxid1, taxid2):
+        """Get the lowest common ancestor of two taxids
+
+        Args:
+            taxid1 (:obj:`int`): a taxid
+            taxid2 (:obj:`int`): a taxid
+
+        Returns:
+            int: lowest common ancestor taxid, None if a taxid is not found
+                or not connected to the root
+        """
+        return self.lca_many([taxid1, taxid2])
+
+    def lca_many(self, taxids):
+        """Get the lowest common ancestor of a set of taxids
+
+        The lowest common ancestor of a set of taxa is the one of the first
+            and last visited taxa in the Euler tour, found in constant time
+            once the tour is built (on first call). Trees holding `depths`
+            (compiled trees) build no tour: lineages are climbed up to the
+            common ancestor, in time proportional to the depth of the taxa.
+
+        Args:
+            taxids (:obj:`list`): a list of taxids
+
+        Returns:
+            int: lowest common ancestor taxid, None if `taxids` is empty or
+                one taxid is not found or not connected to the root
+        """
+        if self.depths is not None:
+            return self._climb_lca(taxids)
+        if self._euler is None:
+            self._build_lca()
+        first = self._first
+        start = end = None
+        for taxid in taxids:
+            if taxid not in self or first[int(taxid)] == -1:
+                return None
+            position = first[int(taxid)]
+            if start is None or position < start:
+                start = position
+            if end is None or position > end:
+                end = position
+        if start is None:
+            return None
+        ancestor = self._euler[self._range_min(start, end)]
+        return ancestor if ancestor != -1 else None
+
+    def _climb_lca(self, taxids):
+        """Get the lowest common ancestor of taxids by climbing up from each
+        of them, using `depths` (see `lca_many`)"""
+        parents, depths = self.parents, self.depths
+        ancestor = None
+        for taxid in taxids:
+            if taxid not in self or depths[int(taxid)] == -1:
+                return None
+            taxid = int(taxid)
+            if ancestor is None:
+                ancestor = taxid
+                continue
+            while depths[ancestor] > depths[taxid]:
+                ancestor = parents[ancestor]
+            while depths[taxid] > depths[ancestor]:
+                taxid = parents[taxid]
+            while ancestor != taxid:
+                if depths[ancestor] == 0:
+                    # Taxa under different roots
+                    return None
+                ancestor, taxid = parents[ancestor], parents[taxid]
+        return ancestor
+
+    def _build_lca(self):
+        """Build the Euler tour and range minimum query structures"""
+        offsets, children = self.children()
+        euler = array('i')
+        depths = array('i')
+        first = array('i', [-1]) * len(self.parents)
+        roots = [taxid for taxid, parent in enumerate(self.parents)
+                 if parent == taxid]
+        for root in roots:
+            if len(euler):
+                # Separate the trees of several roots with a virtual node
+                euler.append(-1)
+                depths.append(-1)
+            first[root] = len(euler)
+            euler.append(root)
+            depths.append(0)
+            stack = [[root, offsets[root]]]
+            while stack:
+                node, child = stack[-1]
+                if child < offsets[node + 1]:
+                    stack[-1][1] += 1
+                    child = children[child]
+                    first[child] = len(euler)
+                    euler.append(child)
+                    depths.append(len(stack))
+                    stack.append([child, offsets[child]])
+                else:
+                    stack.pop()
+                    if stack:
+                        euler.append(stack[-1][0])
+                        depths.append(len(stack) - 1)
+        # Position of the minimum depth from the start of its block, and up
+        # to the end of its block
+        size = len(euler)
+        block = TaxaTree.LCA_BLOCK
+        prefix = array('i', range(size))
+        suffix = array('i', range(size))
+        for i in range(size):
+            if i % block and depths[prefix[i - 1]] < depths[i]:
+                prefix[i] = prefix[i - 1]
+        for i in range(size - 2, -1, -1):
+            if (i + 1) % block and depths[suffix[i + 1]] < depths[i]:
+                suffix[i] = suffix[i + 1]
+        # Sparse table over the minimum of each block
+        sparse = [array('i', (prefix[min(start + block, size) - 1]
+                              for start in range(0, size, block)))]
+        width = 1
+        while 2 * width <= len(sparse[0]):
+            previous = sparse[-1]
+            level = array('i', previous[:len(previous) - width])
+            for i in range(len(level)):
+                if depths[previous[i + width]] < depths[level[i]]:
+                    level[i] = previous[i + width]
+            sparse.append(level)
+            width *= 2
+        self._depths = depths
+        self._first = first
+        self._prefix = prefix
+        self._suffix = suffix
+        self._sparse = sparse
+        self._euler = euler
+
+    def _range_min(self, start, end):
+        """Get the position of the minimum depth in the Euler tour between
+        `start` and `end` (included)"""
+        depths = self._depths
+        block = TaxaTree.LCA_BLOCK
+        start_block, end_block = start // block, end // block
+        if start_block == end_block:
+            return min(range(start, end + 1), key=depths.__getitem__)
+        candidates = [self._suffix[start], self._prefix[end]]
+        if end_block - start_block > 1:
+            level = (end_block - start_block - 1).bit_length() - 1
+            candidates.append(self._sparse[level][start_block + 1])
+            candidates.append(
+                self._sparse[level][end_block - (1 << level)])
+        return min(candidates, key=depths.__getitem__)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+import logging
+
+from array import array
+from collections import Counter
+
+from taxadb.schema import Taxa
+
+# Trigram indexes built by `taxadb create --trigram`, by indexed table: a
+# FTS5 table with SQLite, a pg_trgm index with PostgreSQL
+FTS_TABLES = {'taxa': 'taxa_trigram', 'names': 'names_trigram'}
+PG_INDEXES = {'taxa': 'taxa_tax_name_trgm', 'names': 'names_name_trgm'}
+
+
+def trigrams(text):
+    """Split a text into trigrams
+
+    As PostgreSQL pg_trgm, the text is lowercased and split into words of
+        alphanumeric characters. Each word is padded with two spaces before
+        and one space after.
+
+    Args:
+        text (:obj:`str`): text to split
+
+    Returns:
+        set: trigrams of `text`
+    """
+    grams = set()
+    for word in re.findall(r'[^\W_]+', text.lower()):
+        word = '  ' + word + ' '
+        for i in range(len(word) - 2):
+            grams.add(word[i:i + 3])
+    return grams
+
+
+def similarity(text1, text2):
+    """Get the trigram similarity of two texts
+
+    Args:
+        text1 (:obj:`str`): a text
+        text2 (:obj:`str`): a text
+
+    Returns:
+        float: number of shared trigrams over number of distinct trigrams,
+            between 0 and 1
+    """
+    grams1, grams2 = trigrams(text1), trigrams(text2)
+    if not grams1 or not grams2:
+        return 0.0
+    return len(grams1 & grams2) / len(grams1 | grams2)
+
+
+class TrigramIndex(object):
+
+    """In-memory trigram inverted index of scientific names
+
+    Fallback of `taxadb.names.SciName.search` for databases without a
+        trigram index (MySQL, or SQLite without FTS5 trigram tokenizer).
+        Each trigram maps to the taxids with a name containing it.
+
+    """
+
+    def __init__(self):
+        self.postings = {}
+
+    @property
+    def logger(self):
+        component = "{}.{}".format(type(self).__module__, type(self).__name__)
+        return logging.getLogger(component)
+
+    @classmethod
+    def load(cls, column=Taxa.tax_name):
+        """Build the index from a table
+
+        Args:
+            column (:obj:`pw.Field`): Column holding the names, of a table
+                with a `ncbi_taxid` column. Default `Taxa.tax_name`
+
+        Returns:
+            :obj:`TrigramIndex`
+        """
+        index = cls()
+        total = 0
+        query = column.model.select(column.model.ncbi_taxid,
+                                    column).order_by(column.model.ncbi_taxid)
+        for taxid, name in query.tuples().iterator():
+            index.add(taxid, name)
+            total += 1
+        index.logger.debug("Indexed trigrams of %d names" % total)
+        return index
+
+    def add(self, taxid, name):
+        """Index a name
+
+        Names of a taxid must be added in a row.
+
+        Args:
+            taxid (:obj:`int`): taxid of the name
+            name (:obj:`str`): a name
+        """
+        for gram in trigrams(name):
+            if gram not in self.postings:
+                self.postings[gram] = array('i')
+            postings = self.postings[gram]
+            # Several names of a taxid are added in a row
+            if not postings or postings[-1] != taxid:
+                postings.append(taxid)
+
+    def candidates(self, name, limit):
+        """Get the taxids sharing the most trigrams with a name
+
+        Args:
+            name (:obj:`str`): a name
+            limit (:obj:`int`): maximum number of candidates
+
+        Returns:
+            list: taxids, most shared trigrams first
+        """
+        counts = Counter()
+        for gram in trigrams(name):
+            counts.update(self.postings.get(gram, ()))
+        return [taxid for taxid, _ in counts.most_common(limit)]
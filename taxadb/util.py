@@ -5,6 +5,8 @@ import sys
 import hashlib
 import logging
 
+from itertools import islice
+
 
 def md5_check(file, block_size=256*128):
     """Check the md5 of files large or small
@@ -29,3 +31,92 @@ def md5_check(file, block_size=256*128):
         sys.exit(1)
     else:
         logger.info('Checking md5 of %s: OK' % file)
+
+
+def chunked(iterable, size):
+    """Split an iterable into lists of at most `size` elements
+
+    Args:
+        iterable (iterable): elements to split
+        size (int): maximum number of elements per chunk
+
+    Yields:
+        list: next chunk of elements
+    """
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def unique(iterable):
+    """Drop repeated elements of an iterable, keeping the first ones
+
+    Args:
+        iterable (iterable): hashable elements
+
+    Yields:
+        element: next element not seen before
+    """
+    seen = set()
+    for element in iterable:
+        if element not in seen:
+            seen.add(element)
+            yield element
+
+
+def stream(query, dbtype, private=False):
+    """Iterate over the rows of a query without caching them
+
+    With PostgreSQL, rows are fetched in batches through a server-side
+        (named) cursor. With MySQL, they are read one at a time through an
+        unbuffered cursor (`SSCursor` of the driver) of a dedicated
+        connection, as a connection can't run other queries until all the
+        rows of such a cursor are read. A query reading tables private to
+        its connection (`private`, e.g. a temporary table) can't be run on
+        another one, so its rows are buffered by the driver with MySQL.
+        With SQLite, rows are read from the database as they are iterated.
+
+    Args:
+        query (:obj:`pw.SelectQuery`): query to run
+        dbtype (:obj:`str`): type of the database
+        private (:obj:`bool`): Query reads tables private to its
+            connection. Default False
+
+    Returns:
+        iterator: query rows
+    """
+    if dbtype == 'postgres':
+        from playhouse.postgres_ext import ServerSide
+        return ServerSide(query)
+    if dbtype == 'mysql' and not private:
+        return _unbuffered(query)
+    return query.iterator()
+
+
+def _unbuffered(query):
+    """Iterate over the rows of a MySQL query with an unbuffered cursor
+
+    Args:
+        query (:obj:`pw.SelectQuery`): query to run
+
+    Yields:
+        query rows
+    """
+    # Driver module used by peewee (pymysql or MySQLdb)
+    from peewee import mysql
+    database = query._database
+    connection = mysql.connect(db=database.database,
+                               **database.connect_params)
+    try:
+        cursor = connection.cursor(mysql.cursors.SSCursor)
+        try:
+            sql, params = query.sql()
+            cursor.execute(sql, params)
+            for row in query._get_cursor_wrapper(cursor).iterator():
+                yield row
+        finally:
+            cursor.close()
+    finally:
+        connection.close()